@@ -5,27 +5,151 @@
 
 import sys
 import os
+import io
 import json
 import re
 import argparse
+import contextlib
 import traceback
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 
 #sys.path.append('./')
 
-from rdebej import dictionary
+from rdebej import dictionary, bundle
+
+# Parsed CSDL documents shared by every dictionary generated in this process
+schema_set = None
+
+# Records, per output folder, what each dictionary was generated from so unchanged dictionaries can be skipped
+MANIFEST_FILENAME = '.dictionary_manifest.json'
+
+
+def init_schema_set(cache_dir):
+    global schema_set
+    schema_set = dictionary.SchemaSet(cache_dir)
+
+
+def write_file(filename, contents, mode):
+    # leave byte-identical files untouched
+    if os.path.isfile(filename):
+        with open(filename, 'r' + mode[1:]) as file:
+            if file.read() == contents:
+                return
+
+    # write to a temporary file first so an interrupted run never leaves a truncated dictionary behind
+    with open(filename + '.tmp', mode) as file:
+        file.write(contents)
+    os.replace(filename + '.tmp', filename)
 
 
 def write_map_file(filename, schema_dictionary):
-    with open(filename, 'w') as file:
-        sys.stdout = file
-        dictionary.print_table_data(
-            [["Row", "Sequence#", "Format", "Flags", "Field String", "Child Count", "Offset"]]
-            +
-            schema_dictionary.dictionary)
+    map_contents = io.StringIO()
+    sys.stdout = map_contents
+    dictionary.print_table_data(
+        [["Row", "Sequence#", "Format", "Flags", "Field String", "Child Count", "Offset"]]
+        +
+        schema_dictionary.dictionary)
+
+    dictionary.print_dictionary_summary(schema_dictionary.dictionary,
+                                        schema_dictionary.dictionary_byte_array)
+    sys.stdout = sys.__stdout__
+    write_file(filename, map_contents.getvalue(), 'w')
+
+
+def write_binary_file(filename, byte_array):
+    write_file(filename, bytes(byte_array), 'wb')
+
+
+def load_manifest(dir_to_save):
+    try:
+        with open(os.path.join(dir_to_save, MANIFEST_FILENAME)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(dir_to_save, manifest):
+    if not os.path.exists(dir_to_save):
+        os.makedirs(dir_to_save)
+    write_file(os.path.join(dir_to_save, MANIFEST_FILENAME), json.dumps(manifest, indent=1, sort_keys=True), 'w')
 
-        dictionary.print_dictionary_summary(schema_dictionary.dictionary,
-                                            schema_dictionary.dictionary_byte_array)
-        sys.stdout = sys.__stdout__
+
+def get_generator_digest():
+    """
+    Returns a digest of this script and every module the dictionaries are generated by, so changing any of them
+    regenerates them all
+    """
+    digest = hashlib.sha256()
+    digest.update(dictionary.get_file_digest(__file__).encode())
+    digest.update(dictionary.get_generator_digest().encode())
+    return digest.hexdigest()
+
+
+def is_up_to_date(manifest_entry, config, dir_to_save):
+    """
+    Returns True if the outputs recorded in manifest_entry are still in dir_to_save and were generated with the same
+    config from schema files that have not changed since
+    """
+    if manifest_entry is None or manifest_entry['config'] != config:
+        return False
+
+    for output_filename, digest in manifest_entry['outputs'].items():
+        if dictionary.get_file_digest(os.path.join(dir_to_save, output_filename)) != digest:
+            return False
+
+    return not dictionary.are_dependencies_changed(manifest_entry['dependencies'])
+
+
+def get_manifest_entry(config, dependencies, dir_to_save, output_filenames):
+    return {'config': config, 'dependencies': dependencies,
+            'outputs': {output_filename: dictionary.get_file_digest(os.path.join(dir_to_save, output_filename))
+                        for output_filename in output_filenames}}
+
+
+def get_error(ex):
+    return ex.__class__.__name__, str(ex), ''.join(traceback.format_exception(type(ex), ex, ex.__traceback__))
+
+
+def generate_schema_dictionary_job(schema_dir_csdl, schema_dir_json, entity, filename, copyright, share_subtrees):
+    """
+    Generates the dictionary for one entity, along with the schema files it depends on. Exceptions are returned as
+    (type name, message, traceback text) so they can be reported from the main process when the job runs in a worker
+    """
+    try:
+        return dictionary.record_dependencies(dictionary.generate_schema_dictionary, 'local', schema_dir_csdl,
+                                              schema_dir_json, entity, filename, None, None, None, None, copyright,
+                                              schema_set, share_subtrees) + (None,)
+    except Exception as ex:
+        return None, None, get_error(ex)
+
+
+def generate_annotation_dictionary_job(schema_dir_csdl, schema_dir_json):
+    try:
+        return dictionary.record_dependencies(dictionary.generate_annotation_schema_dictionary, schema_dir_csdl,
+                                              schema_dir_json, 'v1', schema_set=schema_set) + (None,)
+    except Exception as ex:
+        return None, None, get_error(ex)
+
+
+def run_job_captured(job, *args):
+    """
+    Runs a job in a worker process and returns its console output along with its result, so the main process can
+    print the output of every job in submission order
+    """
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        result = job(*args)
+    return output.getvalue(), result
+
+
+def get_job_result(executor, future, job, *args):
+    if executor is None:
+        return job(*args)
+
+    output, result = future.result()
+    print(output, end='')
+    return result
 
 
 if __name__ == '__main__':
@@ -51,6 +175,16 @@ if __name__ == '__main__':
     parser.add_argument('-c', '--config', help="config file for specific user options", required=False)
 
     parser.add_argument('-o', '--output', help="The folder(s) to write the RDE dictionary files", nargs='+', required=True)
+    parser.add_argument('--jobs', help="number of worker processes used to generate the dictionaries", type=int,
+                        default=1, required=False)
+    parser.add_argument('--cache-dir', help="directory to cache what is extracted from each CSDL file, so that\n"
+                                            "unchanged files are not parsed again by later runs", required=False)
+    parser.add_argument('--force', help="regenerate every dictionary, even those whose schema files did not change",
+                        action='store_true')
+    parser.add_argument('--share-subtrees', help="store identical sets of entries (e.g. identical enums) only once",
+                        action='store_true')
+    parser.add_argument('--bundle', help="also write every dictionary into a single bundle file that shares one\n"
+                                         "string table between the dictionaries", required=False)
 
     args = parser.parse_args()
 
@@ -86,87 +220,167 @@ if __name__ == '__main__':
             print("ERROR: Could not open {}".format(args.config))
             sys.exit(1)
 
+    # collect the entities to generate, in the order they are reported and written
+    jobs = []
     for i in range(0, len(schema_dir_csdl)):
         for filename in os.listdir(schema_dir_csdl[i]):
             if filename not in do_not_write:
-                entities = []
-                output_filenames = []
-
                 if filename in explicit_entities:
                     for (k, v) in explicit_entities[filename].items():
-                        entities.append(k)
-                        output_filenames.append(v)
+                        jobs.append((i, filename, k, v))
                 else:
                     # strip out the _v1.xml
                     m = re.compile('(.*)_v1.xml').match(filename)
                     if m:
-                        entities.append(m.group(1) + '.' + m.group(1))
-                        output_filenames.append(filename.replace('.xml', ''))
-
-                for j in range(0, len(entities)):
-                    try:
-                        schema_dictionary = dictionary.generate_schema_dictionary(
-                            'local',
-                            schema_dir_csdl,
-                            schema_dir_json,
-                            entities[j],
-                            filename,
-                            None,
-                            None,
-                            None,
-                            None,
-                            copyright
-                        )
-
-                        if schema_dictionary and schema_dictionary.dictionary and schema_dictionary.json_dictionary:
-                            print(filename, entities[j], 'Entries:', len(schema_dictionary.dictionary),
-                                  'Size:', len(schema_dictionary.dictionary_byte_array),
-                                  'Url:', json.loads(schema_dictionary.json_dictionary)['schema_url'])
-
-                            dir_to_save = args.output[i]
-
-                            if not os.path.exists(dir_to_save):
-                                os.makedirs(dir_to_save)
-
-                            # save the binary and also dump the ascii version
-                            with open(dir_to_save + '//' + output_filenames[j] + '.bin', 'wb') as file:
-                                file.write(bytes(schema_dictionary.dictionary_byte_array))
-
-                            write_map_file(dir_to_save + '//' + output_filenames[j] + '.map', schema_dictionary)
-                        else:
-                            print(filename, "Missing entities, skipping...")
-
-                    except Exception as ex:
-                        print("Error: Could not generate RDE dictionary for schema:", filename)
-                        print("Error: Exception type: {0}, message: {1}".format(ex.__class__.__name__, str(ex)))
-                        traceback.print_exception(type(ex), ex, ex.__traceback__)
-                        sys.exit(1)
-
-    # Generate the annotation dictionary
-    print('Generating annotation dictionary...')
-    annotation_dictionary = None
-    try:
-        annotation_dictionary = dictionary.generate_annotation_schema_dictionary(
-            schema_dir_csdl,
-            schema_dir_json,
-            'v1'
-        )
+                        jobs.append((i, filename, m.group(1) + '.' + m.group(1), filename.replace('.xml', '')))
+
+    # the bundle keys the dictionaries by file name, reject clashes before any dictionary is generated
+    if args.bundle:
+        bundle_names = [output_filename + '.bin' for (i, filename, entity, output_filename) in jobs] + ['annotation.bin']
+        duplicate_names = sorted(set([name for name in bundle_names if bundle_names.count(name) > 1]))
+        if duplicate_names:
+            print("ERROR: --bundle needs unique dictionary file names, found more than once: {}".format(
+                ', '.join(duplicate_names)))
+            sys.exit(1)
+
+    # dictionaries whose config and schema files did not change since the last run are not generated again
+    generator_digest = get_generator_digest()
+    manifests = {}
+    for dir_to_save in set(args.output):
+        manifests[dir_to_save] = {} if args.force else load_manifest(dir_to_save)
 
-        if annotation_dictionary and annotation_dictionary.dictionary \
-                and annotation_dictionary.dictionary_byte_array and annotation_dictionary.json_dictionary:
-            print('Entries:', len(annotation_dictionary.dictionary), 'Size:',
-                  len(annotation_dictionary.dictionary_byte_array))
+    job_configs = []
+    for (i, filename, entity, output_filename) in jobs:
+        config = {'schema': filename, 'entity': entity, 'copyright': copyright, 'csdl': schema_dir_csdl,
+                  'json': schema_dir_json, 'generator': generator_digest}
+        if args.share_subtrees:
+            config['share_subtrees'] = True
+        job_configs.append((config, is_up_to_date(manifests[args.output[i]].get(output_filename), config,
+                                                  args.output[i])))
 
+    annotation_dir = args.output[len(schema_dir_csdl) - 1]
+    annotation_config = {'csdl': schema_dir_csdl, 'json': schema_dir_json, 'generator': generator_digest}
+    annotation_up_to_date = is_up_to_date(manifests[annotation_dir].get('annotation'), annotation_config,
+                                          annotation_dir)
+
+    # with --jobs the entities and the annotation dictionary are generated in worker processes, results are still
+    # reported and written in order by this process
+    init_schema_set(args.cache_dir)
+    executor = None
+    annotation_future = None
+    futures = [None] * len(jobs)
+    if args.jobs > 1:
+        executor = ProcessPoolExecutor(max_workers=args.jobs, initializer=init_schema_set,
+                                       initargs=(args.cache_dir,))
+        if not annotation_up_to_date:
+            annotation_future = executor.submit(run_job_captured, generate_annotation_dictionary_job,
+                                                schema_dir_csdl, schema_dir_json)
+        futures = [executor.submit(run_job_captured, generate_schema_dictionary_job, schema_dir_csdl,
+                                   schema_dir_json, entity, filename, copyright, args.share_subtrees)
+                   if not up_to_date else None
+                   for (i, filename, entity, output_filename), (config, up_to_date) in zip(jobs, job_configs)]
+
+    try:
+        for (i, filename, entity, output_filename), (config, up_to_date), future in zip(jobs, job_configs, futures):
             dir_to_save = args.output[i]
+            if up_to_date:
+                print(filename, entity, "Up to date, skipping...")
+                continue
 
-            with open(dir_to_save + '//' + 'annotation.bin', 'wb') as annotaton_bin:
-                annotaton_bin.write(bytearray(annotation_dictionary.dictionary_byte_array))
+            try:
+                schema_dictionary, dependencies, error = get_job_result(executor, future,
+                                                                        generate_schema_dictionary_job,
+                                                                        schema_dir_csdl, schema_dir_json, entity,
+                                                                        filename, copyright, args.share_subtrees)
+                if not error:
+                    manifests[dir_to_save].pop(output_filename, None)
+                    if schema_dictionary and schema_dictionary.dictionary and schema_dictionary.json_dictionary:
+                        print(filename, entity, 'Entries:', len(schema_dictionary.dictionary),
+                              'Size:', len(schema_dictionary.dictionary_byte_array),
+                              'Url:', json.loads(schema_dictionary.json_dictionary)['schema_url'])
 
-            write_map_file(dir_to_save + '//' + 'annotation.map', annotation_dictionary)
+                        if not os.path.exists(dir_to_save):
+                            os.makedirs(dir_to_save)
 
-    except Exception as ex:
-        print("Error: Could not generate Annotation RDE dictionary for schema: annotation.bin")
-        print("Error: Exception type: {0}, message: {1}".format(ex.__class__.__name__, str(ex)))
-        sys.exit(1)
+                        # save the binary and also dump the ascii version
+                        write_binary_file(dir_to_save + '//' + output_filename + '.bin',
+                                          schema_dictionary.dictionary_byte_array)
+
+                        write_map_file(dir_to_save + '//' + output_filename + '.map', schema_dictionary)
+
+                        manifests[dir_to_save][output_filename] = get_manifest_entry(
+                            config, dependencies, dir_to_save, [output_filename + '.bin', output_filename + '.map'])
+                    else:
+                        print(filename, "Missing entities, skipping...")
+                        manifests[dir_to_save][output_filename] = get_manifest_entry(config, dependencies,
+                                                                                     dir_to_save, [])
+
+            except Exception as ex:
+                error = get_error(ex)
+
+            if error:
+                print("Error: Could not generate RDE dictionary for schema:", filename)
+                print("Error: Exception type: {0}, message: {1}".format(error[0], error[1]))
+                print(error[2], end='', file=sys.stderr)
+                sys.exit(1)
+
+        # Generate the annotation dictionary
+        print('Generating annotation dictionary...')
+        if annotation_up_to_date:
+            print('Up to date, skipping...')
+        else:
+            try:
+                annotation_dictionary, dependencies, error = get_job_result(executor, annotation_future,
+                                                                            generate_annotation_dictionary_job,
+                                                                            schema_dir_csdl, schema_dir_json)
+                if not error and annotation_dictionary and annotation_dictionary.dictionary \
+                        and annotation_dictionary.dictionary_byte_array and annotation_dictionary.json_dictionary:
+                    print('Entries:', len(annotation_dictionary.dictionary), 'Size:',
+                          len(annotation_dictionary.dictionary_byte_array))
+
+                    write_binary_file(annotation_dir + '//' + 'annotation.bin',
+                                      annotation_dictionary.dictionary_byte_array)
+
+                    write_map_file(annotation_dir + '//' + 'annotation.map', annotation_dictionary)
+
+                    manifests[annotation_dir]['annotation'] = get_manifest_entry(
+                        annotation_config, dependencies, annotation_dir, ['annotation.bin', 'annotation.map'])
+
+            except Exception as ex:
+                error = get_error(ex)
+
+            if error:
+                print("Error: Could not generate Annotation RDE dictionary for schema: annotation.bin")
+                print("Error: Exception type: {0}, message: {1}".format(error[0], error[1]))
+                sys.exit(1)
+
+        # Bundle the dictionaries of this run, including the ones that were up to date
+        if args.bundle:
+            bundle_files = [(args.output[i], output_filename)
+                            for (i, filename, entity, output_filename) in jobs] + [(annotation_dir, 'annotation')]
+            bundle_files = [dir_to_save + '//' + output_filename + '.bin' for dir_to_save, output_filename in bundle_files
+                            if output_filename + '.bin' in manifests[dir_to_save].get(output_filename, {}).get('outputs', {})]
+            print('Bundling', len(bundle_files), 'dictionaries into', args.bundle)
+            dictionaries = []
+            for bundle_file in bundle_files:
+                with open(bundle_file, 'rb') as file:
+                    dictionaries.append((os.path.basename(bundle_file), file.read()))
+            write_file(args.bundle, bundle.build_dictionary_bundle(dictionaries), 'wb')
+
+    finally:
+        if executor:
+            if sys.version_info >= (3, 9):
+                executor.shutdown(cancel_futures=True)
+            else:
+                # cancel_futures is new in Python 3.9, cancel the jobs that have not started by hand
+                for future in futures + [annotation_future]:
+                    if future:
+                        future.cancel()
+                executor.shutdown()
+
+        # keep what was generated so far, even if a later dictionary failed
+        for dir_to_save, manifest in manifests.items():
+            if manifest:
+                save_manifest(dir_to_save, manifest)
 
     sys.exit(0)
@@ -16,7 +16,7 @@ import argparse
 import json
 import io
 import sys
-from rdebej import encode, decode
+from rdebej import encode, decode, loader
 
 
 if __name__ == '__main__':
@@ -26,8 +26,11 @@ if __name__ == '__main__':
     subparsers = parser.add_subparsers(dest='operation')
 
     encode_parser = subparsers.add_parser('encode')
-    encode_parser.add_argument('-s',  '--schemaDictionary', type=argparse.FileType('rb'), required=True)
-    encode_parser.add_argument('-a',  '--annotationDictionary', type=argparse.FileType('rb'), required=True)
+    encode_parser.add_argument('-s',  '--schemaDictionary', type=argparse.FileType('rb'), required=False)
+    encode_parser.add_argument('-a',  '--annotationDictionary', type=argparse.FileType('rb'), required=False)
+    encode_parser.add_argument('-d',  '--dictionaryDirectory', required=False,
+                               help="Directory of binary dictionaries used when the schema or annotation dictionary "
+                                    "is not given. The schema dictionary is resolved from the @odata.type of the JSON.")
     encode_parser.add_argument('-j',  '--jsonFile', type=argparse.FileType('r'), required=False)
     encode_parser.add_argument('-o',  '--bejOutputFile', type=argparse.FileType('wb'), required=False)
     encode_parser.add_argument('-op', '--pdrMapFile', type=argparse.FileType('w'), required=False)
@@ -38,12 +41,24 @@ if __name__ == '__main__':
                                     "For example: -fi=4 gives all of the integer in 4-byte. Throw an error message if there"
                                     "is an integer which length in byte is greater than 4-byte."
                                )
+    encode_parser.add_argument('-w',  '--workers', type=int, required=False, default=0,
+                               help="Number of worker processes used to encode large arrays")
+    encode_parser.add_argument('-pt', '--parallelThreshold', type=int, required=False,
+                               default=encode.PARALLEL_ARRAY_THRESHOLD,
+                               help="Minimum number of array elements before an array is split across the workers")
 
     decode_parser = subparsers.add_parser('decode')
     decode_parser.add_argument('-s', '--schemaDictionary', type=argparse.FileType('rb'), required=True)
-    decode_parser.add_argument('-a', '--annotationDictionary', type=argparse.FileType('rb'), required=True)
+    decode_parser.add_argument('-a', '--annotationDictionary', type=argparse.FileType('rb'), required=False)
+    decode_parser.add_argument('-d', '--dictionaryDirectory', required=False,
+                               help="Directory of binary dictionaries used when the annotation dictionary is not given")
     decode_parser.add_argument('-b', '--bejEncodedFile', type=argparse.FileType('rb'), required=True)
     decode_parser.add_argument('-p', '--pdrMapFile', type=argparse.FileType('r'), required=False)
+    decode_parser.add_argument('-w', '--workers', type=int, required=False, default=0,
+                               help="Number of worker processes used to decode large arrays")
+    decode_parser.add_argument('-pt', '--parallelThreshold', type=int, required=False,
+                               default=decode.PARALLEL_ARRAY_THRESHOLD,
+                               help="Minimum number of array elements before an array is split across the workers")
 
     args = parser.parse_args()
 
@@ -58,11 +73,17 @@ if __name__ == '__main__':
         verbose = True
         silent = False
 
-    # Read the binary schema dictionary into a byte array
-    schema_dictionary = list(args.schemaDictionary.read())
+    registry = None
+    if args.dictionaryDirectory:
+        registry = loader.DictionaryRegistry(args.dictionaryDirectory)
+    elif not args.schemaDictionary or not args.annotationDictionary:
+        parser.error('the schema and annotation dictionaries are required without a dictionary directory')
 
-    # Read the binary annotation dictionary into a byte array
-    annotation_dictionary = list(args.annotationDictionary.read())
+    # Load the binary annotation dictionary
+    if args.annotationDictionary:
+        annotation_dictionary = loader.load_binary_dictionary(args.annotationDictionary)
+    else:
+        annotation_dictionary = registry.get_annotation_dictionary()
 
     if args.operation == 'encode':
         json_str = {}
@@ -75,9 +96,19 @@ if __name__ == '__main__':
 
         json_to_encode = json.loads(json_str)
 
+        # Load the binary schema dictionary
+        if args.schemaDictionary:
+            schema_dictionary = loader.load_binary_dictionary(args.schemaDictionary)
+        elif '@odata.type' in json_to_encode:
+            schema_dictionary = registry.resolve(json_to_encode['@odata.type'])
+        else:
+            parser.error('the schema dictionary is required for JSON without an @odata.type')
+
         # create a byte stream
         output_stream = io.BytesIO()
-        success, pdr_map = encode.bej_encode(output_stream, json_to_encode, schema_dictionary, annotation_dictionary, fixed_int_len=int(args.fixedIntegerLength))
+        success, pdr_map = encode.bej_encode(output_stream, json_to_encode, schema_dictionary, annotation_dictionary, fixed_int_len=int(args.fixedIntegerLength),
+                                             parallel_workers=args.workers,
+                                             parallel_threshold=args.parallelThreshold)
         if success:
             encoded_bytes = output_stream.getvalue()
             if not silent:
@@ -93,6 +124,9 @@ if __name__ == '__main__':
                 print('Failed to encode JSON')
 
     elif args.operation == 'decode':
+        # Load the binary schema dictionary
+        schema_dictionary = loader.load_binary_dictionary(args.schemaDictionary)
+
         # Read the encoded bytes
         bej_encoded_bytes = list(args.bejEncodedFile.read())
 
@@ -103,7 +137,7 @@ if __name__ == '__main__':
         input_stream = io.BytesIO(bytes(bej_encoded_bytes))
         output_stream = io.StringIO()
         success = decode.bej_decode(output_stream, input_stream, schema_dictionary, annotation_dictionary, {}, pdr_map,
-                                    {})
+                                    {}, parallel_workers=args.workers, parallel_threshold=args.parallelThreshold)
         if success:
             if not silent:
                 print(json.dumps(json.loads(output_stream.getvalue()), indent=3))
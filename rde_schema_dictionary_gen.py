@@ -14,8 +14,11 @@ Brief : This file contains the definitions and functionalities for generating
 """
 
 import argparse
+import json
+import os
 import sys
 from rdebej.dictionary import *
+from rdebej import loader
 
 
 if __name__ == '__main__':
@@ -42,6 +45,21 @@ if __name__ == '__main__':
     local_parser.add_argument('-p', '--profile', type=str, required=False)
     local_parser.add_argument('-d', '--outputFile', type=argparse.FileType('wb'), required=False)
     local_parser.add_argument('-f', '--outputJsonDictionaryFile', type=argparse.FileType('w'), required=False)
+    local_parser.add_argument('--cacheDir', type=str, required=False,
+                              help="directory to cache what is extracted from each CSDL file")
+    local_parser.add_argument('--shareSubtrees', action='store_true',
+                              help="store identical sets of entries (e.g. identical enums) only once")
+    local_parser.add_argument('--corpus', nargs='*', type=str, required=False,
+                              help="JSON payload files or directories; truncate to the properties they use")
+    local_parser.add_argument('--profiles', nargs='+', type=str, required=False,
+                              help="generate a truncated dictionary for each profile into --profileOutputDirectory")
+    local_parser.add_argument('--profileOutputDirectory', type=str, required=False,
+                              help="directory to write <profile name>.bin for each of --profiles")
+    local_parser.add_argument('--oemVariants', type=argparse.FileType('r'), required=False,
+                              help="JSON file of variant names to their oemSchemaFilenames and oemEntities; "
+                                   "generate a dictionary for each into --oemVariantOutputDirectory")
+    local_parser.add_argument('--oemVariantOutputDirectory', type=str, required=False,
+                              help="directory to write <variant name>.bin for each of --oemVariants")
 
     annotation_v2_parser = subparsers.add_parser('annotation')
     annotation_v2_parser.add_argument('-c', '--csdlSchemaDirectories', nargs='*', type=str, required=True)
@@ -50,6 +68,8 @@ if __name__ == '__main__':
     annotation_v2_parser.add_argument('-r', '--copyright', type=str, required=False)
     annotation_v2_parser.add_argument('-d', '--outputFile', type=argparse.FileType('wb'), required=False)
     annotation_v2_parser.add_argument('-f', '--outputJsonDictionaryFile', type=argparse.FileType('w'), required=False)
+    annotation_v2_parser.add_argument('--cacheDir', type=str, required=False,
+                                      help="directory to cache what is extracted from each CSDL file")
 
     error_parser = subparsers.add_parser('error')
     error_parser.add_argument('-c', '--csdlSchemaDirectories', nargs='*', type=str, required=True)
@@ -57,6 +77,8 @@ if __name__ == '__main__':
     error_parser.add_argument('-r', '--copyright', type=str, required=False)
     error_parser.add_argument('-d', '--outputFile', type=argparse.FileType('wb'), required=False)
     error_parser.add_argument('-f', '--outputJsonDictionaryFile', type=argparse.FileType('w'), required=False)
+    error_parser.add_argument('--cacheDir', type=str, required=False,
+                              help="directory to cache what is extracted from each CSDL file")
 
     dictionary_dump = subparsers.add_parser('view')
     dictionary_dump.add_argument('-f', '--file', type=str, required=True)
@@ -79,18 +101,89 @@ if __name__ == '__main__':
         # load the binary dictionary file
         file = open(args.file, 'rb')
         contents = file.read()
-        print_binary_dictionary(list(contents))
+        print_binary_dictionary(contents)
+        binary_dictionary = loader.BinaryDictionary(contents)
+        binary_dictionary.validate()
+        print_binary_dictionary_statistics(binary_dictionary.get_statistics())
         sys.exit()
 
+    # --profiles and --oemVariants generate their own set of dictionaries, reject the options they would not use
+    if args.source == 'local':
+        conflicting_options = []
+        if args.profiles:
+            conflicting_options = [('--profile', args.profile), ('--corpus', args.corpus),
+                                   ('--oemVariants', args.oemVariants)]
+        elif args.oemVariants:
+            conflicting_options = [('--profile', args.profile), ('--corpus', args.corpus),
+                                   ('--oemSchemaFilenames', args.oemSchemaFilenames),
+                                   ('--oemEntities', args.oemEntities)]
+        for option, value in conflicting_options:
+            if value is not None:
+                local_parser.error('{0} cannot be used with {1}'.format(
+                    option, '--profiles' if args.profiles else '--oemVariants'))
+
     # Generate the schema dictionary.
     schema_dictionary = None
-    if args.source == 'local':
+    schema_set = None
+    if args.source in ['local', 'annotation', 'error'] and args.cacheDir:
+        schema_set = SchemaSet(args.cacheDir)
+
+    if args.source == 'local' and args.profiles:
+        if not args.profileOutputDirectory:
+            print('Error, --profiles requires --profileOutputDirectory')
+            sys.exit(1)
+        os.makedirs(args.profileOutputDirectory, exist_ok=True)
+        schema_dictionaries = generate_profile_schema_dictionaries(args.csdlSchemaDirectories,
+                                                                   args.jsonSchemaDirectories, args.entity,
+                                                                   args.schemaFilename, args.profiles,
+                                                                   args.oemEntities, args.oemSchemaFilenames,
+                                                                   args.copyright, schema_set,
+                                                                   args.shareSubtrees)
+        for profile, profile_dictionary in schema_dictionaries.items():
+            if not profile_dictionary.dictionary:
+                print('Error, dictionary could not be generated for profile', profile)
+                continue
+            output_file = os.path.join(args.profileOutputDirectory,
+                                       os.path.splitext(os.path.basename(profile))[0] + '.bin')
+            with open(output_file, 'wb') as file:
+                file.write(bytes(profile_dictionary.dictionary_byte_array))
+            if not silent:
+                print(profile, '->', output_file)
+                print_dictionary_summary(profile_dictionary.dictionary, profile_dictionary.dictionary_byte_array)
+        sys.exit(0 if all(profile_dictionary.dictionary for profile_dictionary in schema_dictionaries.values())
+                 else 1)
+    elif args.source == 'local' and args.oemVariants:
+        if not args.oemVariantOutputDirectory:
+            print('Error, --oemVariants requires --oemVariantOutputDirectory')
+            sys.exit(1)
+        os.makedirs(args.oemVariantOutputDirectory, exist_ok=True)
+        oem_variants = json.load(args.oemVariants)
+        schema_dictionaries = generate_oem_schema_dictionaries(args.csdlSchemaDirectories,
+                                                               args.jsonSchemaDirectories, args.entity,
+                                                               args.schemaFilename,
+                                                               [(variant.get('oemEntities', []),
+                                                                 variant.get('oemSchemaFilenames', []))
+                                                                for variant in oem_variants.values()],
+                                                               args.copyright, schema_set, args.shareSubtrees)
+        for variant_name, variant_dictionary in zip(oem_variants, schema_dictionaries):
+            if not variant_dictionary.dictionary:
+                print('Error, dictionary could not be generated for OEM variant', variant_name)
+                continue
+            output_file = os.path.join(args.oemVariantOutputDirectory, variant_name + '.bin')
+            with open(output_file, 'wb') as file:
+                file.write(bytes(variant_dictionary.dictionary_byte_array))
+            if not silent:
+                print(variant_name, '->', output_file)
+                print_dictionary_summary(variant_dictionary.dictionary, variant_dictionary.dictionary_byte_array)
+        sys.exit(0 if all(variant_dictionary.dictionary for variant_dictionary in schema_dictionaries) else 1)
+    elif args.source == 'local':
         schema_dictionary = generate_schema_dictionary(args.source, args.csdlSchemaDirectories,
                                                        args.jsonSchemaDirectories, args.entity,
                                                        args.schemaFilename, args.oemEntities,
                                                        args.oemSchemaFilenames, args.profile,
                                                        None,
-                                                       args.copyright)
+                                                       args.copyright, schema_set, args.shareSubtrees,
+                                                       args.corpus)
     elif args.source == 'remote':
         schema_dictionary = generate_schema_dictionary(args.source, None, None, args.entity, None,
                                                        None, None, None, args.schemaURL)
@@ -98,10 +191,10 @@ if __name__ == '__main__':
         # Just choose a dummy complex entity type to start the annotation dictionary generation process.
         schema_dictionary = generate_annotation_schema_dictionary(args.csdlSchemaDirectories,
                                                                   args.jsonSchemaDirectories, args.version,
-                                                                  args.copyright)
+                                                                  args.copyright, schema_set)
     elif args.source == 'error':
         schema_dictionary = generate_error_schema_dictionary(args.csdlSchemaDirectories,
-                                                             args.jsonSchemaDirectories, args.copyright)
+                                                             args.jsonSchemaDirectories, args.copyright, schema_set)
 
     # Print table data.
     if schema_dictionary is not None and schema_dictionary.dictionary:
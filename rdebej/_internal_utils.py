@@ -9,6 +9,11 @@ rdebej._internal_utils
 Provides utility functions that are consumed internally by rdebej
 """
 
+import struct
+import sys
+from collections import namedtuple
+from functools import lru_cache
+
 # BEJ FORMAT definitions
 BEJ_FORMAT_SET = 0x00
 BEJ_FORMAT_ARRAY = 0x01
@@ -38,9 +43,55 @@ DICTIONARY_ENTRY_OFFSET = 3
 DICTIONARY_ENTRY_CHILD_COUNT = 4
 DICTIONARY_ENTRY_NAME = 5
 
+# An immutable dictionary entry, indexed with the DICTIONARY_ENTRY_* constants above
+DictionaryEntry = namedtuple('DictionaryEntry', 'format flags sequence offset child_count name')
+
+# Binary dictionary layout: the header (VersionTag, DictionaryFlags, EntryCount, SchemaVersion, DictionarySize) and
+# the fixed sized entries (Format/Flags, SequenceNumber, ChildPointerOffset, ChildCount, NameLength, NameOffset)
+DICTIONARY_HEADER_STRUCT = struct.Struct('<BBHII')
+DICTIONARY_ENTRY_STRUCT = struct.Struct('<BHHHBH')
+
 BEJ_DICTIONARY_SELECTOR_MAJOR_SCHEMA = 0x00
 BEJ_DICTIONARY_SELECTOR_ANNOTATION = 0x01
 
+# Minimum number of array elements before an array is split across worker processes
+PARALLEL_ARRAY_THRESHOLD = 1000
+
+# Minimum number of elements before a homogeneous numeric array is packed/unpacked with NumPy
+VECTORIZED_ARRAY_THRESHOLD = 16
+
+
+@lru_cache(maxsize=65536)
+def get_dictionary_name(name_bytes):
+    """
+    Decodes a dictionary name (without its null terminator). Names are decoded once and interned, so the entries of
+    every dictionary share a single copy of each name.
+    """
+    return sys.intern(name_bytes.decode('latin-1'))
+
+
+def split_array_range(count, num_slices):
+    """
+    Splits the element indices of an array into contiguous slices
+
+    Args:
+        count: Number of elements in the array
+        num_slices: Maximum number of slices to produce
+
+    Return:
+        List of (start, end) index tuples, in element order
+    """
+    num_slices = max(1, min(num_slices, count))
+    slice_size, remainder = divmod(count, num_slices)
+    slices = []
+    start = 0
+    for i in range(num_slices):
+        end = start + slice_size + (1 if i < remainder else 0)
+        slices.append((start, end))
+        start = end
+
+    return slices
+
 
 class DictionaryByteArrayStream:
     def __init__(self, byte_array, offset=0, child_count=-1):
@@ -75,25 +126,19 @@ class DictionaryByteArrayStream:
 
     def get_next_entry(self):
         entry = []
-        current_entry = 0
         if self._current_entry < self._child_count or self._child_count == -1:
 
-            format_flags = self.get_int(1)
-            entry.append(format_flags >> 4)  # format
-            entry.append(format_flags & 0xF)  # flags
-            entry.append(self.get_int(2))  # sequence
-            entry.append(self.get_int(2))  # offset
-            entry.append(self.get_int(2))  # child_count
-
-            name_length = self.get_int(1)
-            name_offset = self.get_int(2)
+            format_flags, sequence, offset, child_count, name_length, name_offset = \
+                DICTIONARY_ENTRY_STRUCT.unpack(bytes(self._byte_array[self._current_index:
+                                                                      self._current_index+DICTIONARY_ENTRY_STRUCT.size]))
+            self._current_index += DICTIONARY_ENTRY_STRUCT.size
 
             # fetch the name
             name = ''
             if name_length > 0:
-                name = "".join(map(chr, self._byte_array[name_offset:name_offset+name_length-1])) # -1 to skip null terminator
+                name = get_dictionary_name(bytes(self._byte_array[name_offset:name_offset+name_length-1])) # -1 to skip null terminator
 
-            entry.append(name)
+            entry = DictionaryEntry(format_flags >> 4, format_flags & 0xF, sequence, offset, child_count, name)
 
             if self._child_count != -1:
                 self._current_entry += 1
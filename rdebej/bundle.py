@@ -0,0 +1,401 @@
+#! /usr/bin/python3
+# Copyright Notice:
+# Copyright 2018-2019 DMTF. All rights reserved.
+# License: BSD 3-Clause License. For full text see link: https://github.com/DMTF/RDE-Dictionary/blob/master/LICENSE.md
+
+"""
+rdebej.bundle
+~~~~~~~~~~~~~~
+Stores many binary dictionaries in one file that shares a single string table between them
+
+A bundle is laid out as:
+    header      BUNDLE_HEADER_STRUCT
+    index       BUNDLE_INDEX_STRUCT per dictionary
+    strings     string count offsets (uint32) followed by the null terminated strings
+    data        per dictionary, either its entries as BUNDLE_ENTRY_STRUCT (BUNDLE_WIDE_ENTRY_STRUCT with
+                BUNDLE_FLAG_WIDE_STRING_IDS), with the names replaced by string ids, or the original dictionary
+                bytes when they cannot be rebuilt byte for byte from the entries
+
+Every dictionary is rebuilt exactly as it was added, so a bundle can stand in for a directory of dictionaries.
+"""
+
+import binascii
+import mmap
+import os
+import struct
+import threading
+from ._internal_utils import *
+from .loader import BinaryDictionary, DictionaryInfo, parse_schema_type, select_dictionary_info
+
+BUNDLE_MAGIC = b'RDEB'
+BUNDLE_FORMAT_VERSION = 1
+
+# Magic, FormatVersion, Flags, DictionaryCount, StringCount, IndexOffset, StringTableOffset, BundleSize
+BUNDLE_HEADER_STRUCT = struct.Struct('<4sHHIIIII')
+
+# FileNameId, EntityId, CopyrightId, SchemaVersion, Crc32, DictionarySize, DataOffset, DataSize, Storage, VersionTag,
+# DictionaryFlags, EntryCount
+BUNDLE_INDEX_STRUCT = struct.Struct('<8IBBBxH')
+
+# Format/Flags, SequenceNumber, ChildPointerOffset, ChildCount, NameId; 9 bytes, a byte less than a dictionary entry
+# since the name length is not stored
+BUNDLE_ENTRY_STRUCT = struct.Struct('<BHHHH')
+BUNDLE_WIDE_ENTRY_STRUCT = struct.Struct('<BHHHI')
+
+BUNDLE_STRING_OFFSET_STRUCT = struct.Struct('<I')
+
+# The string id of no string, in the index and in entries
+BUNDLE_NO_STRING = 0xFFFFFFFF
+BUNDLE_NO_ENTRY_STRING = 0xFFFF
+
+# Set in Flags when the bundle has too many strings for BUNDLE_ENTRY_STRUCT
+BUNDLE_FLAG_WIDE_STRING_IDS = 0x01
+
+BUNDLE_STORAGE_ENTRIES = 0
+BUNDLE_STORAGE_RAW = 1
+
+
+def split_binary_dictionary(contents):
+    """
+    Splits a binary dictionary into its header fields, its entries with their names and its copyright
+
+    Return:
+        (version_tag, dictionary_flags, schema_version, entries, copyright), entries are (format_flags, sequence,
+        child offset, child count, name) and copyright is None if the dictionary has none
+    """
+    binary_dictionary = BinaryDictionary(contents)
+    entries = [(format_flags, sequence, offset, child_count, binary_dictionary.get_name(name_offset, name_length))
+               for format_flags, sequence, offset, child_count, name_length, name_offset
+               in DICTIONARY_ENTRY_STRUCT.iter_unpack(contents[DICTIONARY_HEADER_STRUCT.size:
+                                                               binary_dictionary.entry_table_end])]
+
+    copyright_offset = binary_dictionary.entry_table_end + binary_dictionary.get_statistics()['name_table_size']
+    copyright = None
+    if copyright_offset < len(contents) and contents[copyright_offset] > 0:
+        copyright = contents[copyright_offset + 1:copyright_offset + contents[copyright_offset]].decode('latin-1')
+
+    return (binary_dictionary.version_tag, binary_dictionary.dictionary_flags, binary_dictionary.schema_version,
+            entries, copyright)
+
+
+def join_binary_dictionary(version_tag, dictionary_flags, schema_version, entries, copyright):
+    """
+    Serializes the parts returned by split_binary_dictionary() back into a binary dictionary. Names are laid out in
+    the order they are first used, like dictionary.generate_byte_array() does.
+    """
+    name_to_offset = {}
+    names = []
+    name_offset = DICTIONARY_HEADER_STRUCT.size + len(entries) * DICTIONARY_ENTRY_STRUCT.size
+    packed_entries = []
+    for format_flags, sequence, offset, child_count, name in entries:
+        name_length = 0
+        entry_name_offset = 0
+        if name:
+            name_length = len(name) + 1
+            if name not in name_to_offset:
+                name_to_offset[name] = name_offset
+                names.append(name)
+                name_offset += name_length
+            entry_name_offset = name_to_offset[name]
+        packed_entries.append(DICTIONARY_ENTRY_STRUCT.pack(format_flags, sequence, offset, child_count, name_length,
+                                                           entry_name_offset))
+
+    trailer = b''.join([name.encode('latin-1') + b'\x00' for name in names])
+    if copyright:
+        trailer += (len(copyright) + 1).to_bytes(1, 'little') + copyright.encode('latin-1') + b'\x00'
+    else:
+        trailer += b'\x00'
+
+    dictionary_size = DICTIONARY_HEADER_STRUCT.size + len(packed_entries) * DICTIONARY_ENTRY_STRUCT.size + \
+        len(trailer)
+    return DICTIONARY_HEADER_STRUCT.pack(version_tag, dictionary_flags, len(entries), schema_version,
+                                         dictionary_size) + b''.join(packed_entries) + trailer
+
+
+def build_dictionary_bundle(dictionaries):
+    """
+    Builds a bundle from binary dictionaries
+
+    Args:
+        dictionaries: Iterable of (file name, dictionary bytes), e.g. ('Drive_v1.bin', ...)
+
+    Return:
+        The bundle as bytes
+
+    Raises:
+        ValueError: A dictionary is not a valid binary dictionary or a file name is used twice
+    """
+    strings = []
+    string_ids = {}
+
+    def get_string_id(string):
+        if string is None:
+            return BUNDLE_NO_STRING
+        if string not in string_ids:
+            string_ids[string] = len(strings)
+            strings.append(string)
+        return string_ids[string]
+
+    index = []
+    entries_list = []
+    file_names = set()
+    for file_name, contents in dictionaries:
+        if file_name in file_names:
+            raise ValueError('Duplicate dictionary file name: {0}'.format(file_name))
+        file_names.add(file_name)
+        contents = bytes(contents)
+        version_tag, dictionary_flags, schema_version, entries, copyright = split_binary_dictionary(contents)
+        entity = entries[0][4] if entries else ''
+
+        if join_binary_dictionary(version_tag, dictionary_flags, schema_version, entries, copyright) == contents:
+            storage = BUNDLE_STORAGE_ENTRIES
+            entries = [(format_flags, sequence, offset, child_count, get_string_id(name) if name else None)
+                       for format_flags, sequence, offset, child_count, name in entries]
+        else:
+            # a layout the entries do not capture (e.g. names in another order), keep the dictionary as it is
+            storage = BUNDLE_STORAGE_RAW
+            entries = contents
+            copyright = None
+
+        index.append([get_string_id(file_name), get_string_id(entity), get_string_id(copyright), schema_version,
+                      binascii.crc32(contents), len(contents), 0, 0, storage, version_tag, dictionary_flags,
+                      DICTIONARY_HEADER_STRUCT.unpack_from(contents, 0)[2]])
+        entries_list.append(entries)
+
+    # entries refer to the strings by 16 bit ids unless there are too many strings
+    flags = 0
+    entry_struct = BUNDLE_ENTRY_STRUCT
+    no_entry_string = BUNDLE_NO_ENTRY_STRING
+    if len(strings) >= BUNDLE_NO_ENTRY_STRING:
+        flags |= BUNDLE_FLAG_WIDE_STRING_IDS
+        entry_struct = BUNDLE_WIDE_ENTRY_STRUCT
+        no_entry_string = BUNDLE_NO_STRING
+
+    data = []
+    for record, entries in zip(index, entries_list):
+        if record[8] == BUNDLE_STORAGE_RAW:
+            dictionary_data = entries
+        else:
+            dictionary_data = b''.join([entry_struct.pack(format_flags, sequence, offset, child_count,
+                                                          no_entry_string if name_id is None else name_id)
+                                        for format_flags, sequence, offset, child_count, name_id in entries])
+        record[7] = len(dictionary_data)
+        data.append(dictionary_data)
+
+    encoded_strings = [string.encode('latin-1') + b'\x00' for string in strings]
+    string_offsets = []
+    string_offset = 0
+    for encoded_string in encoded_strings:
+        string_offsets.append(BUNDLE_STRING_OFFSET_STRUCT.pack(string_offset))
+        string_offset += len(encoded_string)
+
+    index_offset = BUNDLE_HEADER_STRUCT.size
+    string_table_offset = index_offset + len(index) * BUNDLE_INDEX_STRUCT.size
+    data_offset = string_table_offset + len(strings) * BUNDLE_STRING_OFFSET_STRUCT.size + string_offset
+    for record, dictionary_data in zip(index, data):
+        record[6] = data_offset
+        data_offset += len(dictionary_data)
+
+    return BUNDLE_HEADER_STRUCT.pack(BUNDLE_MAGIC, BUNDLE_FORMAT_VERSION, flags, len(index), len(strings), index_offset,
+                                     string_table_offset, data_offset) \
+        + b''.join([BUNDLE_INDEX_STRUCT.pack(*record) for record in index]) \
+        + b''.join(string_offsets) + b''.join(encoded_strings) + b''.join(data)
+
+
+def write_dictionary_bundle(file_name, dictionary_files):
+    """
+    Writes a bundle of binary dictionary files. The dictionaries keep their base file names in the bundle.
+    """
+    dictionaries = []
+    for dictionary_file in dictionary_files:
+        with open(dictionary_file, 'rb') as file:
+            dictionaries.append((os.path.basename(dictionary_file), file.read()))
+
+    with open(file_name, 'wb') as file:
+        file.write(build_dictionary_bundle(dictionaries))
+
+
+class DictionaryBundle:
+    """
+    A bundle of binary dictionaries backed by a buffer, usually a read-only memory map of the bundle file. The index
+    is read when the bundle is opened, dictionaries are rebuilt from the bundle when they are requested.
+    """
+    def __init__(self, buffer, path=None):
+        """
+        Args:
+            buffer: The bundle bytes, any object that supports the buffer protocol
+            path: The file the bundle was loaded from, if any
+
+        Raises:
+            ValueError: The buffer is not a bundle
+        """
+        self._buffer = buffer
+        self.path = path
+
+        if len(buffer) < BUNDLE_HEADER_STRUCT.size:
+            raise ValueError('Bundle is too short for a header: {0} bytes'.format(len(buffer)))
+        magic, self.format_version, self.flags, dictionary_count, self.string_count, index_offset, \
+            self.string_table_offset, bundle_size = BUNDLE_HEADER_STRUCT.unpack_from(buffer, 0)
+        if magic != BUNDLE_MAGIC or self.format_version != BUNDLE_FORMAT_VERSION:
+            raise ValueError('Not a dictionary bundle or an unsupported bundle version')
+        if bundle_size != len(buffer):
+            raise ValueError('BundleSize {0} does not match the bundle size {1}'.format(bundle_size, len(buffer)))
+
+        self._entry_struct = BUNDLE_ENTRY_STRUCT
+        self._no_entry_string = BUNDLE_NO_ENTRY_STRING
+        if self.flags & BUNDLE_FLAG_WIDE_STRING_IDS:
+            self._entry_struct = BUNDLE_WIDE_ENTRY_STRUCT
+            self._no_entry_string = BUNDLE_NO_STRING
+
+        self._strings = {}  # string id to string
+        # the strings end where the first dictionary's data starts
+        self._strings_end = len(buffer)
+        self._lock = threading.Lock()
+
+        self._records = {}  # file name to index record
+        self._by_entity = {}  # entity name to its DictionaryInfos
+        self._by_crc = {}  # CRC to DictionaryInfo
+        self._infos = []
+        for i in range(dictionary_count):
+            record = BUNDLE_INDEX_STRUCT.unpack_from(buffer, index_offset + i * BUNDLE_INDEX_STRUCT.size)
+            file_name_id, entity_id, copyright_id, schema_version, crc, dictionary_size = record[:6]
+            info = DictionaryInfo(self.get_string(file_name_id), self.get_string(entity_id), schema_version, crc,
+                                  dictionary_size)
+            self._records[info.path] = record
+            self._by_entity.setdefault(info.entity, []).append(info)
+            self._by_crc.setdefault(crc, info)
+            self._infos.append(info)
+            self._strings_end = min(self._strings_end, record[6])
+
+    def __len__(self):
+        return len(self._infos)
+
+    def __iter__(self):
+        return iter(self._infos)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+
+    def get_string(self, string_id):
+        if string_id == BUNDLE_NO_STRING:
+            return None
+        string = self._strings.get(string_id)
+        if string is None:
+            # a string ends where the next one starts, found from the offsets since not every buffer has find()
+            strings_start = self.string_table_offset + self.string_count * BUNDLE_STRING_OFFSET_STRUCT.size
+            string_offset, = BUNDLE_STRING_OFFSET_STRUCT.unpack_from(
+                self._buffer, self.string_table_offset + string_id * BUNDLE_STRING_OFFSET_STRUCT.size)
+            start = strings_start + string_offset
+            if string_id + 1 < self.string_count:
+                next_string_offset, = BUNDLE_STRING_OFFSET_STRUCT.unpack_from(
+                    self._buffer, self.string_table_offset + (string_id + 1) * BUNDLE_STRING_OFFSET_STRUCT.size)
+                end = strings_start + next_string_offset - 1
+            else:
+                end = self._strings_end - 1
+            string = get_dictionary_name(bytes(self._buffer[start:end]))
+            with self._lock:
+                self._strings[string_id] = string
+        return string
+
+    def find(self, entity, version=None):
+        """
+        Finds the dictionary for an entity, see loader.select_dictionary_info()
+        """
+        return select_dictionary_info(self._by_entity.get(entity, []), version)
+
+    def find_by_crc(self, crc):
+        return self._by_crc.get(crc)
+
+    def get_dictionary_bytes(self, info):
+        """
+        Rebuilds a dictionary exactly as it was added to the bundle
+
+        Args:
+            info: DictionaryInfo or the file name of the dictionary
+
+        Raises:
+            KeyError: The dictionary is not in the bundle
+            ValueError: The rebuilt dictionary does not match its CRC
+        """
+        file_name = info.path if isinstance(info, DictionaryInfo) else info
+        _, _, copyright_id, schema_version, crc, dictionary_size, data_offset, data_size, storage, version_tag, \
+            dictionary_flags, entry_count = self._records[file_name]
+
+        if storage == BUNDLE_STORAGE_RAW:
+            contents = bytes(self._buffer[data_offset:data_offset + data_size])
+        else:
+            entries = [(format_flags, sequence, offset, child_count,
+                        None if name_id == self._no_entry_string else self.get_string(name_id))
+                       for format_flags, sequence, offset, child_count, name_id
+                       in self._entry_struct.iter_unpack(self._buffer[data_offset:data_offset + data_size])]
+            contents = join_binary_dictionary(version_tag, dictionary_flags, schema_version, entries,
+                                              self.get_string(copyright_id))
+
+        if len(contents) != dictionary_size or binascii.crc32(contents) != crc:
+            raise ValueError('Dictionary {0} does not match its CRC'.format(file_name))
+        return contents
+
+    def load(self, info):
+        """
+        Returns a dictionary of the bundle as a BinaryDictionary
+        """
+        return BinaryDictionary(self.get_dictionary_bytes(info))
+
+    def resolve(self, schema_type):
+        """
+        Returns the dictionary for an @odata.type or schema URL
+
+        Raises:
+            KeyError: The bundle has no dictionary for the schema type
+        """
+        entity, version = parse_schema_type(schema_type)
+        info = self.find(entity, version)
+        if info is None:
+            raise KeyError('No dictionary for {0}'.format(schema_type))
+        return self.load(info)
+
+    def extract(self, directory):
+        """
+        Writes every dictionary of the bundle to directory under its file name
+
+        Return:
+            List of the paths written
+        """
+        paths = []
+        for info in self._infos:
+            path = os.path.join(directory, info.path)
+            with open(path, 'wb') as file:
+                file.write(self.get_dictionary_bytes(info))
+            paths.append(path)
+        return paths
+
+
+def load_dictionary_bundle(file):
+    """
+    Loads a bundle file. Regular files are memory-mapped, anything else (e.g. a pipe) is read.
+
+    Args:
+        file: Path or binary file object of the bundle
+
+    Return:
+        DictionaryBundle
+    """
+    if isinstance(file, str):
+        with open(file, 'rb') as bundle_file:
+            return load_dictionary_bundle(bundle_file)
+
+    path = getattr(file, 'name', None)
+    try:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, AttributeError):
+        buffer = file.read()
+        path = None
+
+    return DictionaryBundle(buffer, path if isinstance(path, str) else None)
@@ -11,9 +11,20 @@ File : decode.py
 Brief : This file defines APIs to decode a PLDM Binary encoded JSON (BEJ) to JSON
 """
 
+import array
+import io
+import json
 import os
 import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from ._internal_utils import *
+from .loader import BinaryDictionary
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 def bej_unpack_nnint(stream):
@@ -199,6 +210,97 @@ def bej_sequenceof(stream):
     return seq
 
 
+def bej_scan_array_elements(stream, array_member_count):
+    """
+    Finds the element boundaries of an array using only the SFL lengths of its elements. The stream must point to
+    the first element of the array and is left pointing past the last element.
+
+    Return:
+        List of array_member_count + 1 stream positions, element i spans positions[i] to positions[i+1]
+    """
+    positions = [stream.tell()]
+    for i in range(0, array_member_count):
+        seq, format, length = bej_unpack_sfl(stream)
+        positions.append(stream.seek(length, os.SEEK_CUR))
+
+    return positions
+
+
+def bej_read_complex_type_value(stream, complex_type_start_pos, length):
+    """
+    Reads the rest of a set or array value, from the current stream position to the end given by its SFL length
+    """
+    current_pos = stream.tell()
+    stream.seek(complex_type_start_pos, os.SEEK_SET)
+    bej_unpack_sfl(stream)
+    value_end_pos = stream.tell() + length
+    stream.seek(current_pos, os.SEEK_SET)
+    return stream.read(value_end_pos - current_pos)
+
+
+def bej_unpack_signed_integers(buf, positions, lengths):
+    """
+    Vectorized signed little-endian integer unpack of lengths[i] (at most 8) bytes at positions[i] in buf
+    """
+    value_bytes = buf[positions[:, None] + np.arange(8)]
+    is_negative = (lengths > 0) & (buf[positions + np.maximum(lengths, 1) - 1] >= 0x80)
+    sign_bytes = np.where(is_negative, 0xff, 0x00).astype(np.uint8)
+    value_bytes = np.where(np.arange(8) < lengths[:, None], value_bytes, sign_bytes[:, None])
+    return value_bytes.view('<i8').ravel()
+
+
+def bej_unpack_numeric_array(data, array_member_count):
+    """
+    Unpacks the elements of an array whose elements are all BEJ Integers or all BEJ Reals. The SFL headers are walked
+    once to find where every value starts, then the integer values are converted in one vectorized pass.
+
+    Args:
+        data: bytes of the array elements (everything after the element count)
+        array_member_count: number of elements in the array
+
+    Return: NumPy int64/float64 array (array.array of 'q'/'d' if NumPy is not installed), or None if the elements
+    are not all Integers or all Reals
+    """
+    formats = set()
+    value_positions = []
+    lengths = []
+    pos = 0
+    try:
+        for i in range(0, array_member_count):
+            format_pos = pos + 1 + data[pos]
+            length_pos = format_pos + 1
+            value_pos = length_pos + 1 + data[length_pos]
+            length = int.from_bytes(data[length_pos + 1:value_pos], 'little')
+
+            formats.add(data[format_pos] >> 4)
+            value_positions.append(value_pos)
+            lengths.append(length)
+            pos = value_pos + length
+    except IndexError:
+        return None
+
+    if pos != len(data) or len(formats) != 1:
+        return None
+
+    format = formats.pop()
+    if format == BEJ_FORMAT_INTEGER:
+        if max(lengths) > 8:
+            return None
+        if np is None:
+            return array.array('q', [int.from_bytes(data[value_pos:value_pos + length], 'little', signed=True)
+                                     for value_pos, length in zip(value_positions, lengths)])
+        return bej_unpack_signed_integers(np.frombuffer(data + bytes(8), dtype=np.uint8),
+                                          np.array(value_positions, dtype=np.int64),
+                                          np.array(lengths, dtype=np.int64))
+
+    if format == BEJ_FORMAT_REAL:
+        stream = io.BytesIO(data)
+        values = [bej_unpack_sflv_real(stream)[1] for i in range(0, array_member_count)]
+        return array.array('d', values) if np is None else np.array(values, dtype=np.float64)
+
+    return None
+
+
 def get_stream_size(stream):
     current_pos = stream.tell()
     stream.seek(0, os.SEEK_END)
@@ -209,6 +311,16 @@ def get_stream_size(stream):
 
 current_available_pdr = 0
 
+# Globals for parallel array decoding - Warning! not thread safe
+parallel_array_workers = 0
+parallel_array_threshold = PARALLEL_ARRAY_THRESHOLD
+parallel_array_pool = None
+parallel_array_dictionaries = None
+parallel_array_entries_cache = None
+
+# Result of bej_decode_columns(): number of decoded streams and a dict of leaf path -> (values, validity)
+BejColumns = namedtuple('BejColumns', 'count columns')
+
 
 def get_link_from_pdr_map(pdr, pdr_map):
     for key, value in pdr_map.items():
@@ -218,6 +330,21 @@ def get_link_from_pdr_map(pdr, pdr_map):
 
 
 def load_dictionary_subset_by_key_sequence(schema_dict, offset, child_count):
+    # worker processes and batch decodes use the same dictionaries throughout, so they index every set once
+    if parallel_array_entries_cache is not None:
+        cache_key = (id(schema_dict), offset, child_count)
+        if cache_key not in parallel_array_entries_cache:
+            parallel_array_entries_cache[cache_key] = load_dictionary_subset_by_key_sequence_uncached(
+                schema_dict, offset, child_count)
+        return parallel_array_entries_cache[cache_key]
+
+    return load_dictionary_subset_by_key_sequence_uncached(schema_dict, offset, child_count)
+
+
+def load_dictionary_subset_by_key_sequence_uncached(schema_dict, offset, child_count):
+    if isinstance(schema_dict, BinaryDictionary):
+        return schema_dict.get_entries_by_sequence(offset, child_count)
+
     schema_dict_stream = DictionaryByteArrayStream(schema_dict, offset, child_count)
 
     entry_dict = {}
@@ -252,7 +379,7 @@ def bej_decode_enum_value(dict_to_use, dict_entry, value):
     return enum_value
 
 
-def bej_decode_name(annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector, output_stream):
+def bej_get_name(annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector):
     if (selector == entries_by_seq_selector) and ((flags & BEJ_FLAG_NESTED_TOP_LEVEL_ANNOTATION) == 0):
         name = entries_by_seq[seq][DICTIONARY_ENTRY_NAME]
     elif selector == BEJ_DICTIONARY_SELECTOR_ANNOTATION:
@@ -260,15 +387,25 @@ def bej_decode_name(annot_dict, seq, selector, flags, entries_by_seq, entries_by
     else:
         name = entries_by_seq[seq][DICTIONARY_ENTRY_NAME]
 
+    return name
+
+
+def bej_decode_name(annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector, output_stream):
+    name = bej_get_name(annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector)
+
     if name != '':
         output_stream.write('"' + name + '":')
 
 
-def bej_decode_property_annotation_name(annot_dict, annot_seq, prop_seq, entries_by_seq, output_stream):
+def bej_get_property_annotation_name(annot_dict, annot_seq, prop_seq, entries_by_seq):
     prop_name = entries_by_seq[prop_seq][DICTIONARY_ENTRY_NAME]
     annot_name = get_full_annotation_name_from_sequence_number(annot_seq, annot_dict)
 
-    output_stream.write('"' + prop_name + annot_name + '":')
+    return prop_name + annot_name
+
+
+def bej_decode_property_annotation_name(annot_dict, annot_seq, prop_seq, entries_by_seq, output_stream):
+    output_stream.write('"' + bej_get_property_annotation_name(annot_dict, annot_seq, prop_seq, entries_by_seq) + '":')
 
 
 def get_annotation_dictionary_entries_by_seq(annotation_dictionary):
@@ -298,8 +435,212 @@ def get_entry_by_seq(schema_dict, annot_dict, seq, selector, flags, entries_by_s
     return entries_by_seq[seq]
 
 
-def bej_decode_stream(output_stream, input_stream, schema_dict, annot_dict, entries_by_seq, entries_by_seq_selector,
-                      prop_count, is_seq_array_index, add_name, deferred_binding_strings):
+def bej_decode_parallel_worker_init(schema_dict, annot_dict, pdr_map, deferred_binding_strings, numeric_arrays):
+    """
+    Initializes a worker process that decodes slices of large arrays
+    """
+    global parallel_array_workers, parallel_array_pool, parallel_array_dictionaries, parallel_array_entries_cache
+    # workers always decode their slice serially
+    parallel_array_workers = 0
+    parallel_array_pool = None
+    parallel_array_dictionaries = (schema_dict, annot_dict, pdr_map, deferred_binding_strings, numeric_arrays)
+    parallel_array_entries_cache = {}
+
+
+def bej_decode_array_slice(selector, offset, child_count, slice_bytes, slice_member_count):
+    """
+    Decodes a contiguous slice of array elements in a worker process
+
+    Return:
+        Tuple (success, decoded JSON text of the elements separated by commas)
+    """
+    schema_dict, annot_dict, pdr_map, deferred_binding_strings, numeric_arrays = parallel_array_dictionaries
+    dict_to_use = schema_dict if selector is BEJ_DICTIONARY_SELECTOR_MAJOR_SCHEMA else annot_dict
+
+    output_stream = io.StringIO()
+    success = bej_decode_stream(output_stream, io.BytesIO(slice_bytes), schema_dict, annot_dict,
+                                load_dictionary_subset_by_key_sequence(dict_to_use, offset, child_count),
+                                selector,
+                                prop_count=slice_member_count, is_seq_array_index=True, add_name=False,
+                                deferred_binding_strings=deferred_binding_strings, pdr_map=pdr_map,
+                                numeric_arrays=numeric_arrays)
+    return success, output_stream.getvalue()
+
+
+def bej_decode_array_parallel(output_stream, input_stream, schema_dict, annot_dict, entry, selector,
+                              array_member_count, pdr_map, deferred_binding_strings, numeric_arrays):
+    """
+    Decodes the elements of a large array by splitting them into contiguous slices that are decoded by a pool of
+    worker processes. The element boundaries are found from the SFL lengths alone, and the decoded slices are
+    written to output_stream in element order.
+    """
+    global parallel_array_pool
+    if parallel_array_pool is None:
+        parallel_array_pool = ProcessPoolExecutor(max_workers=parallel_array_workers,
+                                                  initializer=bej_decode_parallel_worker_init,
+                                                  initargs=(schema_dict, annot_dict, pdr_map,
+                                                            deferred_binding_strings, numeric_arrays))
+
+    positions = bej_scan_array_elements(input_stream, array_member_count)
+    end_pos = input_stream.tell()
+
+    futures = []
+    for start, end in split_array_range(array_member_count, parallel_array_workers):
+        input_stream.seek(positions[start], os.SEEK_SET)
+        slice_bytes = input_stream.read(positions[end] - positions[start])
+        futures.append(parallel_array_pool.submit(bej_decode_array_slice, selector, entry[DICTIONARY_ENTRY_OFFSET],
+                                                  entry[DICTIONARY_ENTRY_CHILD_COUNT], slice_bytes, end - start))
+    input_stream.seek(end_pos, os.SEEK_SET)
+
+    success = True
+    for index, future in enumerate(futures):
+        slice_success, decoded_slice = future.result()
+        success = success and slice_success
+        if index > 0:
+            output_stream.write(',')
+        output_stream.write(decoded_slice)
+
+    return success
+
+
+def bej_try_unpack_numeric_array(input_stream, array_start_pos, length, array_member_count):
+    """
+    Unpacks a large array with bej_unpack_numeric_array() and leaves the stream past its end. Returns None and leaves
+    the stream at the first element if the array is small, its first element is not an Integer or a Real, or its
+    elements do not all have the same format.
+    """
+    if array_member_count < VECTORIZED_ARRAY_THRESHOLD \
+            or bej_typeof(input_stream)[0] not in (BEJ_FORMAT_INTEGER, BEJ_FORMAT_REAL):
+        return None
+
+    elements_pos = input_stream.tell()
+    values = bej_unpack_numeric_array(bej_read_complex_type_value(input_stream, array_start_pos, length),
+                                      array_member_count)
+    if values is None:
+        input_stream.seek(elements_pos, os.SEEK_SET)
+    return values
+
+
+class BejTextWriter:
+    """
+    Writes the values that bej_decode_properties() decodes as JSON text
+    """
+    parallel_arrays = True
+
+    def __init__(self, output_stream):
+        self.output_stream = output_stream
+
+    def name(self, name):
+        if name != '':
+            self.output_stream.write('"' + name + '":')
+
+    def separator(self):
+        self.output_stream.write(',')
+
+    def start_set(self):
+        self.output_stream.write('{')
+
+    def end_set(self):
+        self.output_stream.write('}')
+
+    def start_array(self):
+        self.output_stream.write('[')
+
+    def end_array(self):
+        self.output_stream.write(']')
+
+    def numeric_array(self, values):
+        self.output_stream.write('[' + ','.join(map(str, values.tolist())) + ']')
+
+    def string(self, value):
+        self.output_stream.write('"' + value + '"')
+
+    def number(self, value):
+        self.output_stream.write(str(value))
+
+    def boolean(self, value):
+        self.output_stream.write(value)
+
+    def null(self):
+        self.output_stream.write('null')
+
+    def contents(self):
+        return self.output_stream.getvalue()
+
+
+class BejObjectWriter:
+    """
+    Builds Python objects (dict, list, str, int, float, bool and None) from the values that bej_decode_properties()
+    decodes. The decoded (name, value) pairs are in properties.
+    """
+    parallel_arrays = False
+
+    def __init__(self):
+        self.properties = []
+        self._name = ''
+        self._parents = []
+
+    def add(self, value):
+        self.properties.append((self._name, value))
+        self._name = ''
+
+    def name(self, name):
+        self._name = name
+
+    def separator(self):
+        pass
+
+    def start_set(self):
+        self._parents.append((self._name, self.properties))
+        self._name = ''
+        self.properties = []
+
+    def end_set(self):
+        members = self.properties
+        self._name, self.properties = self._parents.pop()
+        self.add(dict(members))
+
+    def start_array(self):
+        self.start_set()
+
+    def end_array(self):
+        members = self.properties
+        self._name, self.properties = self._parents.pop()
+        self.add([value for name, value in members])
+
+    def numeric_array(self, values):
+        self.add(values)
+
+    def string(self, value):
+        # strings are stored with JSON escape sequences
+        self.add(json.loads('"' + value + '"'))
+
+    def number(self, value):
+        self.add(value)
+
+    def boolean(self, value):
+        self.add(value == 'true')
+
+    def null(self):
+        self.add(None)
+
+    def contents(self):
+        return repr(self.properties)
+
+
+def bej_decode_properties(writer, input_stream, schema_dict, annot_dict, entries_by_seq, entries_by_seq_selector,
+                          prop_count, is_seq_array_index, add_name, pdr_map, deferred_binding_strings,
+                          numeric_arrays):
+    """
+    Decodes prop_count properties and hands their names and values to writer, a BejTextWriter or a BejObjectWriter
+
+    Args:
+        numeric_arrays: Decode arrays whose elements are all Integers or all Reals in bulk, see
+        bej_unpack_numeric_array()
+
+    Return:
+        success
+    """
     index = 0
     success = True
     while success and input_stream.tell() < get_stream_size(input_stream) and index < prop_count:
@@ -314,29 +655,30 @@ def bej_decode_stream(output_stream, input_stream, schema_dict, annot_dict, entr
             entry = get_entry_by_seq(schema_dict, annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector)
 
             if add_name:
-                bej_decode_name(annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector, output_stream)
+                writer.name(bej_get_name(annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector))
 
             dict_to_use = schema_dict if selector is BEJ_DICTIONARY_SELECTOR_MAJOR_SCHEMA else annot_dict
-            output_stream.write('{')
+            writer.start_set()
 
-            success = bej_decode_stream(output_stream, input_stream, schema_dict, annot_dict,
-                                        load_dictionary_subset_by_key_sequence(
-                                            dict_to_use, entry[DICTIONARY_ENTRY_OFFSET], entry[DICTIONARY_ENTRY_CHILD_COUNT]),
-                                        selector,
-                                        count, is_seq_array_index=False, add_name=True, deferred_binding_strings=deferred_binding_strings)
-            output_stream.write('}')
+            success = bej_decode_properties(writer, input_stream, schema_dict, annot_dict,
+                                            load_dictionary_subset_by_key_sequence(
+                                                dict_to_use, entry[DICTIONARY_ENTRY_OFFSET],
+                                                entry[DICTIONARY_ENTRY_CHILD_COUNT]),
+                                            selector, count, False, True, pdr_map, deferred_binding_strings,
+                                            numeric_arrays)
+            writer.end_set()
 
             # validate the length
             if not validate_complex_type_length(input_stream, set_start_pos, length):
                 print('BEJ decoding error: Invalid length/count for set. Current stream contents:',
-                      output_stream.getvalue())
+                      writer.contents())
                 return False
 
         elif format == BEJ_FORMAT_STRING:
             is_deferred_binding = bej_is_deferred_binding(input_stream)
             [seq, selector], value = bej_unpack_sflv_string(input_stream)
             if add_name:
-                bej_decode_name(annot_dict, seq, selector, flags,  entries_by_seq, entries_by_seq_selector, output_stream)
+                writer.name(bej_get_name(annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector))
 
             if is_deferred_binding:
                 bindings_to_resolve = re.findall('(%[BCMSU]|%[LTPI][0-9]+|%PF[0-9a-f]+)\.?[0-9]*.*?', value)
@@ -344,35 +686,35 @@ def bej_decode_stream(output_stream, input_stream, schema_dict, annot_dict, entr
                     if binding in deferred_binding_strings:
                         value = value.replace(binding, deferred_binding_strings[binding])
 
-            output_stream.write('"' + value + '"')
+            writer.string(value)
 
         elif format == BEJ_FORMAT_INTEGER:
             [seq, selector], value = bej_unpack_sflv_integer(input_stream)
             if add_name:
-                bej_decode_name(annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector, output_stream)
+                writer.name(bej_get_name(annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector))
 
-            output_stream.write(str(value))
+            writer.number(value)
 
         elif format == BEJ_FORMAT_REAL:
             [seq, selector], value = bej_unpack_sflv_real(input_stream)
             if add_name:
-                bej_decode_name(annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector, output_stream)
+                writer.name(bej_get_name(annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector))
 
-            output_stream.write(str(value))
+            writer.number(value)
 
         elif format == BEJ_FORMAT_BOOLEAN:
             [seq, selector], value = bej_unpack_sflv_boolean(input_stream)
             if add_name:
-                bej_decode_name(annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector, output_stream)
+                writer.name(bej_get_name(annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector))
 
-            output_stream.write(value)
+            writer.boolean(value)
 
         elif format == BEJ_FORMAT_RESOURCE_LINK:
             [seq, selector], pdr = bej_unpack_sflv_resource_link(input_stream)
             if add_name:
-                bej_decode_name(annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector, output_stream)
+                writer.name(bej_get_name(annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector))
 
-            output_stream.write('"' + get_link_from_pdr_map(pdr) + '"')
+            writer.string(get_link_from_pdr_map(pdr, pdr_map))
 
         elif format == BEJ_FORMAT_ENUM:
             [seq, selector], value = bej_unpack_sflv_enum(input_stream)
@@ -380,19 +722,19 @@ def bej_decode_stream(output_stream, input_stream, schema_dict, annot_dict, entr
                 seq = 0
 
             if add_name:
-                bej_decode_name(annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector, output_stream)
+                writer.name(bej_get_name(annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector))
 
             dict_to_use = schema_dict if selector is BEJ_DICTIONARY_SELECTOR_MAJOR_SCHEMA else annot_dict
-            enum_value = bej_decode_enum_value(dict_to_use, get_entry_by_seq(schema_dict, annot_dict, seq, selector,
-                                                                             flags, entries_by_seq, entries_by_seq_selector), value)
-            output_stream.write('"' + enum_value + '"')
+            writer.string(bej_decode_enum_value(dict_to_use, get_entry_by_seq(schema_dict, annot_dict, seq, selector,
+                                                                              flags, entries_by_seq,
+                                                                              entries_by_seq_selector), value))
 
         elif format == BEJ_FORMAT_NULL:
             [seq, selector] = bej_unpack_sflv_null(input_stream)
             if add_name:
-                bej_decode_name(annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector, output_stream)
+                writer.name(bej_get_name(annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector))
 
-            output_stream.write('null')
+            writer.null()
 
         elif format == BEJ_FORMAT_ARRAY:
             array_start_pos = input_stream.tell()
@@ -404,28 +746,37 @@ def bej_decode_stream(output_stream, input_stream, schema_dict, annot_dict, entr
             entry = get_entry_by_seq(schema_dict, annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector)
 
             if add_name:
-                bej_decode_name(annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector, output_stream)
-
-            output_stream.write('[')
-            for i in range(0, array_member_count):
-                success = bej_decode_stream(output_stream, input_stream, schema_dict, annot_dict,
-                                            load_dictionary_subset_by_key_sequence(dict_to_use, entry[DICTIONARY_ENTRY_OFFSET],
-                                                                                   entry[DICTIONARY_ENTRY_CHILD_COUNT]),
-                                            selector,
-                                            prop_count=1, is_seq_array_index=True, add_name=False,
-                                            deferred_binding_strings=deferred_binding_strings)
-                if i < array_member_count-1:
-                    output_stream.write(',')
-
-            output_stream.write(']')
+                writer.name(bej_get_name(annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector))
+
+            values = None
+            if numeric_arrays:
+                values = bej_try_unpack_numeric_array(input_stream, array_start_pos, length, array_member_count)
+
+            if values is not None:
+                writer.numeric_array(values)
+            elif writer.parallel_arrays and parallel_array_workers > 1 \
+                    and array_member_count >= parallel_array_threshold:
+                writer.start_array()
+                success = bej_decode_array_parallel(writer.output_stream, input_stream, schema_dict, annot_dict,
+                                                    entry, selector, array_member_count, pdr_map,
+                                                    deferred_binding_strings, numeric_arrays)
+                writer.end_array()
+            else:
+                writer.start_array()
+                success = bej_decode_properties(writer, input_stream, schema_dict, annot_dict,
+                                                load_dictionary_subset_by_key_sequence(
+                                                    dict_to_use, entry[DICTIONARY_ENTRY_OFFSET],
+                                                    entry[DICTIONARY_ENTRY_CHILD_COUNT]),
+                                                selector, array_member_count, True, False, pdr_map,
+                                                deferred_binding_strings, numeric_arrays)
+                writer.end_array()
 
             # validate the length
             if not validate_complex_type_length(input_stream, array_start_pos, length):
                 print('BEJ decoding error: Invalid length/count for array. Current stream contents:',
-                      output_stream.getvalue())
+                      writer.contents())
                 return False
 
-
         elif format == BEJ_FORMAT_PROPERTY_ANNOTATION:
             # Seq(property sequence #)
             #    Format(bejPropertyAnnotation)
@@ -437,26 +788,219 @@ def bej_decode_stream(output_stream, input_stream, schema_dict, annot_dict, entr
             # e.g Status@Message.ExtendedInfo
 
             annot_seq, prop_seq = bej_unpack_property_annotation_start(input_stream)
-            bej_decode_property_annotation_name(annot_dict, annot_seq, prop_seq, entries_by_seq,
-                                                output_stream)
-
-            success = bej_decode_stream(output_stream, input_stream, schema_dict, annot_dict,
-                                        get_annotation_dictionary_entries_by_seq(annot_dict),
-                                        BEJ_DICTIONARY_SELECTOR_ANNOTATION,
-                                        prop_count=1, is_seq_array_index=False, add_name=False,
-                                        deferred_binding_strings=deferred_binding_strings)
+            writer.name(bej_get_property_annotation_name(annot_dict, annot_seq, prop_seq, entries_by_seq))
+
+            success = bej_decode_properties(writer, input_stream, schema_dict, annot_dict,
+                                            get_annotation_dictionary_entries_by_seq(annot_dict),
+                                            BEJ_DICTIONARY_SELECTOR_ANNOTATION, 1, False, False, pdr_map,
+                                            deferred_binding_strings, numeric_arrays)
         else:
             success = False
 
         if index < prop_count-1:
-            output_stream.write(',')
+            writer.separator()
         index += 1
 
     return success
 
 
+def bej_decode_stream(output_stream, input_stream, schema_dict, annot_dict, entries_by_seq, entries_by_seq_selector,
+                      prop_count, is_seq_array_index, add_name, deferred_binding_strings, pdr_map=None,
+                      numeric_arrays=False):
+    """
+    Decodes prop_count properties as JSON text into output_stream
+    """
+    return bej_decode_properties(BejTextWriter(output_stream), input_stream, schema_dict, annot_dict, entries_by_seq,
+                                 entries_by_seq_selector, prop_count, is_seq_array_index, add_name,
+                                 pdr_map if pdr_map is not None else {}, deferred_binding_strings, numeric_arrays)
+
+
+def bej_decode_stream_object(input_stream, schema_dict, annot_dict, entries_by_seq, entries_by_seq_selector,
+                             prop_count, is_seq_array_index, add_name, pdr_map, deferred_binding_strings,
+                             numeric_arrays):
+    """
+    Object mode counterpart of bej_decode_stream(), decodes prop_count properties into Python objects
+
+    Return:
+        Tuple (success, list of (name, value) tuples)
+    """
+    writer = BejObjectWriter()
+    success = bej_decode_properties(writer, input_stream, schema_dict, annot_dict, entries_by_seq,
+                                    entries_by_seq_selector, prop_count, is_seq_array_index, add_name, pdr_map,
+                                    deferred_binding_strings, numeric_arrays)
+    return success, writer.properties
+
+
+def bej_decode_stream_columns(input_stream, schema_dict, annot_dict, entries_by_seq, entries_by_seq_selector,
+                              prop_count, add_name, path, row, row_count, columns, pdr_map, deferred_binding_strings):
+    """
+    Flattens prop_count properties of one payload into columns, keyed by the '/' separated path of each leaf.
+    Sets are walked in place, every other format is decoded by bej_decode_stream_object()
+
+    Return:
+        success
+    """
+    index = 0
+    success = True
+    while success and input_stream.tell() < get_stream_size(input_stream) and index < prop_count:
+        property_start_pos = input_stream.tell()
+        format, flags = bej_typeof(input_stream)
+
+        if format == BEJ_FORMAT_SET:
+            set_start_pos = input_stream.tell()
+            [seq, selector], length, count = bej_unpack_set_start(input_stream)
+            entry = get_entry_by_seq(schema_dict, annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector)
+
+            name = ''
+            if add_name:
+                name = bej_get_name(annot_dict, seq, selector, flags, entries_by_seq, entries_by_seq_selector)
+
+            dict_to_use = schema_dict if selector is BEJ_DICTIONARY_SELECTOR_MAJOR_SCHEMA else annot_dict
+            success = bej_decode_stream_columns(input_stream, schema_dict, annot_dict,
+                                                load_dictionary_subset_by_key_sequence(
+                                                    dict_to_use, entry[DICTIONARY_ENTRY_OFFSET],
+                                                    entry[DICTIONARY_ENTRY_CHILD_COUNT]),
+                                                selector, count, True, path + name + '/' if name else path,
+                                                row, row_count, columns, pdr_map, deferred_binding_strings)
+
+            # validate the length
+            if not validate_complex_type_length(input_stream, set_start_pos, length):
+                print('BEJ decoding error: Invalid length/count for set')
+                return False
+        else:
+            input_stream.seek(property_start_pos, os.SEEK_SET)
+            success, properties = bej_decode_stream_object(input_stream, schema_dict, annot_dict, entries_by_seq,
+                                                           entries_by_seq_selector, 1, False, True, pdr_map,
+                                                           deferred_binding_strings, True)
+            for name, value in properties:
+                if path + name not in columns:
+                    columns[path + name] = ([None] * row_count, [False] * row_count)
+                values, validity = columns[path + name]
+                values[row] = value
+                validity[row] = True
+
+        index += 1
+
+    return success
+
+
+def bej_unpack_header(input_stream):
+    """
+    Strips off the BEJ header and returns the schema class
+    """
+    version = input_stream.read(4)
+    assert((version == bytes([0x00, 0xF0, 0xF0, 0xF1])) or (version == bytes([0x00, 0xF0, 0xF1, 0xF1])))
+    flags = input_stream.read(2)
+    assert (flags == bytes([0x00, 0x00]))
+    schemaClass = input_stream.read(1)
+    assert(schemaClass in [bytes([0x00]), bytes([0x01]), bytes([0x04])])
+
+    return schemaClass
+
+
+def bej_decode_object(input_stream, schema_dictionary, annotation_dictionary, error_dictionary, pdr_map,
+                      def_binding_strings, numeric_arrays=False):
+    """
+    Decode a BEJ stream into Python objects (dict, list, str, int, float, bool and None) instead of JSON text
+
+    Args:
+        input_stream:
+        schema_dictionary:
+        annotation_dictionary:
+        error_dictionary:
+        pdr_map:
+        def_binding_strings:
+        numeric_arrays: Set to True to return arrays whose elements are all Integers or all Reals as NumPy arrays
+        (array.array if NumPy is not installed)
+
+    Returns:
+        Tuple (success, decoded object)
+    """
+    schemaClass = bej_unpack_header(input_stream)
+    if schemaClass == bytes([0x00]) or schemaClass == bytes([0x01]): # Major schema class or Event
+        dict_to_use = schema_dictionary
+    else: # Error schema class
+        dict_to_use = error_dictionary
+
+    success, properties = bej_decode_stream_object(input_stream, dict_to_use, annotation_dictionary,
+                                                   load_dictionary_subset_by_key_sequence(dict_to_use, 0, -1),
+                                                   BEJ_DICTIONARY_SELECTOR_MAJOR_SCHEMA, 1, False, False, pdr_map,
+                                                   def_binding_strings, numeric_arrays)
+    return success, properties[0][1] if success and properties else None
+
+
+def bej_build_column(values, validity):
+    """
+    Converts a column of leaf values to a NumPy int64/float64 array when every present value is an Integer or a Real.
+    Missing integers are stored as 0 and missing reals as NaN, the validity mask tells them apart
+    """
+    if np is None:
+        return values, validity
+
+    present = [value for value, valid in zip(values, validity) if valid]
+    mask = np.array(validity, dtype=bool)
+    if present and all(type(value) is int for value in present):
+        try:
+            return np.array([value if valid else 0 for value, valid in zip(values, validity)], dtype=np.int64), mask
+        except OverflowError:
+            pass
+    elif present and all(type(value) in (int, float) for value in present):
+        return np.array([value if valid else np.nan for value, valid in zip(values, validity)],
+                        dtype=np.float64), mask
+
+    return values, mask
+
+
+def bej_decode_columns(input_streams, schema_dictionary, annotation_dictionary, error_dictionary, pdr_map,
+                       def_binding_strings):
+    """
+    Decode a batch of BEJ streams that share the same dictionaries into columns, one per leaf property path, instead
+    of one object per stream
+
+    Args:
+        input_streams: list of BEJ streams
+        schema_dictionary:
+        annotation_dictionary:
+        error_dictionary:
+        pdr_map:
+        def_binding_strings:
+
+    Returns:
+        Tuple (success, BejColumns). Each column is a (values, validity) tuple where values is a NumPy array for
+        Integer/Real leaves (a list otherwise) and validity marks the streams in which the leaf is present
+    """
+    global parallel_array_entries_cache
+    row_count = len(input_streams)
+    columns = {}
+
+    # every stream is decoded against the same dictionaries, so index each set only once for the whole batch
+    saved_entries_cache = parallel_array_entries_cache
+    if parallel_array_entries_cache is None:
+        parallel_array_entries_cache = {}
+
+    try:
+        for row, input_stream in enumerate(input_streams):
+            schemaClass = bej_unpack_header(input_stream)
+            if schemaClass == bytes([0x00]) or schemaClass == bytes([0x01]): # Major schema class or Event
+                dict_to_use = schema_dictionary
+            else: # Error schema class
+                dict_to_use = error_dictionary
+
+            if not bej_decode_stream_columns(input_stream, dict_to_use, annotation_dictionary,
+                                             load_dictionary_subset_by_key_sequence(dict_to_use, 0, -1),
+                                             BEJ_DICTIONARY_SELECTOR_MAJOR_SCHEMA, 1, False, '', row, row_count,
+                                             columns, pdr_map, def_binding_strings):
+                return False, None
+    finally:
+        parallel_array_entries_cache = saved_entries_cache
+
+    return True, BejColumns(row_count, {path: bej_build_column(values, validity)
+                                        for path, (values, validity) in columns.items()})
+
+
 def bej_decode(output_stream, input_stream, schema_dictionary, annotation_dictionary,
-               error_dictionary, pdr_map, def_binding_strings):
+               error_dictionary, pdr_map, def_binding_strings, parallel_workers=0,
+               parallel_threshold=PARALLEL_ARRAY_THRESHOLD, numeric_arrays=False):
     """
     Decode a BEJ stream into JSON
 
@@ -468,28 +1012,35 @@ def bej_decode(output_stream, input_stream, schema_dictionary, annotation_dictio
         error_dictionary:
         pdr_map:
         def_binding_strings:
+        parallel_workers: Number of worker processes used to decode large arrays, 0 or 1 decodes serially
+        parallel_threshold: Minimum number of elements in an array before it is split across the worker processes
+        numeric_arrays: Set to True to decode arrays whose elements are all Integers or all Reals in bulk
 
     Returns:
     """
-    resource_link_to_pdr_map = pdr_map
-    # strip off the headers
-    version = input_stream.read(4)
-    assert((version == bytes([0x00, 0xF0, 0xF0, 0xF1])) or (version == bytes([0x00, 0xF0, 0xF1, 0xF1])))
-    flags = input_stream.read(2)
-    assert (flags == bytes([0x00, 0x00]))
-    schemaClass = input_stream.read(1)
-    assert(schemaClass in [bytes([0x00]), bytes([0x01]), bytes([0x04])])
-
-    if schemaClass == bytes([0x00]) or schemaClass == bytes([0x01]): # Major schema class or Event
-        return bej_decode_stream(output_stream, input_stream, schema_dictionary, annotation_dictionary,
-                                 load_dictionary_subset_by_key_sequence(schema_dictionary, 0, -1),
-                                 BEJ_DICTIONARY_SELECTOR_MAJOR_SCHEMA,
-                                 1, is_seq_array_index=False, add_name=False,
-                                 deferred_binding_strings=def_binding_strings)
-    else: # Error schema class
-        return bej_decode_stream(output_stream, input_stream, error_dictionary, annotation_dictionary,
-                                 load_dictionary_subset_by_key_sequence(error_dictionary, 0, -1),
-                                 BEJ_DICTIONARY_SELECTOR_MAJOR_SCHEMA,
-                                 1, is_seq_array_index=False, add_name=False,
-                                 deferred_binding_strings=def_binding_strings)
+    global parallel_array_workers, parallel_array_threshold, parallel_array_pool
+    parallel_array_workers = parallel_workers
+    parallel_array_threshold = parallel_threshold
 
+    # strip off the headers
+    schemaClass = bej_unpack_header(input_stream)
+
+    try:
+        if schemaClass == bytes([0x00]) or schemaClass == bytes([0x01]): # Major schema class or Event
+            return bej_decode_stream(output_stream, input_stream, schema_dictionary, annotation_dictionary,
+                                     load_dictionary_subset_by_key_sequence(schema_dictionary, 0, -1),
+                                     BEJ_DICTIONARY_SELECTOR_MAJOR_SCHEMA,
+                                     1, is_seq_array_index=False, add_name=False,
+                                     deferred_binding_strings=def_binding_strings, pdr_map=pdr_map,
+                                     numeric_arrays=numeric_arrays)
+        else: # Error schema class
+            return bej_decode_stream(output_stream, input_stream, error_dictionary, annotation_dictionary,
+                                     load_dictionary_subset_by_key_sequence(error_dictionary, 0, -1),
+                                     BEJ_DICTIONARY_SELECTOR_MAJOR_SCHEMA,
+                                     1, is_seq_array_index=False, add_name=False,
+                                     deferred_binding_strings=def_binding_strings, pdr_map=pdr_map,
+                                     numeric_arrays=numeric_arrays)
+    finally:
+        if parallel_array_pool:
+            parallel_array_pool.shutdown()
+            parallel_array_pool = None
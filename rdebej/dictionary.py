@@ -25,8 +25,14 @@ from collections import namedtuple
 from copy import deepcopy
 import binascii
 import glob
+import fnmatch
 import collections
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
 from ._internal_utils import *
+from . import _internal_utils
 from functools import cmp_to_key
 
 # OData types
@@ -38,6 +44,9 @@ ODATA_NAVIGATION_PROPERTY = '{http://docs.oasis-open.org/odata/ns/edm}Navigation
 ODATA_ACTION_TYPE = '{http://docs.oasis-open.org/odata/ns/edm}Action'
 ODATA_PARAMETER_TYPE = '{http://docs.oasis-open.org/odata/ns/edm}Parameter'
 ODATA_TERM_TYPE = '{http://docs.oasis-open.org/odata/ns/edm}Term'
+ODATA_PROPERTY = '{http://docs.oasis-open.org/odata/ns/edm}Property'
+ODATA_ANNOTATION = '{http://docs.oasis-open.org/odata/ns/edm}Annotation'
+ODATA_ALL_ELEMENTS = '{http://docs.oasis-open.org/odata/ns/edm}*'
 ODATA_ALL_NAMESPACES = {'edm': 'http://docs.oasis-open.org/odata/ns/edm', 'edmx': 'http://docs.oasis-open.org/odata/ns/edmx'}
 
 # Optimization: check to see if dictionary already contains an entry for the complex type/enum.
@@ -65,14 +74,46 @@ ENTITY_REPO_ENTRY_REFERENCE = 4
 ENTITY_REPO_ENTRY_AUTO_EXPAND = 5
 
 # Global variable to set verbosity.
-includeNamespaces = {} # Dict to build a list of namespaces that will be used to build the dictionary
 verbose = False
 silent = False
 
+# State of the dictionary build running on the current thread: the active DictionaryBuilder and the schema files and
+# globs the dictionary depends on, see record_dependencies()
+build_state = threading.local()
+
+# Digest of the modules that generate dictionaries, see get_generator_digest()
+generator_digest = None
+
 EntityOffsetMapTuple = namedtuple('EntityOffsetMapTuple', 'offset offset_to_array count')
 
 PROPERTY_PATH = 'descendant-or-self::edm:Property | edm:NavigationProperty'
 
+SCHEMA_VERSION_REGEX = re.compile('\.v(\d+)_(\d+)_(\d+)\.json')
+
+REDFISH_REVISION_KIND_ADDED = 'Redfish.RevisionKind/Added'
+
+# Annotations of a CSDL element collected by get_element_annotations()
+ElementAnnotations = namedtuple('ElementAnnotations', 'permissions excerpts is_auto_expand revision_kinds added_record')
+AnnotatedElement = namedtuple('AnnotatedElement', 'element annotations')
+
+# Precompiled XPath expressions used while extracting the types of a CSDL document
+compiled_xpaths = {} # Dict of the XPath expressions compiled by get_xpath()
+XPATH_SCHEMAS = etree.XPath('//edm:Schema', namespaces=ODATA_ALL_NAMESPACES)
+XPATH_PARENT_SCHEMA = etree.XPath('parent::edm:Schema', namespaces=ODATA_ALL_NAMESPACES)
+XPATH_ENTITY_AND_COMPLEX_TYPES = etree.XPath('//edm:EntityType | //edm:ComplexType', namespaces=ODATA_ALL_NAMESPACES)
+XPATH_ENUM_TYPES = etree.XPath('//edm:EnumType', namespaces=ODATA_ALL_NAMESPACES)
+XPATH_ENUM_MEMBERS = etree.XPath('child::edm:Member', namespaces=ODATA_ALL_NAMESPACES)
+XPATH_ACTIONS = etree.XPath('//edm:Action', namespaces=ODATA_ALL_NAMESPACES)
+XPATH_ACTION_PARAMETERS = etree.XPath('child::edm:Parameter', namespaces=ODATA_ALL_NAMESPACES)
+XPATH_TYPE_PROPERTIES = etree.XPath('edm:Property | edm:NavigationProperty', namespaces=ODATA_ALL_NAMESPACES)
+XPATH_REVISION_RECORDS = etree.XPath('edm:Collection/edm:Record', namespaces=ODATA_ALL_NAMESPACES)
+XPATH_REVISION_KIND = etree.XPath('child::edm:PropertyValue[@Property="Kind"]', namespaces=ODATA_ALL_NAMESPACES)
+XPATH_REVISION_VERSION = etree.XPath('child::edm:PropertyValue[@Property=\'Version\']', namespaces=ODATA_ALL_NAMESPACES)
+
+# Format version of the files in the CSDL cache directory and the number of extractions kept per document
+CSDL_CACHE_VERSION = 1
+CSDL_CACHE_MAX_EXTRACTIONS = 8
+
 
 def get_base_properties(entity_type):
     """
@@ -143,74 +184,130 @@ def is_property_nullable(property):
     return property_is_nullable
 
 
-def get_property_permissions(property):
+def get_xpath(path):
     """
-    Returns whether the read-only versus read-write permissions for a property. If the permission is not set,
-    then the permission is null.
+    Returns the precompiled XPath expression for path, compiling it on first use
     """
-    permissions = property.xpath('child::edm:Annotation[@Term=\'OData.Permissions\']', namespaces=ODATA_ALL_NAMESPACES)
-    if len(permissions) == 1:
-        return 'Permission=' + permissions[0].get('EnumMember')[len('OData.Permission/'):]
-    return ''
+    xpath = compiled_xpaths.get(path)
+    if xpath is None:
+        xpath = etree.XPath(path, namespaces=ODATA_ALL_NAMESPACES)
+        compiled_xpaths[path] = xpath
+    return xpath
 
 
-# This will return excerpt annotations as a dictionary:
-# {ExcerptCopy:[A,B], Excerpt=[X, Y], ExcerptCopyOnly:[]}
-# Examples:
-# {ExcerptCopy:[], Excerpt=[Y]}
-# {ExcerptCopyOnly:[]}
-#
-def get_property_excerpts(property_element):
-    excerpt_dict = {}
+def get_element_annotations(element):
+    """
+    Collects the annotations of a CSDL element that the dictionary generator is interested in. The children of the
+    element are walked once and every annotation is dispatched on its term.
 
-    # Assumption: A property can be the source for an excerpt copy or could be the destination but cannot be both!
+    Args:
+        element: The Property, NavigationProperty, Parameter, Term or Member element
 
+    Return:
+        ElementAnnotations
+    """
+    permissions = []
+    excerpt_copies = []
+    excerpts = []
+    is_excerpt_copy_only = False
+    is_auto_expand = False
+    revision_kinds = []
+    added_record = None
+    for annotation in element.iterchildren(ODATA_ANNOTATION):
+        term = annotation.get('Term')
+        if term == 'OData.Permissions':
+            permissions.append(annotation)
+        elif term == 'Redfish.ExcerptCopy':
+            excerpt_copies.append(annotation)
+        elif term == 'Redfish.Excerpt':
+            excerpts.append(annotation)
+        elif term == 'Redfish.ExcerptCopyOnly':
+            is_excerpt_copy_only = True
+        elif term == 'OData.AutoExpand':
+            is_auto_expand = True
+        elif term == 'Redfish.Revisions':
+            # search for the 'Added' revision kind since there may be others such as 'Deprecated'.
+            for record in XPATH_REVISION_RECORDS(annotation):
+                props = XPATH_REVISION_KIND(record)
+                kind = props[0].get('EnumMember') if len(props) == 1 else None
+                revision_kinds.append(kind)
+                if kind == REDFISH_REVISION_KIND_ADDED:
+                    added_record = record
+
+    property_permissions = ''
+    if len(permissions) == 1:
+        property_permissions = 'Permission=' + permissions[0].get('EnumMember')[len('OData.Permission/'):]
+
+    # This will return excerpt annotations as a dictionary:
+    # {ExcerptCopy:[A,B], Excerpt=[X, Y], ExcerptCopyOnly:[]}
+    # Examples:
+    # {ExcerptCopy:[], Excerpt=[Y]}
+    # {ExcerptCopyOnly:[]}
+    #
+    # Assumption: A property can be the source for an excerpt copy or could be the destination but cannot be both!
+    #
     # Excerpt annotations applicable for destination:
     # ExcerptCopy is used to copy an excerpt from a source to the destination.
-    excerpt_copies = property_element.xpath('child::edm:Annotation[@Term=\'Redfish.ExcerptCopy\']',
-                                            namespaces=ODATA_ALL_NAMESPACES)
-    if len(excerpt_copies):
-        excerpt_dict['ExcerptCopy'] = []
-        for excerpt in excerpt_copies:
-            if excerpt.get("String"):
-                excerpt_dict['ExcerptCopy'].extend(excerpt.get("String").split(','))
-
+    #
     # Excerpt annotations applicable for source:
     # Excerpt specifies that the property can be a source for an ExcerptCopy and can exist as a property in the source.
     # ExcerptCopyOnly specifies that this property can be a source for an ExcerptCopy AND does NOT exist as a property
     # in the source'
-    excerpts = property_element.xpath('child::edm:Annotation[@Term=\'Redfish.Excerpt\']',
-                                      namespaces=ODATA_ALL_NAMESPACES)
-    if len(excerpts):
-        excerpt_dict['Excerpt'] = []
-        for excerpt in excerpts:
-            if excerpt.get("String"):
-                excerpt_dict['Excerpt'].extend(excerpt.get("String").split(','))
-
-    excerpt_copy_only = property_element.xpath('child::edm:Annotation[@Term=\'Redfish.ExcerptCopyOnly\']',
-                                               namespaces=ODATA_ALL_NAMESPACES)
-    if len(excerpt_copy_only):
+    excerpt_dict = {}
+    for key, annotations in (('ExcerptCopy', excerpt_copies), ('Excerpt', excerpts)):
+        if len(annotations):
+            excerpt_dict[key] = []
+            for excerpt in annotations:
+                if excerpt.get("String"):
+                    excerpt_dict[key].extend(excerpt.get("String").split(','))
+    if is_excerpt_copy_only:
         excerpt_dict['ExcerptCopyOnly'] = []
 
-    return excerpt_dict
+    return ElementAnnotations(property_permissions, excerpt_dict, is_auto_expand, revision_kinds, added_record)
+
+
+def get_added_version(annotations):
+    """
+    Returns the version string of the Redfish.Revisions Added record, or '' if the element has none
+    """
+    if annotations.added_record is None:
+        return ''
+    return XPATH_REVISION_VERSION(annotations.added_record)[0].get('String')
+
+
+def get_annotated_elements(some_type, path=PROPERTY_PATH):
+    """
+    Returns the elements matched by path under some_type together with their annotations
+    """
+    return [AnnotatedElement(element, get_element_annotations(element)) for element in get_xpath(path)(some_type)]
+
+
+def get_property_permissions(property):
+    """
+    Returns whether the read-only versus read-write permissions for a property. If the permission is not set,
+    then the permission is null.
+    """
+    return get_element_annotations(property).permissions
+
+
+def get_property_excerpts(property_element):
+    return get_element_annotations(property_element).excerpts
 
 
 # Returns true if the entity has at least one property that has the Redfish.Revisions Added annotation
-def has_redfish_revisions_added(entity):
-    elements = entity.xpath('edm:Property | edm:NavigationProperty', namespaces=ODATA_ALL_NAMESPACES)
-
-    for element in elements:
-        ver = ''
-        # check for Redfish.Revisions
-        revisions = element.xpath(
-            'child::edm:Annotation[@Term=\'Redfish.Revisions\']/edm:Collection/edm:Record',
-            namespaces=ODATA_ALL_NAMESPACES)
-
-        if len(revisions) == 1:
-            props = revisions[0].xpath('child::edm:PropertyValue[@Property=\"Kind\"]',
-                                       namespaces=ODATA_ALL_NAMESPACES)
-            if len(props) == 1 and props[0].get('EnumMember') == 'Redfish.RevisionKind/Added':
-                return True
+# annotated_elements - optional list of AnnotatedElement already collected for the entity
+def has_redfish_revisions_added(entity, annotated_elements=None):
+    if annotated_elements is None:
+        annotated_elements = [AnnotatedElement(element, get_element_annotations(element))
+                              for element in XPATH_TYPE_PROPERTIES(entity)]
+    else:
+        annotated_elements = [annotated_element for annotated_element in annotated_elements
+                              if annotated_element.element.getparent() is entity
+                              and annotated_element.element.tag in (ODATA_PROPERTY, ODATA_NAVIGATION_PROPERTY)]
+
+    for annotated_element in annotated_elements:
+        if annotated_element.annotations.revision_kinds == [REDFISH_REVISION_KIND_ADDED]:
+            return True
 
     return False
 
@@ -218,22 +315,13 @@ def has_redfish_revisions_added(entity):
 # This will sort the elements (e.g. properties or enums) based on the Redfish.Revisions Added
 # element_access - function to access each element
 # sort_function - sort function to use to sort the elements within a specific version
-def sort_by_version(elements, element_access, sort_function):
+# element_annotations - optional list of ElementAnnotations, one per element
+def sort_by_version(elements, element_access, sort_function, element_annotations=None):
     element_dict = {}
-    for element in elements:
-        ver = ''
-        # check for Redfish.Revision
-        records = element.xpath(
-            'child::edm:Annotation[@Term=\'Redfish.Revisions\']/edm:Collection/edm:Record',
-            namespaces=ODATA_ALL_NAMESPACES)
-
-        # search for the 'Added' revision kind since there may be others such as 'Deprecated'.
-        for record in records:
-            props = record.xpath('child::edm:PropertyValue[@Property=\"Kind\"]',
-                                       namespaces=ODATA_ALL_NAMESPACES)
-            if len(props) == 1 and props[0].get('EnumMember') == 'Redfish.RevisionKind/Added':
-                ver = record.xpath('child::edm:PropertyValue[@Property=\'Version\']',
-                                         namespaces=ODATA_ALL_NAMESPACES)[0].get('String')
+    if element_annotations is None:
+        element_annotations = [get_element_annotations(element) for element in elements]
+    for element, annotations in zip(elements, element_annotations):
+        ver = get_added_version(annotations)
 
         if ver not in element_dict:
             element_dict[ver] = []
@@ -253,16 +341,18 @@ def sort_by_version(elements, element_access, sort_function):
     return sorted_elements
 
 
-def get_properties(some_type, path=PROPERTY_PATH, can_sort_by_version=False):
+def get_properties(some_type, path=PROPERTY_PATH, can_sort_by_version=False, annotated_elements=None):
     global verbose
 
     properties = []
-    property_elements = some_type.xpath(path, namespaces=ODATA_ALL_NAMESPACES)
+    if annotated_elements is None:
+        annotated_elements = get_annotated_elements(some_type, path)
 
     if can_sort_by_version:
-        property_elements = sort_by_version(property_elements, lambda p: p, lambda p: p.get('Name'))
+        annotated_elements = sort_by_version(annotated_elements, lambda p: p, lambda p: p.element.get('Name'),
+                                             [annotated_element.annotations for annotated_element in annotated_elements])
 
-    for property_element in property_elements:
+    for property_element, annotations in annotated_elements:
         property_name = property_element.get('Name')
 
         property_type = property_element.get('Type')
@@ -271,18 +361,14 @@ def get_properties(some_type, path=PROPERTY_PATH, can_sort_by_version=False):
         if is_property_nullable(property_element):
             property_is_nullable_flag = 'Nullable=True'
 
-        property_permissions = get_property_permissions(property_element)
-
-        property_flags = property_is_nullable_flag + ',' + property_permissions
+        property_flags = property_is_nullable_flag + ',' + annotations.permissions
 
         is_auto_expand = (property_element.tag != ODATA_NAVIGATION_PROPERTY \
                           and property_element.tag != ODATA_PARAMETER_TYPE) \
-            or (property_element.tag == ODATA_NAVIGATION_PROPERTY
-                and len(property_element.xpath('child::edm:Annotation[@Term=\'OData.AutoExpand\']',
-                                               namespaces=ODATA_ALL_NAMESPACES)))
+            or (property_element.tag == ODATA_NAVIGATION_PROPERTY and annotations.is_auto_expand)
         is_auto_expand_refs = not is_auto_expand
 
-        excerpt_dict = get_property_excerpts(property_element)
+        excerpt_dict = annotations.excerpts
 
         primitive_type = get_primitive_type(property_type)
         if primitive_type != '':  # primitive type?
@@ -325,7 +411,7 @@ def get_properties(some_type, path=PROPERTY_PATH, can_sort_by_version=False):
 
 
 def get_namespace(entity_type):
-    namespace = entity_type.xpath('parent::edm:Schema', namespaces=ODATA_ALL_NAMESPACES)[0].get('Namespace')
+    namespace = XPATH_PARENT_SCHEMA(entity_type)[0].get('Namespace')
     if namespace.find('.') != -1:
         m = re.search('(\w*?)\.v.*', namespace)
         if m:
@@ -359,8 +445,8 @@ def extract_doc_name_from_url(url):
         return ''
 
 
-def add_annotation_terms(doc, entity_repo):
-    for namespace in doc.xpath('//edm:Schema', namespaces=ODATA_ALL_NAMESPACES):
+def add_annotation_terms(doc, operations):
+    for namespace in XPATH_SCHEMAS(doc):
         terms = get_properties(namespace, path='descendant-or-self::edm:Term')
 
         namespace_name = namespace.get('Namespace')
@@ -369,93 +455,73 @@ def add_annotation_terms(doc, entity_repo):
         if namespace_name.startswith('RedfishExtensions'):
             namespace_name = 'Redfish'
 
-        if namespace_name not in entity_repo:
-            entity_repo[namespace_name] = ('Set', [])
+        operations.append([namespace_name, 'Set', True, sorted(terms, key=itemgetter(0))])
 
-        entity_repo[namespace_name][ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX].extend(
-            [item for item in sorted(terms, key=itemgetter(0))
-             if item not in entity_repo[namespace_name][ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX]])
 
-
-def add_entity_and_complex_types(doc, entity_repo):
+def add_entity_and_complex_types(doc, operations):
     """
     Adds all entity and complex types into the entity repo for the specified document
 
     Args:
-        doc:  The document to search for enums
-        entity_repo: Found enums will be added to the entity_repo
+        doc:  The document to search for entity and complex types
+        operations: Operations that add the found types to the entity repo will be appended to operations
     """
-    for entity_type in doc.xpath('//edm:EntityType | //edm:ComplexType', namespaces=ODATA_ALL_NAMESPACES):
+    for entity_type in XPATH_ENTITY_AND_COMPLEX_TYPES(doc):
         properties = []
         if is_abstract(entity_type) is not True:
             if is_parent_abstract(entity_type):
                 properties = get_base_properties(entity_type)
 
-            can_sort_by_version = has_redfish_revisions_added(entity_type)
-            properties = properties + get_properties(entity_type, PROPERTY_PATH, can_sort_by_version)
+            # collect the annotations of every property once for both the version check and the extraction
+            annotated_elements = get_annotated_elements(entity_type, PROPERTY_PATH)
+            can_sort_by_version = has_redfish_revisions_added(entity_type, annotated_elements)
+            properties = properties + get_properties(entity_type, PROPERTY_PATH, can_sort_by_version,
+                                                     annotated_elements)
 
             # add the entity only if it has at least one property
             if len(properties):
-                entity_type_name = get_qualified_entity_name(entity_type)
-                if entity_type_name not in entity_repo:
-                    entity_repo[entity_type_name] = ('Set', [])
-
                 # Use standard sort to sort properties (alphanumeric)
                 if not can_sort_by_version:
                     properties = sorted(properties, key=itemgetter(0))
 
                 # sort and add to the map
                 # add only unique entries - this is to handle Swordfish vs Redfish conflicting schema (e.g. Volume)
-                entity_repo[entity_type_name][ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX].extend(
-                    [item for item in properties
-                     if item not in entity_repo[entity_type_name][ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX]]
-                )
+                operations.append([get_qualified_entity_name(entity_type), 'Set', True, properties])
 
 
-def add_enums(doc, entity_repo):
+def add_enums(doc, operations):
     """
     Adds all enum types into the entity repo for the specified document
 
     Args:
         doc:  The document to search for enums
-        entity_repo: Found enums will be added to the entity_repo
+        operations: Operations that add the found enums to the entity repo will be appended to operations
     """
-    for enum_type in doc.xpath('//edm:EnumType', namespaces=ODATA_ALL_NAMESPACES):
-        enum_type_name = get_qualified_entity_name(enum_type)
-        if enum_type_name not in entity_repo:
-            entity_repo[enum_type_name] = ('Enum', [])
-
-        sorted_enums = sort_by_version(enum_type.xpath('child::edm:Member', namespaces=ODATA_ALL_NAMESPACES),
+    for enum_type in XPATH_ENUM_TYPES(doc):
+        sorted_enums = sort_by_version(XPATH_ENUM_MEMBERS(enum_type),
                                        lambda p: p.get('Name'), lambda p: p.casefold())
 
-        for item in sorted_enums:
-            entity_repo[enum_type_name][ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX].append([item])
+        operations.append([get_qualified_entity_name(enum_type), 'Enum', False, [[item] for item in sorted_enums]])
 
 
-def add_actions(doc, entity_repo):
+def add_actions(doc, operations):
     # Handle Actions
-    for actionType in doc.xpath('//edm:Action', namespaces=ODATA_ALL_NAMESPACES):
+    for actionType in XPATH_ACTIONS(doc):
         # the first parameter is the binding parameter. Skip it
-        parameters_iter = iter(actionType.xpath('child::edm:Parameter', namespaces=ODATA_ALL_NAMESPACES))
+        parameters_iter = iter(XPATH_ACTION_PARAMETERS(actionType))
         binding_parameter = next(parameters_iter)
         action_entity_type = strip_version(binding_parameter.get('Type'))
 
-        if action_entity_type not in entity_repo:
-            entity_repo[action_entity_type] = ('Set', [])
-
-        entity_repo[action_entity_type][ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX].append(
-            ['#' + get_namespace(actionType) + '.' + actionType.get('Name'), 'Set', '', get_qualified_entity_name(actionType)])
-
-        if get_qualified_entity_name(actionType) not in entity_repo:
-            entity_repo[get_qualified_entity_name(actionType)] = ('Set', [])
+        operations.append([action_entity_type, 'Set', False,
+                           [['#' + get_namespace(actionType) + '.' + actionType.get('Name'), 'Set', '',
+                             get_qualified_entity_name(actionType)]]])
 
         # All actions have a target and title
-        entity_repo[get_qualified_entity_name(actionType)][ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX].extend(
-            [
-                ['target', 'String', 'Nullable=False,Permission=Read', ''],
-                ['title', 'String', 'Nullable=False,Permission=Read', '']
-            ]
-        )
+        operations.append([get_qualified_entity_name(actionType), 'Set', False,
+                           [
+                               ['target', 'String', 'Nullable=False,Permission=Read', ''],
+                               ['title', 'String', 'Nullable=False,Permission=Read', '']
+                           ]])
 
         properties = []
 
@@ -464,22 +530,86 @@ def add_actions(doc, entity_repo):
 
         # sort and add to the map
         # add only unique entries - this is to handle Swordfish vs Redfish conflicting schema (e.g. Volume)
-        entity_repo[get_qualified_entity_name(actionType)][ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX].extend(
-            [item for item in sorted(properties, key=itemgetter(0))
-             if item not in entity_repo[get_qualified_entity_name(actionType)][ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX]]
-        )
+        operations.append([get_qualified_entity_name(actionType), 'Set', True, sorted(properties, key=itemgetter(0))])
+
+
+def get_file_digest(path):
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def get_generator_digest():
+    """
+    Returns a digest of the modules that generate dictionaries and the CSDL extractions they cache, so a change to the
+    code invalidates what was built with the previous code
+    """
+    global generator_digest
+    if generator_digest is None:
+        digest = hashlib.sha256()
+        for module_file in [__file__, _internal_utils.__file__]:
+            digest.update(get_file_digest(module_file).encode())
+        generator_digest = digest.hexdigest()
+    return generator_digest
+
+
+def get_dependencies():
+    return getattr(build_state, 'dependencies', None)
+
+
+def add_dependency_file(path, digest=None):
+    dependencies = get_dependencies()
+    if dependencies is not None and path not in dependencies['files']:
+        dependencies['files'][path] = digest if digest else get_file_digest(path)
+
+
+def is_dependency_file(path):
+    """
+    Same as os.path.isfile() for the schema files a dictionary is built from, but also records path as a dependency
+    """
+    add_dependency_file(path)
+    return os.path.isfile(path)
+
+
+def record_dependencies(function, *args, **kwargs):
+    """
+    Calls function (one of the generate_*_dictionary functions) and records every schema file that it looked for or
+    read, along with the result of every schema file glob
+
+    Return:
+        Tuple (result of function, dependencies)
+    """
+    dependencies = {'files': {}, 'globs': {}}
+    build_state.dependencies = dependencies
+    try:
+        return function(*args, **kwargs), dependencies
+    finally:
+        build_state.dependencies = None
+
+
+def are_dependencies_changed(recorded_dependencies):
+    for path, digest in recorded_dependencies['files'].items():
+        if get_file_digest(path) != digest:
+            return True
+
+    for pattern, filenames in recorded_dependencies['globs'].items():
+        if sorted(glob.glob(pattern)) != filenames:
+            return True
+
+    return False
 
 
 def find_csdl_source(csdl_schema_dirs, filename):
     for csdl_dir in csdl_schema_dirs:
-        if os.path.isfile(os.path.join(csdl_dir, filename)):
+        if is_dependency_file(os.path.join(csdl_dir, filename)):
             return os.path.join(csdl_dir, filename)
     return ''
 
 
 def find_json_schema_source(json_schema_dirs, filename):
     for json_schema_dir in json_schema_dirs:
-        if os.path.isfile(os.path.join(json_schema_dir, filename)):
+        if is_dependency_file(os.path.join(json_schema_dir, filename)):
             return os.path.join(json_schema_dir, filename)
     return ''
 
@@ -533,72 +663,252 @@ def find_json_schema_files_with_version(json_schema_dirs, filename):
 
     filenames = []   # list of filenames sorted from lowest to highest version
     for json_schema_dir in json_schema_dirs:
-        filenames = filenames + glob.glob(os.path.join(json_schema_dir, base_filename) + '.*.' + extension)
+        pattern = os.path.join(json_schema_dir, base_filename) + '.*.' + extension
+        matches = get_json_schema_index().find_files(json_schema_dir, base_filename + '.*.' + extension)
+        filenames = filenames + matches
+        if get_dependencies() is not None:
+            get_dependencies()['globs'][pattern] = sorted(matches)
 
     # remove any filenames with version > highest_version
     filenames = [x for x in filenames if not is_version_greater_than(highest_version, os.path.basename(x))]
-    filenames.sort(key=cmp_to_key(schema_version_string_compare), reverse=True)
+    filenames.sort(key=get_schema_version_key, reverse=True)
 
     return filenames
 
 
-def add_namespaces(csdl_schema_dirs, source, doc_list):
-    global includeNamespaces
-    global verbose
+class JsonSchemaIndex:
+    """
+    Index of the json-schema directories used by dictionary builds. Each directory is listed and each json-schema file
+    is read and parsed at most once, so like SchemaSet it should only be shared by builds that run against an
+    unchanging set of schema files.
+    """
+    def __init__(self):
+        self._listings = {}  # directory to the names of its files, in directory order
+        self._matches = {}  # (directory, pattern) to the paths of the matching files
+        self._schemas = {}  # path to (digest, parsed json-schema), or None if there is no such file
+        self._refs = {}  # (path, definition) to the (ref, namespace, version, entity) of each anyOf $ref
+        self._lock = threading.Lock()
+
+    def find_files(self, json_schema_dir, pattern):
+        """
+        Same as glob.glob(os.path.join(json_schema_dir, pattern)) for a pattern without a directory part
+        """
+        with self._lock:
+            if (json_schema_dir, pattern) not in self._matches:
+                if json_schema_dir not in self._listings:
+                    try:
+                        self._listings[json_schema_dir] = os.listdir(json_schema_dir or os.curdir)
+                    except OSError:
+                        self._listings[json_schema_dir] = []
+                names = fnmatch.filter(self._listings[json_schema_dir], pattern)
+                if not pattern.startswith('.'):
+                    names = [name for name in names if not name.startswith('.')]
+                self._matches[(json_schema_dir, pattern)] = [os.path.join(json_schema_dir, name) for name in names]
+            return list(self._matches[(json_schema_dir, pattern)])
+
+    def get_schema(self, path):
+        """
+        Returns the parsed json-schema at path, or None if there is no such file. path is recorded as a dependency.
+        The returned json-schema is shared and must not be modified.
+        """
+        with self._lock:
+            if path not in self._schemas:
+                self._schemas[path] = None
+                if os.path.isfile(path):
+                    with open(path, 'rb') as file:
+                        contents = file.read()
+                    self._schemas[path] = (hashlib.sha256(contents).hexdigest(), json.loads(contents))
+            entry = self._schemas[path]
+
+        add_dependency_file(path, entry[0] if entry else None)
+        return entry[1] if entry else None
+
+    def get_anyof_refs(self, path, definition):
+        """
+        Returns a list of (ref, namespace, version, entity) for each $ref in the anyOf of a definition of the
+        json-schema at path
+        """
+        json_schema = self.get_schema(path)
+        with self._lock:
+            if (path, definition) not in self._refs:
+                refs = []
+                if 'anyOf' in json_schema['definitions'][definition]:
+                    for ref in json_schema['definitions'][definition]['anyOf']:
+                        if '$ref' in ref:
+                            refs.append((ref['$ref'],) + tuple(get_ref_parts(ref['$ref'])))
+                self._refs[(path, definition)] = refs
+            return self._refs[(path, definition)]
+
+
+def get_json_schema_index():
+    """
+    Returns the JsonSchemaIndex of the current dictionary build, or a new one outside of a build
+    """
+    builder = get_current_builder()
+    if builder is None:
+        return JsonSchemaIndex()
+    return builder.schema_set.json_schema_index
+
 
-    # check to see if source is from a remote location
-    is_remote = re.search("^http(s?)://", source) is not None
+class CsdlDocument:
+    """
+    A CSDL file along with the namespaces it defines, the documents it references and the entity repo operations
+    extracted from it. The file is only parsed when one of those is not already known from the cache directory.
+    """
+    def __init__(self, source, schema_string, cache_dir=None):
+        self.source = source
+        self.digest = hashlib.sha256(schema_string).hexdigest()
+        self._schema_string = schema_string
+        self._doc = None
+        self._namespace_elements = {}
+        self._namespace_children = {}
+        self._cache_file = os.path.join(cache_dir, self.digest + '.json') if cache_dir else None
+        # builders on several threads can share the document through a SchemaSet
+        self._lock = threading.RLock()
+
+        cache_data = self.load_cache_file()
+        if cache_data:
+            self.namespaces = cache_data['namespaces']
+            self.references = cache_data['references']
+            self.extractions = cache_data['extractions']
+        else:
+            self.namespaces = [namespace.get('Namespace') for namespace in
+                               self.doc.xpath('descendant-or-self::edm:Schema[@Namespace]',
+                                              namespaces=ODATA_ALL_NAMESPACES)]
+            self.references = [ref.get('Uri') for ref in
+                               self.doc.xpath('descendant-or-self::edmx:Reference', namespaces=ODATA_ALL_NAMESPACES)]
+            self.extractions = []
+            self.save_cache_file()
+
+    def __repr__(self):
+        return 'CsdlDocument(' + repr(self.source) + ')'
+
+    @property
+    def doc(self):
+        if self._doc is None:
+            self._doc = etree.fromstring(self._schema_string)
+        return self._doc
+
+    def get_namespace_element(self, namespace_name):
+        if namespace_name not in self._namespace_elements:
+            self._namespace_elements[namespace_name] = \
+                self.doc.xpath('descendant-or-self::edm:Schema[@Namespace=\'%s\']' % namespace_name,
+                               namespaces=ODATA_ALL_NAMESPACES)[0]
+        return self._namespace_elements[namespace_name]
+
+    def get_namespace_children(self, namespace_name):
+        """
+        Returns an index of the named edm child elements of a namespace, from name to the elements in document order
+        """
+        if namespace_name not in self._namespace_children:
+            children = {}
+            for child in self.get_namespace_element(namespace_name).iterchildren(ODATA_ALL_ELEMENTS):
+                if child.get('Name') is not None:
+                    children.setdefault(child.get('Name'), []).append(child)
+            self._namespace_children[namespace_name] = children
+        return self._namespace_children[namespace_name]
+
+    def get_extraction(self):
+        """
+        Returns the entity repo operations extracted from this document, if they were extracted with the namespaces
+        they depend on coming from the same documents as they do now. Otherwise returns None.
+        """
+        for dependencies, operations in self.extractions:
+            if all(get_namespace_digest(namespace_name) == digest for namespace_name, digest in dependencies.items()):
+                return operations
+        return None
+
+    def add_extraction(self, dependencies, operations):
+        with self._lock:
+            self.extractions = ([[dependencies, operations]] + self.extractions)[:CSDL_CACHE_MAX_EXTRACTIONS]
+            self.save_cache_file()
+
+    def load_cache_file(self):
+        if self._cache_file is None or not os.path.isfile(self._cache_file):
+            return None
+
+        try:
+            with open(self._cache_file) as file:
+                cache_data = json.load(file)
+            # extractions of another version of the code are stale even if the document did not change
+            if cache_data.get('version') == CSDL_CACHE_VERSION \
+                    and cache_data.get('generator') == get_generator_digest():
+                return cache_data
+        except (OSError, ValueError):
+            # a damaged cache file is simply rebuilt
+            pass
+        return None
+
+    def save_cache_file(self):
+        if self._cache_file is None:
+            return
+
+        with self._lock:
+            cache_dir = os.path.dirname(self._cache_file)
+            os.makedirs(cache_dir, exist_ok=True)
+            # a temporary file of its own, so that threads and processes writing the same document do not collide
+            fd, tmp_file = tempfile.mkstemp(dir=cache_dir, prefix=self.digest + '.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as file:
+                    json.dump({'version': CSDL_CACHE_VERSION, 'generator': get_generator_digest(),
+                               'namespaces': self.namespaces,
+                               'references': self.references, 'extractions': self.extractions}, file)
+                os.replace(tmp_file, self._cache_file)
+            except BaseException:
+                if os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+                raise
+
+
+def load_csdl_document(source, is_remote, cache_dir=None):
+    """
+    Reads a CSDL file
+
+    Args:
+        source: The local path or URL of the CSDL file
+        is_remote: True if source is a URL
+        cache_dir: Directory of previously extracted documents, keyed by content hash (default None)
 
-    doc_name = source
-    schema_string = ''
+    Return:
+        CsdlDocument, or None if a remote source could not be fetched
+    """
     if is_remote:
-        doc_name = extract_doc_name_from_url(source)
+        try:
+            if verbose:
+                print('Opening URL', source)
+            schema_string = urllib.request.urlopen(source).read()
+        except:
+            # skip if we cannot bring the file down
+            return None
+    else:
+        with open(source, 'rb') as local_file:
+            schema_string = local_file.read()
 
-    # first load the CSDL file as a string
-    if doc_name not in doc_list:
-        if is_remote:
-            # ignore odata references
-            if source.find('http://docs.oasis') == -1:
-                try:
-                    if verbose:
-                        print('Opening URL', source)
-                    schema_string = urllib.request.urlopen(source).read()
-                except:
-                    # skip if we cannot bring the file down
-                    return
-        else:
-            with open(source, 'rb') as local_file:
-                schema_string = local_file.read()
+    return CsdlDocument(source, schema_string, cache_dir)
 
-    if schema_string != '':
-        doc = etree.fromstring(schema_string)
-        doc_list[doc_name] = doc
-        # load all namespaces in the current doc
-        for namespace in doc.xpath('descendant-or-self::edm:Schema[@Namespace]', namespaces=ODATA_ALL_NAMESPACES):
-            if namespace.get('Namespace') not in includeNamespaces:
-                includeNamespaces[namespace.get('Namespace')] = namespace
-            else:
-                return
 
-        # bring in all dependent documents and their corresponding namespaces
-        for ref in doc.xpath('descendant-or-self::edmx:Reference', namespaces=ODATA_ALL_NAMESPACES):
-            if is_remote:
-                dependent_source = ref.get('Uri')
-            else:
-                dependent_source = find_csdl_source(csdl_schema_dirs, extract_doc_name_from_url(ref.get('Uri')))
+class SchemaSet:
+    """
+    Cache of CSDL documents. Dictionary builds that are given the same SchemaSet read and parse each CSDL file only
+    once, so it should only be shared by builds that run against an unchanging set of schema files. With a cache_dir,
+    what is extracted from each file is also kept on disk and reused by later runs until the file changes.
+    """
+    def __init__(self, cache_dir=None):
+        self._documents = {}
+        self._cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self.json_schema_index = JsonSchemaIndex()
 
-                if os.path.exists(dependent_source) is False:
-                    continue
-                if verbose:
-                    print(dependent_source)
-            add_namespaces(csdl_schema_dirs, dependent_source, doc_list)
+    def get_document(self, source, is_remote):
+        with self._lock:
+            if source not in self._documents:
+                self._documents[source] = load_csdl_document(source, is_remote, self._cache_dir)
+            return self._documents[source]
 
 
 def get_latest_version(entity):
-    global includeNamespaces
-
     # search the namespaces for all 'entity.vMajor_Minor_Errata'
-    result = [key for key, value in includeNamespaces.items() if key.startswith(entity.split('.')[1]+'.')]
+    result = [key for key, value in get_include_namespaces().items() if key.startswith(entity.split('.')[1]+'.')]
 
     # The last item in result will have the latest version
     if result:  # This is a versioned namespace
@@ -686,21 +996,150 @@ def get_latest_version_as_ver32(entity):
     return to_ver32(version)
 
 
-def add_all_entity_and_complex_types(doc_list, entity_repo):
-    for key in doc_list:
-        add_entity_and_complex_types(doc_list[key], entity_repo)
-        add_enums(doc_list[key], entity_repo)
-        add_actions(doc_list[key], entity_repo)
-        add_annotation_terms(doc_list[key], entity_repo)
+def get_current_builder():
+    """
+    Returns the DictionaryBuilder running on the current thread, or None
+    """
+    return getattr(build_state, 'builder', None)
 
-    # second pass, add seq numbers
+
+def get_include_namespaces():
+    """
+    Returns the dict of the namespaces used to build the current dictionary to their CsdlDocument
+    """
+    builder = get_current_builder()
+    if builder is None:
+        return {}
+    return builder.include_namespaces
+
+
+def record_namespace_lookup(namespace_name):
+    builder = get_current_builder()
+    if builder is not None and builder.namespace_lookups is not None:
+        builder.namespace_lookups.add(namespace_name)
+
+
+def get_namespace_element(namespace_name):
+    return get_include_namespaces()[namespace_name].get_namespace_element(namespace_name)
+
+
+def get_namespace_children(namespace_name):
+    return get_include_namespaces()[namespace_name].get_namespace_children(namespace_name)
+
+
+def get_namespace_digest(namespace_name):
+    include_namespaces = get_include_namespaces()
+    if namespace_name in include_namespaces:
+        return include_namespaces[namespace_name].digest
+    return None
+
+
+def extract_entity_repo_operations(doc):
+    """
+    Extracts the entity repo operations for a document, along with the digests of the documents that provided every
+    namespace looked up along the way
+
+    Return:
+        Tuple (dependencies, operations)
+    """
+    builder = get_current_builder()
+
+    operations = []
+    builder.namespace_lookups = set()
+    try:
+        add_entity_and_complex_types(doc, operations)
+        add_enums(doc, operations)
+        add_actions(doc, operations)
+        add_annotation_terms(doc, operations)
+        dependencies = {namespace_name: get_namespace_digest(namespace_name)
+                        for namespace_name in sorted(builder.namespace_lookups)}
+    finally:
+        builder.namespace_lookups = None
+
+    return dependencies, operations
+
+
+def get_property_key(item):
+    """
+    Returns a hashable key for an entity repo property list item. The items only hold strings, lists of strings and
+    excerpt dicts that are always filled in the same key order, so two items have the same key if they compare equal.
+    """
+    return repr(item)
+
+
+def merge_unique_properties(property_list, property_keys, properties):
+    """
+    Appends the properties that are not already in property_list, keeping their order. Duplicates within properties
+    itself are all kept, same as a membership test against property_list before the merge.
+
+    Args:
+        property_list: The ordered property list to merge into
+        property_keys: Set of the get_property_key() of every item in property_list, updated along with it
+        properties: The properties to merge
+    """
+    keyed_properties = [(get_property_key(item), item) for item in properties]
+    property_list.extend([item for key, item in keyed_properties if key not in property_keys])
+    property_keys.update([key for key, item in keyed_properties])
+
+
+def apply_entity_repo_operations(entity_repo, operations, entity_repo_keys=None):
+    """
+    Applies the operations of extract_entity_repo_operations() to the entity repo
+
+    Args:
+        entity_repo: The entity repo to add the types to
+        operations: List of [entity type name, entity type, is unique, properties]
+        entity_repo_keys: Dict of entity type name to the set of keys of its property list. Keep the same dict for
+                          every call against the same entity_repo, entries missing from it are built on demand by the
+                          unique merges, the only ones that need them.
+    """
+    if entity_repo_keys is None:
+        entity_repo_keys = {}
+
+    for [entity_type_name, entity_type, is_unique, properties] in operations:
+        if entity_type_name not in entity_repo:
+            entity_repo[entity_type_name] = (entity_type, [])
+
+        property_list = entity_repo[entity_type_name][ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX]
+        if is_unique:
+            if entity_type_name not in entity_repo_keys:
+                entity_repo_keys[entity_type_name] = set([get_property_key(item) for item in property_list])
+            merge_unique_properties(property_list, entity_repo_keys[entity_type_name], properties)
+        else:
+            property_list.extend(properties)
+            # rebuilt by the next unique merge, if any
+            entity_repo_keys.pop(entity_type_name, None)
+
+
+def add_document_entity_and_complex_types(documents, entity_repo):
+    """
+    Adds the entity and complex types of the CSDL documents to the entity repo, without sequence numbers
+    """
+    entity_repo_keys = {}
+    for document in documents:
+        operations = document.get_extraction()
+        if operations is None:
+            dependencies, operations = extract_entity_repo_operations(document.doc)
+            document.add_extraction(dependencies, operations)
+
+        # the operations are kept for later builds, so never hand out the cached property lists
+        apply_entity_repo_operations(entity_repo, deepcopy(operations), entity_repo_keys)
+
+
+def add_sequence_numbers(entity_repo):
     for key in entity_repo:
         for seq, item in enumerate(entity_repo[key][ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX]):
             item.insert(0, seq)
 
 
+def add_all_entity_and_complex_types(doc_list, entity_repo):
+    add_document_entity_and_complex_types(doc_list.values(), entity_repo)
+
+    # second pass, add seq numbers
+    add_sequence_numbers(entity_repo)
+
+
 def get_base_type(child):
-    global includeNamespaces
     global verbose
 
     if child.get('BaseType') is not None:
@@ -708,12 +1147,12 @@ def get_base_type(child):
         base_namespace = m.group(1)
         base_entity_name = m.group(2)
 
-        assert base_namespace in includeNamespaces, \
+        record_namespace_lookup(base_namespace)
+
+        assert base_namespace in get_include_namespaces(), \
             "Could not find base namespace %s, source line %d" % (base_namespace, child.sourceline)
-        base_types = includeNamespaces[base_namespace].xpath(
-            'child::edm:EntityType[@Name=\'%s\'] | child::edm:ComplexType[@Name=\'%s\']' % (base_entity_name,
-                                                                                            base_entity_name),
-            namespaces=ODATA_ALL_NAMESPACES)
+        base_types = [element for element in get_namespace_children(base_namespace).get(base_entity_name, [])
+                      if element.tag == ODATA_ENTITY_TYPE or element.tag == ODATA_COMPLEX_TYPE]
         if len(base_types) == 1:
             return base_types[0]
         assert False, "Could not find base type %s, source line %d" % (child.get('BaseType'), child.sourceline)
@@ -729,16 +1168,15 @@ def is_abstract(entity_type):
 
 
 def find_element_from_type(type):
-    global includeNamespaces
-
     m = re.compile('(.*)\.(\w*)').match(type)
     namespace = m.group(1)
     entity_name = m.group(2)
 
+    record_namespace_lookup(namespace)
+
     # TODO assert here instead of returning None to let users know that all referenced schema files are not available
-    if namespace in includeNamespaces:
-        elements = includeNamespaces[namespace].xpath('child::edm:*[@Name=\'%s\']' % entity_name,
-                                           namespaces=ODATA_ALL_NAMESPACES)
+    if namespace in get_include_namespaces():
+        elements = get_namespace_children(namespace).get(entity_name, [])
         if len(elements) >= 1:
             return elements[0]
         assert False, "Could not find %s" % (type)
@@ -899,7 +1337,7 @@ def generate_json_dictionary(json_schema_dirs, dictionary, dictionary_byte_array
 
     summary['schema_dictionary_length_bytes'] = len(dictionary_byte_array)
     summary['schema_dictionary_crc_32'] = binascii.crc32(bytes(dictionary_byte_array))
-    summary['schema_dictionary_bytes'] = dictionary_byte_array
+    summary['schema_dictionary_bytes'] = list(dictionary_byte_array)
     assert(len(summary['schema_dictionary_bytes']) == summary['schema_dictionary_length_bytes'])
 
     return json.dumps(summary)
@@ -916,53 +1354,144 @@ def print_dictionary_summary(dictionary, dictionary_byte_array):
     print('Signature:', hex(binascii.crc32(bytes(dictionary_byte_array))))
 
 
-def generate_dictionary(dictionary, entity_repo, entity_offset_map, optimize_duplicate_items=True):
-    can_expand = True
-    while can_expand:
-        tmp_dictionary = dictionary.copy()
-        was_expanded = False
-        for index, item in enumerate(dictionary):
-            if (type(item[DICTIONARY_ENTRY_OFFSET]) == str
-                    and item[DICTIONARY_ENTRY_OFFSET] != ''
-                    and (item[DICTIONARY_ENTRY_FORMAT] == 'Set'
-                         or item[DICTIONARY_ENTRY_FORMAT] == 'Enum'
-                         or item[DICTIONARY_ENTRY_FORMAT] == 'Array'
-                         or item[DICTIONARY_ENTRY_FORMAT] == 'Namespace')):
-
-                excerpt_filter = None
-                if 'ExcerptCopy' in item[DICTIONARY_ENTRY_EXCERPT]:
-                    excerpt_filter = item[DICTIONARY_ENTRY_EXCERPT]['ExcerptCopy']
-
-                # Add dictionary entries
-                offset, child_count = add_dictionary_entries(tmp_dictionary, entity_repo,
-                                                             item[DICTIONARY_ENTRY_OFFSET],
-                                                             entity_offset_map,
-                                                             item[DICTIONARY_ENTRY_FORMAT] == 'Array',
-                                                             '',
-                                                             excerpt_filter)
-
-                tmp_dictionary[index][DICTIONARY_ENTRY_OFFSET] = ''
-                if offset != 0:
-                    tmp_dictionary[index][DICTIONARY_ENTRY_OFFSET] = offset
-                    # Use child_count only if this is a complex type or enum
-                    if item[DICTIONARY_ENTRY_FORMAT] == 'Set' or item[DICTIONARY_ENTRY_FORMAT] == 'Enum':
-                        tmp_dictionary[index][DICTIONARY_ENTRY_CHILD_COUNT] = child_count
-                    else:
-                        tmp_dictionary[index][DICTIONARY_ENTRY_CHILD_COUNT] = 1
+def generate_dictionary(dictionary, entity_repo, entity_offset_map, optimize_duplicate_items=True,
+                        share_subtrees=False):
+    # Expanding a row only appends new rows to the end of the dictionary, so a single pass over the growing dictionary
+    # expands the rows in the same order as repeatedly searching it for the first row that still needs expanding.
+    dictionary = dictionary.copy()
+    index = 0
+    while index < len(dictionary):
+        item = dictionary[index]
+        if (type(item[DICTIONARY_ENTRY_OFFSET]) == str
+                and item[DICTIONARY_ENTRY_OFFSET] != ''
+                and (item[DICTIONARY_ENTRY_FORMAT] == 'Set'
+                     or item[DICTIONARY_ENTRY_FORMAT] == 'Enum'
+                     or item[DICTIONARY_ENTRY_FORMAT] == 'Array'
+                     or item[DICTIONARY_ENTRY_FORMAT] == 'Namespace')):
+
+            excerpt_filter = None
+            if 'ExcerptCopy' in item[DICTIONARY_ENTRY_EXCERPT]:
+                excerpt_filter = item[DICTIONARY_ENTRY_EXCERPT]['ExcerptCopy']
+
+            # Add dictionary entries
+            offset, child_count = add_dictionary_entries(dictionary, entity_repo,
+                                                         item[DICTIONARY_ENTRY_OFFSET],
+                                                         entity_offset_map,
+                                                         item[DICTIONARY_ENTRY_FORMAT] == 'Array',
+                                                         '',
+                                                         excerpt_filter)
+
+            item[DICTIONARY_ENTRY_OFFSET] = ''
+            if offset != 0:
+                item[DICTIONARY_ENTRY_OFFSET] = offset
+                # Use child_count only if this is a complex type or enum
+                if item[DICTIONARY_ENTRY_FORMAT] == 'Set' or item[DICTIONARY_ENTRY_FORMAT] == 'Enum':
+                    item[DICTIONARY_ENTRY_CHILD_COUNT] = child_count
+                else:
+                    item[DICTIONARY_ENTRY_CHILD_COUNT] = 1
 
-                was_expanded = True
-                break
-        if was_expanded:
-            dictionary = tmp_dictionary.copy()
-        else:
-            can_expand = False
+        index += 1
 
     # strip excerpt meta-data from the dictionary
     dictionary = [item[:len(item)-1] for item in dictionary]
 
+    if share_subtrees:
+        dictionary = share_identical_subtrees(dictionary)
+
     return dictionary
 
 
+def share_identical_subtrees(dictionary):
+    """
+    Stores structurally identical runs of child rows only once. Two runs are identical when their rows have the same
+    sequence numbers, formats, flags, names and child counts and their children are identical in turn, even if they
+    were generated for differently named types (e.g. the same enum members). The parents of the dropped runs point to
+    the run that is kept, so the encoder and decoder see the same entries.
+
+    Args:
+        dictionary: The generated dictionary rows, see generate_dictionary()
+
+    Return:
+        The dictionary rows, without the duplicated runs and renumbered
+    """
+    def get_child_run(row):
+        if type(row[DICTIONARY_ENTRY_OFFSET]) == int and row[DICTIONARY_ENTRY_CHILD_COUNT] > 0:
+            return row[DICTIONARY_ENTRY_OFFSET], row[DICTIONARY_ENTRY_CHILD_COUNT]
+        return None
+
+    # every run of child rows, the root row is a run of its own
+    runs = {(0, 1)}
+    pointed_rows = set()  # rows pointed to without children, they have to stay where they are
+    for row in dictionary:
+        if get_child_run(row) is not None:
+            runs.add(get_child_run(row))
+        elif type(row[DICTIONARY_ENTRY_OFFSET]) == int:
+            if row[DICTIONARY_ENTRY_OFFSET] >= len(dictionary):
+                return dictionary  # a pointer past the rows cannot be renumbered, leave the dictionary as it is
+            pointed_rows.add(row[DICTIONARY_ENTRY_OFFSET])
+    runs = sorted(runs)
+
+    # only runs that do not overlap another run, or a row pointed to on its own, can be shared. Runs overlap when a
+    # Set row counts children that were not emitted (e.g. unsupported properties), those runs are kept as they are.
+    run_of_row = {}
+    unshareable_runs = set()
+    for run in runs:
+        offset, count = run
+        if offset + count > len(dictionary):
+            unshareable_runs.add(run)
+        for index in range(offset, min(offset + count, len(dictionary))):
+            other_run = run_of_row.setdefault(index, run)
+            if other_run != run:
+                unshareable_runs.update([run, other_run])
+            if index in pointed_rows:
+                unshareable_runs.add(run)
+
+    # refine the runs into classes of identical runs, starting from the rows themselves and then splitting runs whose
+    # children are in different classes until no class splits anymore. Every unshareable run is a class of its own.
+    def get_class_ids(signatures):
+        ids = {}
+        return {run: ids.setdefault(signature, len(ids)) for run, signature in signatures.items()}
+
+    run_class = get_class_ids({run: (run if run in unshareable_runs else None,
+                                     tuple((row[DICTIONARY_ENTRY_SEQUENCE_NUMBER], row[DICTIONARY_ENTRY_FORMAT],
+                                            row[DICTIONARY_ENTRY_FORMAT_FLAGS], row[DICTIONARY_ENTRY_FIELD_STRING],
+                                            row[DICTIONARY_ENTRY_CHILD_COUNT], get_child_run(row) is not None)
+                                           for row in dictionary[run[0]:run[0] + run[1]]))
+                               for run in runs})
+    class_count = len(set(run_class.values()))
+    while True:
+        run_class = get_class_ids({run: (run_class[run],
+                                         tuple(run_class[get_child_run(row)] if get_child_run(row) else -1
+                                               for row in dictionary[run[0]:run[0] + run[1]]))
+                                   for run in runs})
+        if len(set(run_class.values())) == class_count:
+            break
+        class_count = len(set(run_class.values()))
+
+    # keep the first run of each class, and the rows no run refers to
+    kept_run_of_class = {}
+    for run in runs:
+        kept_run_of_class.setdefault(run_class[run], run)
+    kept_rows = [index for index in range(len(dictionary))
+                 if index not in run_of_row or kept_run_of_class[run_class[run_of_row[index]]] == run_of_row[index]]
+    if len(kept_rows) == len(dictionary):
+        return dictionary
+
+    new_index = {index: new for new, index in enumerate(kept_rows)}
+    shared_dictionary = []
+    for index in kept_rows:
+        row = list(dictionary[index])
+        row[DICTIONARY_ENTRY_INDEX] = new_index[index]
+        child_run = get_child_run(row)
+        if child_run is not None:
+            row[DICTIONARY_ENTRY_OFFSET] = new_index[kept_run_of_class[run_class[child_run]][0]]
+        elif type(row[DICTIONARY_ENTRY_OFFSET]) == int:
+            row[DICTIONARY_ENTRY_OFFSET] = new_index[row[DICTIONARY_ENTRY_OFFSET]]
+        shared_dictionary.append(row)
+
+    return shared_dictionary
+
+
 def add_redfish_annotations(annotation_dictionary):
     pass
 
@@ -976,6 +1505,7 @@ ANNOTATION_DICTIONARY_RESERVED_ENTRY = 4
 def add_odata_annotations(annotation_dictionary, odata_annotation_location):
     global verbose
 
+    add_dependency_file(odata_annotation_location)
     json_schema = json.load(open(odata_annotation_location))
     offset = len(annotation_dictionary)
     count = 0
@@ -1069,30 +1599,25 @@ def find_schema_url(json_schema_dirs, namespace, version, entity):
 
     # find the un-versioned json schema file for this namespace
     unversioned_schema_filename = namespace + '.json'
+    index = get_json_schema_index()
     for json_schema_dir in json_schema_dirs:
-        if os.path.isfile(os.path.join(json_schema_dir, unversioned_schema_filename)):
-            with open(os.path.join(json_schema_dir, unversioned_schema_filename)) as file:
-                json_schema = json.load(file)
-
+        unversioned_schema_path = os.path.join(json_schema_dir, unversioned_schema_filename)
+        json_schema = index.get_schema(unversioned_schema_path)
+        if json_schema is not None:
             if version == '' and '$id' in json_schema:  # this is an un-versioned. We just use the '$id'
                 return json_schema['$id']
 
-            if 'anyOf' in json_schema['definitions'][entity]:
-                list_of_refs = json_schema['definitions'][entity]['anyOf']
-                for ref in list_of_refs:
-                    if '$ref' in ref:
-                        ref_namespace, ref_version, ref_entity = get_ref_parts(ref['$ref'])
-
-                        if namespace == ref_namespace and entity == ref_entity:  # versioned namespace
-                            if version == ref_version:
-                                return ref['$ref']
-                            else:
-                                # hack - let's record this as a candidate url if it is close enough
-                                # (for cases where the json-schema does not have the url yet)
-                                if closest_url == '' or (compare_redfish_versions(ref_version, closest_ver) == 1
-                                                         and compare_redfish_versions(ref_version, version) == -1):
-                                    closest_url = ref['$ref']
-                                    closest_ver = ref_version
+            for ref, ref_namespace, ref_version, ref_entity in index.get_anyof_refs(unversioned_schema_path, entity):
+                if namespace == ref_namespace and entity == ref_entity:  # versioned namespace
+                    if version == ref_version:
+                        return ref
+                    else:
+                        # hack - let's record this as a candidate url if it is close enough
+                        # (for cases where the json-schema does not have the url yet)
+                        if closest_url == '' or (compare_redfish_versions(ref_version, closest_ver) == 1
+                                                 and compare_redfish_versions(ref_version, version) == -1):
+                            closest_url = ref
+                            closest_ver = ref_version
 
     # if we are here, we didn't find an exact match but we may have found one close enough.
     if closest_url != '':
@@ -1171,32 +1696,30 @@ def generate_annotation_dictionary(annotation_version, json_schema_dirs, entity_
     global verbose
 
     entity_repo['Annotations'] = ('Set', [])
+    annotation_keys = set()
     for payload_annotation_file in payload_annotation_files:
-        with open(payload_annotation_file) as f:
-            json_schema = json.load(f)
-
-            properties = []
-            payload_annotation_sections = ['properties', 'patternProperties']
-            for payload_annotation_section in payload_annotation_sections:
-                for k, v in json_schema[payload_annotation_section].items():
-                    bej_format, offset = convert_json_type_to_bej_format(k, v, entity_repo)
-
-                    # strip any patterns from k and remove any trailing '$'
-                    k = k[k.find('@'):]
-                    if '$' in k:
-                        k = k[:-1]
-                    if bej_format == 'Array':
-                        entry = [k, bej_format, '', offset, 'AutoExpand']
-                    else:
-                        entry = [k, bej_format, '', offset]
-                    properties.append(entry)
+        json_schema = get_json_schema_index().get_schema(payload_annotation_file)
+
+        properties = []
+        payload_annotation_sections = ['properties', 'patternProperties']
+        for payload_annotation_section in payload_annotation_sections:
+            for k, v in json_schema[payload_annotation_section].items():
+                bej_format, offset = convert_json_type_to_bej_format(k, v, entity_repo)
+
+                # strip any patterns from k and remove any trailing '$'
+                k = k[k.find('@'):]
+                if '$' in k:
+                    k = k[:-1]
+                if bej_format == 'Array':
+                    entry = [k, bej_format, '', offset, 'AutoExpand']
+                else:
+                    entry = [k, bej_format, '', offset]
+                properties.append(entry)
 
-            # sort and add to the entity_repo
-            # add only unique entries - this is to handle Swordfish vs Redfish conflicting schema (e.g. Volume)
-            entity_repo['Annotations'][ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX].extend(
-                [item for item in sorted(properties, key=itemgetter(0))
-                 if item not in entity_repo['Annotations'][ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX]]
-            )
+        # sort and add to the entity_repo
+        # add only unique entries - this is to handle Swordfish vs Redfish conflicting schema (e.g. Volume)
+        merge_unique_properties(entity_repo['Annotations'][ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX], annotation_keys,
+                                sorted(properties, key=itemgetter(0)))
 
     # second pass, add seq numbers
     for seq, item in enumerate(entity_repo['Annotations'][ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX]):
@@ -1218,14 +1741,36 @@ def truncate_entity_repo(entity_repo, required_properties, enum_key = ""):
     is_truncated = False
     for req_entity, req_values in required_properties.items():
         if req_entity in entity_repo:
-            for property in reversed(entity_repo[req_entity][ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX]):
-                if property[ENTITY_REPO_ENTRY_PROPERTY_NAME] not in req_values:
-                    entity_repo[req_entity][ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX].remove(property)
-                    is_truncated = True
+            properties = entity_repo[req_entity][ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX]
+            req_values = req_values if isinstance(req_values, (set, frozenset, dict)) else set(req_values)
+            kept = [property for property in properties if property[ENTITY_REPO_ENTRY_PROPERTY_NAME] in req_values]
+            if len(kept) != len(properties):
+                properties[:] = kept
+                is_truncated = True
 
     return is_truncated
 
 
+def copy_entity_repo(entity_repo):
+    """Copy the property lists of an entity repository so that truncating the copy leaves the original intact.
+
+    The property entries themselves are shared since truncation and dictionary generation only read them.
+    """
+    return {entity: (entity_type, list(properties)) for entity, (entity_type, properties) in entity_repo.items()}
+
+
+def get_entity_property_map(entity_repo, entity):
+    """Map the property names of an entity in the entity repository to the list of their entries.
+
+    A name can have several entries, e.g. when schemas that are merged into the same entity (Swordfish vs Redfish)
+    define a property with different types, so every entry is kept in the order of the property list.
+    """
+    properties = {}
+    for entity_repo_prop in entity_repo[entity][ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX]:
+        properties.setdefault(entity_repo_prop[ENTITY_REPO_ENTRY_PROPERTY_NAME], []).append(entity_repo_prop)
+    return properties
+
+
 def process_profile(json_profile, entity, entity_repo):
     """Validate that the provided profile has a 'Resources' key and the target entity.
 
@@ -1246,36 +1791,107 @@ def process_profile(json_profile, entity, entity_repo):
 def build_requirements(obj, required_properties, entity, entity_repo):
     """Generate a required_properties dictionary used to truncate the entity repository.
 
-    The required_properties dictionary is generated in a way such that every property specified in the
-    profile is converted into a key-value pair where:
-    - key = property name
-    - value = list of valid enums
-    For properties that are not enums, or that do not have valid enums specified, the value in the
-    key-value pair is an empty list.
+    The required_properties dictionary is generated in a way such that every entity that the profile
+    specifies requirements for is converted into a key-value pair where:
+    - key = entity name
+    - value = set of the required property names, or of the valid enums for an enum entity
+    An entity whose requirements list no known property maps to an empty set.
     """
 
     if 'PropertyRequirements' in obj:
-        if entity not in required_properties:
-            required_properties[entity] = []
+        required = required_properties.setdefault(entity, set())
 
         # go thru each required property and fetch the type
-        for prop in obj['PropertyRequirements'].items():
-            if isinstance(prop[1], dict):  # prop[0] is the prop name, prop[1] is the prop requirements
-                # find the entry in the entity_repo that corresponds to this property
-                for entity_repo_prop in entity_repo[entity][ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX]:
-                    if prop[0] == entity_repo_prop[ENTITY_REPO_ENTRY_PROPERTY_NAME]:
-                        required_properties[entity].append(prop[0])
-                        if entity_repo_prop[ENTITY_REPO_ENTRY_TYPE] == 'Set' or \
-                                entity_repo_prop[ENTITY_REPO_ENTRY_TYPE] == 'Enum' or \
-                                entity_repo_prop[ENTITY_REPO_ENTRY_TYPE] == 'Array' :
-                            build_requirements(prop[1], required_properties,
-                                               entity_repo_prop[ENTITY_REPO_ENTRY_REFERENCE], entity_repo)
+        properties = get_entity_property_map(entity_repo, entity)
+        for prop_name, prop_requirements in obj['PropertyRequirements'].items():
+            if isinstance(prop_requirements, dict) and prop_name in properties:
+                required.add(prop_name)
+                # every entry in the entity_repo that corresponds to this property
+                for entity_repo_prop in properties[prop_name]:
+                    if entity_repo_prop[ENTITY_REPO_ENTRY_TYPE] in ('Set', 'Enum', 'Array'):
+                        build_requirements(prop_requirements, required_properties,
+                                           entity_repo_prop[ENTITY_REPO_ENTRY_REFERENCE], entity_repo)
     if 'Values' in obj: # For enums
-        if entity not in required_properties:
-            required_properties[entity] = []
+        required_properties.setdefault(entity, set()).update(obj['Values'])
 
-        for val in obj['Values']:
-            required_properties[entity].append(val)
+
+def load_corpus(corpus):
+    """
+    Loads the JSON payloads of a corpus
+
+    Args:
+        corpus: List of JSON payload files, or directories whose *.json files are payloads
+
+    Return:
+        List of the payloads
+    """
+    payloads = []
+    for path in corpus:
+        file_names = [path]
+        if os.path.isdir(path):
+            pattern = os.path.join(path, '*.json')
+            file_names = sorted(glob.glob(pattern))
+            if get_dependencies() is not None:
+                get_dependencies()['globs'][pattern] = file_names
+        for file_name in file_names:
+            add_dependency_file(file_name)
+            with open(file_name) as file:
+                payloads.append(json.load(file))
+    return payloads
+
+
+def process_corpus(payloads, entity, entity_repo):
+    """Create a dictionary of the properties and enum values used by a corpus of payloads of the entity.
+
+    The dictionary has the same form as the one process_profile() creates, so it truncates the entity repo to the
+    properties and enum values that the payloads actually use.
+    """
+    required_properties = {}
+    for payload in payloads:
+        build_corpus_requirements(payload, required_properties, entity, entity_repo)
+    return required_properties
+
+
+def build_corpus_requirements(obj, required_properties, entity, entity_repo):
+    """Add the properties of a payload object to a required_properties dictionary, see build_requirements().
+
+    Annotations are left out since they are encoded with the annotation dictionary, but a property annotation (e.g.
+    ResetType@Redfish.AllowableValues) keeps the annotated property since the encoder refers to it by its sequence
+    number. Enum values are added for the enum type of the property, so properties that share an enum type keep the
+    values used by any of them.
+    """
+    if entity not in entity_repo:
+        return
+
+    required = required_properties.setdefault(entity, set())
+
+    if entity_repo[entity][ENTITY_REPO_TUPLE_TYPE_INDEX] == 'Enum':
+        required.update(value for value in (obj if isinstance(obj, list) else [obj]) if isinstance(value, str))
+        return
+
+    if not isinstance(obj, dict):
+        return
+
+    properties = get_entity_property_map(entity_repo, entity)
+    for prop_name, value in obj.items():
+        if '@' in prop_name:
+            annotated_prop_name = prop_name.split('@')[0]
+            if annotated_prop_name in properties:
+                required.add(annotated_prop_name)
+            continue
+
+        if prop_name not in properties:
+            continue
+
+        required.add(prop_name)
+
+        for entity_repo_prop in properties[prop_name]:
+            if entity_repo_prop[ENTITY_REPO_ENTRY_TYPE] in ('Set', 'Enum', 'Array') and value is not None:
+                for element in value if entity_repo_prop[ENTITY_REPO_ENTRY_TYPE] == 'Array' \
+                        and isinstance(value, list) else [value]:
+                    if element is not None:
+                        build_corpus_requirements(element, required_properties,
+                                                  entity_repo_prop[ENTITY_REPO_ENTRY_REFERENCE], entity_repo)
 
 
 def dictionary_binary_header_size():
@@ -1301,11 +1917,11 @@ def dictionary_binary_entry_size():
 
 
 def dictionary_binary_size(dictionary, copyright):
+    # entries with the same name share a single copy of it
     total_field_string_size = 0
-    for item in dictionary:
-        if len(item[DICTIONARY_ENTRY_FIELD_STRING]):
-            total_field_string_size = total_field_string_size + len(item[DICTIONARY_ENTRY_FIELD_STRING]) \
-                                   + 1  # for null termination
+    for name in set([item[DICTIONARY_ENTRY_FIELD_STRING] for item in dictionary]):
+        if len(name):
+            total_field_string_size = total_field_string_size + len(name) + 1  # for null termination
     copyright_len = 0
     if copyright:
         copyright_len = len(copyright) + 1  # for null termination
@@ -1367,22 +1983,30 @@ def is_readonly(format):
 
 
 def generate_byte_array(dictionary, version, is_truncated, copyright):
-    binary_data = []
-    binary_data.append(0x00)  # VersionTag
+    """
+    Serializes a dictionary into the binary dictionary format
 
-    # DictionaryFlags
-    if is_truncated:
-        binary_data.append(0x01)
-    else:
-        binary_data.append(0x00)
+    Args:
+        dictionary: The dictionary rows
+        version: The 32 bit schema version
+        is_truncated: True if the dictionary was truncated by a profile
+        copyright: Copyright string to append, or None
 
-    binary_data.extend(len(dictionary).to_bytes(2, 'little', signed=False))  # EntryCount
-    binary_data.extend(version.to_bytes(4, 'little', signed=False))  # SchemaVersion
-    offset_to_size = len(binary_data)
-    binary_data.extend(int(0).to_bytes(4, 'little', signed=False))  # DictionarySize
+    Return:
+        The binary dictionary as bytes
+    """
+    binary_data = bytearray(dictionary_binary_size(dictionary, copyright))
+
+    DICTIONARY_HEADER_STRUCT.pack_into(binary_data, 0,
+                                       0x00,  # VersionTag
+                                       0x01 if is_truncated else 0x00,  # DictionaryFlags
+                                       len(dictionary),  # EntryCount
+                                       version,  # SchemaVersion
+                                       len(binary_data))  # DictionarySize
 
     # track property name offsets, this is initialized to the first property name
-    name_offset = dictionary_binary_header_size() + (len(dictionary) * dictionary_binary_entry_size())
+    entry_offset = dictionary_binary_header_size()
+    name_offset = entry_offset + (len(dictionary) * dictionary_binary_entry_size())
 
     # maintain a dictionary of names to offsets to allow multiple fixed sized entries to point
     # to the same name
@@ -1393,62 +2017,47 @@ def generate_byte_array(dictionary, version, is_truncated, copyright):
 
     # Add the fixed sized entries
     for item in dictionary:
-        # Format
+        name = item[DICTIONARY_ENTRY_FIELD_STRING]
         format = to_bej_format(item[DICTIONARY_ENTRY_FORMAT],
                                is_nullable='Nullable=True' in item[DICTIONARY_ENTRY_FORMAT_FLAGS],
                                is_readonly=('Permission=Read' in item[DICTIONARY_ENTRY_FORMAT_FLAGS] and 'Permission=ReadWrite' not in item[DICTIONARY_ENTRY_FORMAT_FLAGS]))
-        binary_data.extend(format.to_bytes(1, 'little'))
 
-        binary_data.extend(item[DICTIONARY_ENTRY_SEQUENCE_NUMBER].to_bytes(2, 'little'))  # SequenceNumber
-
-        # ChildPointerOffset
+        child_pointer_offset = 0
         if item[DICTIONARY_ENTRY_OFFSET]:
-            binary_data.extend(binary_offset_from_dictionary_offset(int(item[DICTIONARY_ENTRY_OFFSET])).to_bytes(2, 'little'))
-        else:
-            binary_data.extend([0x00, 0x00])
+            child_pointer_offset = binary_offset_from_dictionary_offset(int(item[DICTIONARY_ENTRY_OFFSET]))
 
-        # ChildCount
-        if item[DICTIONARY_ENTRY_FIELD_STRING] == 'Array':
-            binary_data.extend([0xFF, 0xFF])
+        if name == 'Array':
+            child_count = 0xFFFF
         else:
-            binary_data.extend(item[DICTIONARY_ENTRY_CHILD_COUNT].to_bytes(2, 'little'))
-
-        # NameLength
-        if item[DICTIONARY_ENTRY_FIELD_STRING]:
-            binary_data.append(len(item[DICTIONARY_ENTRY_FIELD_STRING]) + 1)
-        else:
-            binary_data.append(0x00)
-
-        # NameOffset
-        if item[DICTIONARY_ENTRY_FIELD_STRING]:
-            if item[DICTIONARY_ENTRY_FIELD_STRING] in name_to_offset_dict:
-                offset = name_to_offset_dict[item[DICTIONARY_ENTRY_FIELD_STRING]]
+            child_count = item[DICTIONARY_ENTRY_CHILD_COUNT]
+
+        name_length = 0
+        offset = 0
+        if name:
+            name_length = len(name) + 1
+            if name in name_to_offset_dict:
+                offset = name_to_offset_dict[name]
             else:
                 # add name and increment name_offset
-                name_to_offset_dict[item[DICTIONARY_ENTRY_FIELD_STRING]] = name_offset
+                name_to_offset_dict[name] = name_offset
                 offset = name_offset
-                names.append(item[DICTIONARY_ENTRY_FIELD_STRING])
-                name_offset += len(item[DICTIONARY_ENTRY_FIELD_STRING]) + 1
+                names.append(name)
+                name_offset += len(name) + 1
 
-            binary_data.extend(offset.to_bytes(2, 'little'))
-        else:
-            binary_data.extend([0x00, 0x00])
-
-    # Add the property names to the end of the dictionary
-    for name in names:
-        binary_data.extend([ord(elem) for elem in name])
-        binary_data.append(0x00)  # null terminator
+        DICTIONARY_ENTRY_STRUCT.pack_into(binary_data, entry_offset, format, item[DICTIONARY_ENTRY_SEQUENCE_NUMBER],
+                                          child_pointer_offset, child_count, name_length, offset)
+        entry_offset += DICTIONARY_ENTRY_STRUCT.size
 
-    # Add the copyright string if any
+    # Add the null terminated property names and the copyright string if any to the end of the dictionary
+    trailer = b''.join([name.encode('latin-1') + b'\x00' for name in names])
     if copyright and len(copyright):
-        binary_data.extend((len(copyright) + 1).to_bytes(1, 'little'))
-        binary_data.extend([ord(elem) for elem in copyright])
-        binary_data.append(0x00)
+        trailer += (len(copyright) + 1).to_bytes(1, 'little') + copyright.encode('latin-1') + b'\x00'
     else:
-        binary_data.append(0x00)  # set the copyright length to zero
+        trailer += b'\x00'  # set the copyright length to zero
+    binary_data[entry_offset:] = trailer
+    assert(len(binary_data) == DICTIONARY_HEADER_STRUCT.unpack_from(binary_data, 0)[4])
 
-    binary_data[offset_to_size: offset_to_size + 4] = len(binary_data).to_bytes(4, 'little', signed=False)
-    return binary_data
+    return bytes(binary_data)
 
 
 def get_int_from_byte_array(byte_array, start_index, size):
@@ -1470,22 +2079,23 @@ class DictionaryByteArrayStreamSimple:
 
 
 def print_binary_dictionary(byte_array):
-    stream = DictionaryByteArrayStreamSimple(byte_array)
+    byte_array = bytes(byte_array)
 
     # print header
-    print('VersionTag: ', stream.get_int(1))
-    print('DictionaryFlags: ', stream.get_int(1))
-    total_entries = stream.get_int(2)
+    version_tag, dictionary_flags, total_entries, version, dictionary_size = \
+        DICTIONARY_HEADER_STRUCT.unpack_from(byte_array, 0)
+    print('VersionTag: ', version_tag)
+    print('DictionaryFlags: ', dictionary_flags)
     print('EntryCount: ', total_entries)
-    print('SchemaVersion: ', hex(stream.get_int(4)))
-    print('DictionarySize: ', stream.get_int(4))
+    print('SchemaVersion: ', hex(version))
+    print('DictionarySize: ', dictionary_size)
 
     # print each entry
     table = []
-    current_entry = 0
-    while current_entry < total_entries:
-        current_offset = stream.get_current_offset()
-        format = stream.get_int(1)
+    entry_table_end = DICTIONARY_HEADER_STRUCT.size + total_entries * DICTIONARY_ENTRY_STRUCT.size
+    entries = DICTIONARY_ENTRY_STRUCT.iter_unpack(byte_array[DICTIONARY_HEADER_STRUCT.size:entry_table_end])
+    for current_entry, (format, sequence, offset, child_count, name_length, name_offset) in enumerate(entries):
+        current_offset = DICTIONARY_HEADER_STRUCT.size + current_entry * DICTIONARY_ENTRY_STRUCT.size
         format_str = from_bej_format(format)
         format_flags = ''
         if is_nullable(format):
@@ -1493,19 +2103,12 @@ def print_binary_dictionary(byte_array):
         if is_readonly(format):
             format_flags += ',Permission=Read'
 
-        sequence = stream.get_int(2)
-        offset = stream.get_int(2)
-        child_count = stream.get_int(2)
-        name_length = stream.get_int(1)
-        name_offset = stream.get_int(2)
-
         name = ''
         if name_length > 0:
-            name = "".join(map(chr, byte_array[name_offset:name_offset+name_length]))
+            name = byte_array[name_offset:name_offset+name_length].decode('latin-1')
 
         table.append([str(current_entry)+'('+str(current_offset)+')', sequence, format_str, format_flags, name,
                       str(dictionary_offset_from_binary_offset(offset))+'('+str(offset)+')', child_count])
-        current_entry += 1
 
     print_table_data(
         [["Row", "Sequence#", "Format", "Flags", "Field String", "Offset", "Child Count"]]
@@ -1514,13 +2117,34 @@ def print_binary_dictionary(byte_array):
     )
 
 
+def print_binary_dictionary_statistics(statistics):
+    """
+    Prints the statistics of a binary dictionary, see loader.BinaryDictionary.get_statistics()
+    """
+    print('Entries:', statistics['entry_count'])
+    for format, count in statistics['format_counts'].items():
+        print('  {0}: {1}'.format(bej_format_table_reverse_map.get(format, hex(format)), count))
+    print('Sets:', statistics['set_count'])
+    print('Largest set:', statistics['max_child_count'])
+    print('Unique names:', statistics['unique_names'])
+    print('Name table size (bytes):', statistics['name_table_size'])
+
+
 # Named tuple to return schema dictionary.
 SchemaDictionary = namedtuple('SchemaDictionary', 'dictionary dictionary_byte_array json_dictionary')
 
 
+def get_schema_version_key(filename):
+    """
+    Returns a sort key that orders versioned json-schema filenames (e.g. Resource.v1_2_0.json) by version
+    """
+    version_matcher = SCHEMA_VERSION_REGEX.search(filename)
+    return int(version_matcher.group(1)), int(version_matcher.group(2)), int(version_matcher.group(3))
+
+
 def schema_version_string_compare(lhs, rhs):
-    lhs_version_matcher = re.compile('\.v(\d+)_(\d+)_(\d+)\.json').search(lhs)
-    rhs_version_matcher = re.compile('\.v(\d+)_(\d+)_(\d+)\.json').search(rhs)
+    lhs_version_matcher = SCHEMA_VERSION_REGEX.search(lhs)
+    rhs_version_matcher = SCHEMA_VERSION_REGEX.search(rhs)
 
     major_diff = int(lhs_version_matcher.group(1)) - int(rhs_version_matcher.group(1))
     minor_diff = int(lhs_version_matcher.group(2)) - int(rhs_version_matcher.group(2))
@@ -1539,92 +2163,476 @@ def get_latest_annotation_dictionary_version(json_schema_dirs):
     annotation_versions = []
     for json_dir in json_schema_dirs:
         pinned_schema = os.path.join(json_dir, 'redfish-payload-annotations-v1.json')
-        with open(pinned_schema) as f:
-            schema_contents = json.load(f)
-            m = re.compile('\.(v\d+_\d+_\d+)\.json').search(schema_contents['$id']).group(1)
-            annotation_versions.append(m)
+        schema_contents = get_json_schema_index().get_schema(pinned_schema)
+        if schema_contents is None:
+            raise FileNotFoundError('No such file: ' + pinned_schema)
+        m = re.compile('\.(v\d+_\d+_\d+)\.json').search(schema_contents['$id']).group(1)
+        annotation_versions.append(m)
 
     if len(annotation_versions) > 1:
         annotation_versions.sort(key=cmp_to_key(schema_version_string_compare))
     return annotation_versions[-1]
 
 
-def generate_annotation_schema_dictionary(csdl_schema_dirs, json_schema_dirs, version=None, copyright=None):
-    """ Generate the annotation schema dictionary.
+def is_verbose():
+    return verbose
 
-    Args:
-        csdl_schema_dirs: List of CSDL schema directories.
-        json_schema_dirs: List of JSON schema directories.
-        version: The version of the annotation in Redfish format (e.g. v1_0_0) (default None).
 
-    Return:
-        SchemaDictionary: Named tuple which has the following fields:
-                          dictionary - The annotation dictionary.
-                          dictionary_byte_array - The annotation dictionary in byte array.
-                          json_dictionary - Annotation dictionary in JSON format.
+class DictionaryBuilder:
     """
-    global includeNamespaces
-    global verbose
+    Builds dictionaries from a set of CSDL and json-schema directories. The builder owns the state of a build: the
+    namespaces and documents that were loaded, the entity repo built from them and the build options. Each build
+    starts from a clean state, so a builder can be reused for several dictionaries in turn.
 
-    # Initialize the global variables.
-    doc_list = {}
-    entity_repo = {}
-    entity_offset_map = {}
-    includeNamespaces = {}
+    Builders running on different threads do not share any state besides their SchemaSet, so dictionaries for
+    different entities can be built concurrently while every schema file is read and parsed only once.
+    """
+    def __init__(self, csdl_schema_dirs, json_schema_dirs, copyright=None, schema_set=None, verbose=None,
+                 share_subtrees=False):
+        """
+        Args:
+            csdl_schema_dirs: List of CSDL schema directories.
+            json_schema_dirs: List of JSON schema directories.
+            copyright: Copyright string that should be appended to the binary dictionaries (default None).
+            schema_set: SchemaSet of parsed CSDL documents to reuse across dictionary builds (default None).
+            verbose: Print the intermediate build state (default None, use the module verbose flag).
+            share_subtrees: Store identical runs of entries once in schema dictionaries, see
+                            share_identical_subtrees() (default False).
+        """
+        self.csdl_schema_dirs = csdl_schema_dirs
+        self.json_schema_dirs = json_schema_dirs
+        self.copyright = copyright
+        self.share_subtrees = share_subtrees
+        self.schema_set = schema_set if schema_set is not None else SchemaSet()
+        self.verbose = verbose if verbose is not None else is_verbose()
+        self.reset()
+
+    def reset(self):
+        self.include_namespaces = {}  # Dict of the namespaces used to build the dictionary to their CsdlDocument
+        self.namespace_lookups = None  # Set of the namespaces looked up while extracting a document
+        self.doc_list = {}
+        self.entity_repo = {}
+        self.entity_offset_map = {}
+
+    @contextmanager
+    def activate(self):
+        """
+        Makes this builder the one that the module functions use on the current thread
+        """
+        previous_builder = get_current_builder()
+        build_state.builder = self
+        try:
+            yield self
+        finally:
+            build_state.builder = previous_builder
+
+    def find_csdl_file(self, schema_file_name):
+        """
+        Returns the path of schema_file_name in the first CSDL directory that has it, or schema_file_name
+        """
+        for csdl_dir in self.csdl_schema_dirs:
+            if is_dependency_file(os.path.join(csdl_dir, schema_file_name)):
+                return os.path.join(csdl_dir, schema_file_name)
+        return schema_file_name
+
+    def add_namespaces(self, source):
+        # check to see if source is from a remote location
+        is_remote = re.search("^http(s?)://", source) is not None
+
+        doc_name = source
+        if is_remote:
+            doc_name = extract_doc_name_from_url(source)
 
-    # Set the schema file name and entity for annotations.
-    # TODO: Does not work with remote locations
-    schema_file_name = 'RedfishExtensions_v1.xml'
-    entity = 'RedfishExtensions.PropertyPattern'
+        if doc_name in self.doc_list:
+            return
 
-    # Compute source starting with the first csdl directory. The first one wins.
-    source = schema_file_name
-    for csdl_dir in csdl_schema_dirs:
-        if os.path.isfile(os.path.join(csdl_dir, schema_file_name)):
-            source = os.path.join(csdl_dir, schema_file_name)
-            break
+        # ignore odata references
+        if is_remote and source.find('http://docs.oasis') != -1:
+            return
 
-    # Add namespaces.
-    add_namespaces(csdl_schema_dirs, source, doc_list)
+        document = self.schema_set.get_document(source, is_remote)
+        if document is None:
+            return
 
-    if verbose:
-        pprint.PrettyPrinter(indent=3).pprint(doc_list)
+        if not is_remote:
+            add_dependency_file(source, document.digest)
 
-    add_all_entity_and_complex_types(doc_list, entity_repo)
-    if verbose:
-        pprint.PrettyPrinter(indent=3).pprint(entity_repo)
+        self.doc_list[doc_name] = document
+        # load all namespaces in the current doc
+        for namespace_name in document.namespaces:
+            if namespace_name not in self.include_namespaces:
+                self.include_namespaces[namespace_name] = document
+            else:
+                return
 
-    # search for entity and build dictionary
-    if entity in entity_repo:
-        ver = ''
-        if version == 'v1':
-            version = get_latest_annotation_dictionary_version(json_schema_dirs)
-        dictionary = generate_annotation_dictionary(version, json_schema_dirs, entity_repo, entity_offset_map)
-        ver = to_ver32(version)
+        # bring in all dependent documents and their corresponding namespaces
+        for uri in document.references:
+            if is_remote:
+                dependent_source = uri
+            else:
+                dependent_source = find_csdl_source(self.csdl_schema_dirs, extract_doc_name_from_url(uri))
 
+                if os.path.exists(dependent_source) is False:
+                    continue
+                if self.verbose:
+                    print(dependent_source)
+            self.add_namespaces(dependent_source)
+
+    def build_entity_repo(self, sources):
+        """
+        Loads the CSDL documents for sources along with the documents they reference and builds the entity repo
+        """
+        for source in sources:
+            self.add_namespaces(source)
+
+        if self.verbose:
+            pprint.PrettyPrinter(indent=3).pprint(self.doc_list)
+
+        add_all_entity_and_complex_types(self.doc_list, self.entity_repo)
+        if self.verbose:
+            pprint.PrettyPrinter(indent=3).pprint(self.entity_repo)
+
+    def build_annotation_dictionary(self, version=None):
+        """ Generate the annotation schema dictionary.
+
+        Args:
+            version: The version of the annotation in Redfish format (e.g. v1_0_0) (default None).
+
+        Return:
+            SchemaDictionary
+        """
+        self.reset()
+        with self.activate():
+            # Set the schema file name and entity for annotations.
+            # TODO: Does not work with remote locations
+            schema_file_name = 'RedfishExtensions_v1.xml'
+            entity = 'RedfishExtensions.PropertyPattern'
+
+            # Compute source starting with the first csdl directory. The first one wins.
+            self.build_entity_repo([self.find_csdl_file(schema_file_name)])
+
+            # search for entity and build dictionary
+            if entity in self.entity_repo:
+                ver = ''
+                if version == 'v1':
+                    version = get_latest_annotation_dictionary_version(self.json_schema_dirs)
+                dictionary = generate_annotation_dictionary(version, self.json_schema_dirs, self.entity_repo,
+                                                            self.entity_offset_map)
+                ver = to_ver32(version)
+
+                # Generate dictionary_byte_array.
+                dictionary_byte_array = generate_byte_array(dictionary, ver, False, self.copyright)
+
+                # Generate JSON dictionary.
+                json_dictionary = generate_json_dictionary(self.json_schema_dirs, dictionary, dictionary_byte_array,
+                                                           'annotation')
+                # Return the named tuple.
+                return (SchemaDictionary(dictionary=dictionary,
+                                         dictionary_byte_array=dictionary_byte_array,
+                                         json_dictionary=json_dictionary))
+
+            # Reached here means something went wrong. Return an empty named tuple.
+            else:
+                if self.verbose:
+                    print('Error, cannot find entity:', entity)
+                return (SchemaDictionary(dictionary=None,
+                                         dictionary_byte_array=None,
+                                         json_dictionary=None))
+
+    def add_oem_entity(self, entity, oem_entities, oem_schema_file_names):
+        """
+        Creates the special entity that holds the OEM extensions of an entity
+
+        Return:
+            The name of the OEM entity and the list of OEM schema sources to load
+        """
+        oem_sources = []
+        for oem_schema_file in oem_schema_file_names:
+            for csdl_dir in self.csdl_schema_dirs:
+                if is_dependency_file(os.path.join(csdl_dir, oem_schema_file)):
+                    oem_sources.append(os.path.join(csdl_dir, oem_schema_file))
+
+        oem_entity_type = entity + '.Oem'
+        # create a special entity for OEM and set the major entity's oem section to it
+        self.entity_repo[oem_entity_type] = ('Set', [])
+        for oemEntityPair in oem_entities:
+            oemName, oem_entity = oemEntityPair.split('=')
+            self.entity_repo[oem_entity_type][ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX].append(
+               [oemName, 'Set', '', oem_entity])
+
+        return oem_entity_type, oem_sources
+
+    def set_oem_entity(self, entity, oem_entity_type):
+        """
+        Sets the Oem property of the entity to the special OEM entity type
+        """
+        for property in self.entity_repo[entity][ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX]:
+            if property[PROPERTY_FIELD_STRING] == 'Oem':
+                property[PROPERTY_OFFSET] = oem_entity_type
+
+    def build_schema_entity_repo(self, source_type, entity, source, oem_entities=None, oem_schema_file_names=None):
+        """
+        Loads the CSDL documents of a schema and its OEM extensions and builds the entity repo, with the Oem property
+        of the entity set to an entity that holds the OEM extensions
+        """
+        oem_sources = []
+        oem_entity_type = ''
+
+        # Set oem sources and entity repo for oem schema file names.
+        if oem_schema_file_names:
+            oem_entity_type, oem_sources = self.add_oem_entity(entity, oem_entities, oem_schema_file_names)
+
+        # Add namespaces.
+        self.build_entity_repo([source] + oem_sources)
+
+        # set the entity oem entry to the special OEM entity type
+        if source_type == 'local' and oem_schema_file_names:
+            self.set_oem_entity(entity, oem_entity_type)
+
+    def load_profile_requirements(self, profile, entity, entity_repo):
+        """
+        Reads a profile file and returns the required_properties it specifies for the entity, or None if the profile
+        does not specify any
+        """
+        add_dependency_file(profile)
+        with open(profile) as file:
+            json_profile = json.load(file)
+        # Fix up the profile
+        profile_requirements = process_profile(json_profile, entity, entity_repo)
+        if not profile_requirements and self.verbose:
+            print('Error parsing profile')
+        return profile_requirements
+
+    def generate_entity_dictionary(self, entity, entity_repo, is_truncated):
+        """
+        Generates the SchemaDictionary of an entity from an entity repo built by this builder
+        """
+        self.entity_offset_map = {}
+        dictionary = []
+        add_dictionary_entries(dictionary, entity_repo, entity, self.entity_offset_map, True,
+                               get_entity_name(entity), None)
+        dictionary = generate_dictionary(dictionary, entity_repo, self.entity_offset_map,
+                                         share_subtrees=self.share_subtrees)
+        ver = get_latest_version_as_ver32(entity)
+        if self.verbose:
+            print(self.entity_offset_map)
+
+        return self.generate_schema_dictionary_tuple(entity, dictionary, ver, is_truncated)
+
+    def generate_schema_dictionary_tuple(self, entity, dictionary, ver, is_truncated):
         # Generate dictionary_byte_array.
-        dictionary_byte_array = generate_byte_array(dictionary, ver, False, copyright)
+        dictionary_byte_array = generate_byte_array(dictionary, ver, is_truncated, self.copyright)
 
         # Generate JSON dictionary.
-        json_dictionary = generate_json_dictionary(json_schema_dirs, dictionary, dictionary_byte_array, 'annotation')
+        json_dictionary = generate_json_dictionary(self.json_schema_dirs, dictionary, dictionary_byte_array,
+                                                   entity)
+
         # Return the named tuple.
         return (SchemaDictionary(dictionary=dictionary,
                                  dictionary_byte_array=dictionary_byte_array,
                                  json_dictionary=json_dictionary))
 
-    # Reached here means something went wrong. Return an empty named tuple.
-    else:
-        if verbose:
-            print('Error, cannot find entity:', entity)
-        return (SchemaDictionary(dictionary=None,
-                                 dictionary_byte_array=None,
-                                 json_dictionary=None))
+    def build_schema_dictionary(self, source_type, entity, schema_file_name, oem_entities=None,
+                                oem_schema_file_names=None, profile=None, schema_url=None, corpus=None):
+        """ Generate the schema dictionary.
+
+        Args:
+            source_type: Type of schema file. local or remote.
+            entity: Schema entity name.
+            schema_file_name: Schema file name.
+            oem_entities: List of oem entities (default None).
+            oem_schema_file_names: List of OEM schema file names (default None).
+            profile: Schema profile (default None)
+            schema_url: Schema URL. Used when source_type is remote (default None).
+            corpus: List of payload files or directories of them. The dictionary is truncated to the properties and
+                    enum values the payloads use (default None).
+
+        Return:
+            SchemaDictionary
+        """
+        self.reset()
+        with self.activate():
+            entity_repo = self.entity_repo
+
+            # Validate source type.
+            if source_type not in ['local', 'remote']:
+                if self.verbose:
+                    print('Error, invalid source_type: {0}'.format(source_type))
+                return (SchemaDictionary(dictionary=None,
+                                         dictionary_byte_array=None,
+                                         json_dictionary=None))
+
+            # Set the source variable. If source_type is remote set source to schema_url.
+            if source_type == 'remote':
+                source = schema_url
+            else:
+                # compute source starting with the first csdl directory. The first one wins
+                source = self.find_csdl_file(schema_file_name)
+
+            self.build_schema_entity_repo(source_type, entity, source, oem_entities, oem_schema_file_names)
+
+            # search for entity and build dictionary
+            if entity in entity_repo:
+                if source_type == 'local':
+                    # truncate the entity_repo first if a profile is specified
+                    is_truncated = False
+                    if profile:
+                        profile_requirements = self.load_profile_requirements(profile, entity, entity_repo)
+                        if profile_requirements:
+                            is_truncated = truncate_entity_repo(entity_repo, profile_requirements)
+                        else:
+                            return (SchemaDictionary(dictionary=None,
+                                                     dictionary_byte_array=None,
+                                                     json_dictionary=None))
+
+                    # truncate the entity_repo to what a corpus of payloads uses
+                    if corpus:
+                        corpus_requirements = process_corpus(load_corpus(corpus), entity, entity_repo)
+                        if truncate_entity_repo(entity_repo, corpus_requirements):
+                            is_truncated = True
+
+                    return self.generate_entity_dictionary(entity, entity_repo, is_truncated)
+
+                return self.generate_schema_dictionary_tuple(entity, [], '', False)
+
+            # Reached here means something went wrong. Return an empty named tuple.
+            else:
+                if self.verbose:
+                    print('Error, cannot find entity:', entity)
+                return (SchemaDictionary(dictionary=None,
+                                         dictionary_byte_array=None,
+                                         json_dictionary=None))
+
+    def build_profile_dictionaries(self, entity, schema_file_name, profiles, oem_entities=None,
+                                   oem_schema_file_names=None):
+        """ Generate a truncated schema dictionary for each of a list of profiles.
+
+        The schema is loaded and its entity repo built once, then each profile truncates a copy of the entity repo.
+
+        Args:
+            entity: Schema entity name.
+            schema_file_name: Schema file name.
+            profiles: List of schema profiles.
+            oem_entities: List of oem entities (default None).
+            oem_schema_file_names: List of OEM schema file names (default None).
+
+        Return:
+            Dict of each profile to its SchemaDictionary. The SchemaDictionary fields are None for a profile that
+            could not be parsed.
+        """
+        self.reset()
+        with self.activate():
+            self.build_schema_entity_repo('local', entity, self.find_csdl_file(schema_file_name), oem_entities,
+                                          oem_schema_file_names)
+
+            schema_dictionaries = {}
+            for profile in profiles:
+                schema_dictionaries[profile] = SchemaDictionary(dictionary=None,
+                                                                dictionary_byte_array=None,
+                                                                json_dictionary=None)
+                if entity not in self.entity_repo:
+                    if self.verbose:
+                        print('Error, cannot find entity:', entity)
+                    continue
+
+                profile_requirements = self.load_profile_requirements(profile, entity, self.entity_repo)
+                if profile_requirements:
+                    entity_repo = copy_entity_repo(self.entity_repo)
+                    is_truncated = truncate_entity_repo(entity_repo, profile_requirements)
+                    schema_dictionaries[profile] = self.generate_entity_dictionary(entity, entity_repo, is_truncated)
+
+            return schema_dictionaries
+
+    def build_oem_dictionaries(self, entity, schema_file_name, oem_variants):
+        """ Generate the schema dictionary of an entity for each of a list of OEM extension combinations.
+
+        The schema is loaded and its entity repo built once, then each variant copies it and adds only the types of
+        its OEM schema files and the documents they reference. The dictionaries are the same as the ones
+        build_schema_dictionary() generates for each combination.
+
+        Args:
+            entity: Schema entity name.
+            schema_file_name: Schema file name.
+            oem_variants: List of (oem_entities, oem_schema_file_names) pairs, see build_schema_dictionary().
+
+        Return:
+            List of the SchemaDictionary of each variant
+        """
+        self.reset()
+        with self.activate():
+            self.add_namespaces(self.find_csdl_file(schema_file_name))
+            base_doc_list = self.doc_list
+            base_include_namespaces = self.include_namespaces
+            base_entity_repo = {}
+            add_document_entity_and_complex_types(base_doc_list.values(), base_entity_repo)
+
+            schema_dictionaries = []
+            for oem_entities, oem_schema_file_names in oem_variants:
+                self.doc_list = dict(base_doc_list)
+                self.include_namespaces = dict(base_include_namespaces)
+                # sequence numbers are inserted into the property entries, so each variant gets its own copies
+                self.entity_repo = {}
+                oem_entity_type, oem_sources = '', []
+                if oem_schema_file_names:
+                    oem_entity_type, oem_sources = self.add_oem_entity(entity, oem_entities, oem_schema_file_names)
+                for entity_type_name, (entity_type, properties) in base_entity_repo.items():
+                    self.entity_repo.setdefault(entity_type_name, (entity_type, []))[
+                        ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX].extend(list(property) for property in properties)
+
+                for source in oem_sources:
+                    self.add_namespaces(source)
+                add_document_entity_and_complex_types(
+                    [document for doc_name, document in self.doc_list.items() if doc_name not in base_doc_list],
+                    self.entity_repo)
+                add_sequence_numbers(self.entity_repo)
+
+                if entity not in self.entity_repo:
+                    if self.verbose:
+                        print('Error, cannot find entity:', entity)
+                    schema_dictionaries.append(SchemaDictionary(dictionary=None,
+                                                                dictionary_byte_array=None,
+                                                                json_dictionary=None))
+                    continue
+
+                if oem_schema_file_names:
+                    self.set_oem_entity(entity, oem_entity_type)
+                schema_dictionaries.append(self.generate_entity_dictionary(entity, self.entity_repo, False))
+
+            return schema_dictionaries
+
+    def build_error_dictionary(self):
+        """ Generate the error schema dictionary.
+
+        Return:
+            SchemaDictionary
+        """
+        return self.build_schema_dictionary('local', 'RedfishError.RedfishError', 'RedfishError_v1.xml')
+
+
+def generate_annotation_schema_dictionary(csdl_schema_dirs, json_schema_dirs, version=None, copyright=None,
+                                          schema_set=None):
+    """ Generate the annotation schema dictionary.
+
+    Args:
+        csdl_schema_dirs: List of CSDL schema directories.
+        json_schema_dirs: List of JSON schema directories.
+        version: The version of the annotation in Redfish format (e.g. v1_0_0) (default None).
+        schema_set: SchemaSet of parsed CSDL documents to reuse across dictionary builds (default None).
+
+    Return:
+        SchemaDictionary: Named tuple which has the following fields:
+                          dictionary - The annotation dictionary.
+                          dictionary_byte_array - The annotation dictionary in byte array.
+                          json_dictionary - Annotation dictionary in JSON format.
+    """
+    builder = DictionaryBuilder(csdl_schema_dirs, json_schema_dirs, copyright, schema_set)
+    return builder.build_annotation_dictionary(version)
 
 
 def generate_schema_dictionary(source_type, csdl_schema_dirs, json_schema_dirs,
                                entity, schema_file_name, oem_entities=None,
                                oem_schema_file_names=None, profile=None, schema_url=None,
-                               copyright=None):
+                               copyright=None, schema_set=None, share_subtrees=False, corpus=None):
     """ Generate the schema dictionary.
 
     Args:
@@ -1638,6 +2646,9 @@ def generate_schema_dictionary(source_type, csdl_schema_dirs, json_schema_dirs,
         profile: Schema profile (default None)
         schema_url: Schema URL. Used when source_type is remote (default None).
         copyright: Copyright string that should be appended to the binary dictionary
+        schema_set: SchemaSet of parsed CSDL documents to reuse across dictionary builds (default None).
+        share_subtrees: Store identical runs of entries once, see share_identical_subtrees() (default False).
+        corpus: List of payload files or directories of them to truncate the dictionary to (default None).
 
     Return:
         SchemaDictionary: Named tuple which has the following fields:
@@ -1645,122 +2656,66 @@ def generate_schema_dictionary(source_type, csdl_schema_dirs, json_schema_dirs,
                           dictionary_byte_array - The schema dictionary in byte array.
                           json_dictionary - Schema dictionary in JSON format.
     """
-    global includeNamespaces
-    global verbose
+    builder = DictionaryBuilder(csdl_schema_dirs, json_schema_dirs, copyright, schema_set,
+                                share_subtrees=share_subtrees)
+    return builder.build_schema_dictionary(source_type, entity, schema_file_name, oem_entities, oem_schema_file_names,
+                                           profile, schema_url, corpus)
 
-    # Initialize the global variables.
-    doc_list = {}
-    oem_sources = []
-    oem_entity_type = ''
-    entity_repo = {}
-    entity_offset_map = {}
-    includeNamespaces = {}
-
-    # Validate source type.
-    if source_type not in ['local', 'remote']:
-        if verbose:
-            print('Error, invalid source_type: {0}'.format(source_type))
-        return (SchemaDictionary(dictionary=None,
-                                 dictionary_byte_array=None,
-                                 json_dictionary=None))
-
-    # Set the source variable. If source_type is remote set source to schema_url.
-    if source_type == 'remote':
-        source = schema_url
-    else:
-        # compute source starting with the first csdl directory. The first one wins
-        source = schema_file_name
-        for csdl_dir in csdl_schema_dirs:
-            if os.path.isfile(os.path.join(csdl_dir, schema_file_name)):
-                source = os.path.join(csdl_dir, schema_file_name)
-                break
-
-    # Set oem sources and entity repo for oem schema file names.
-    if oem_schema_file_names:
-        for oem_schema_file in oem_schema_file_names:
-            for csdl_dir in csdl_schema_dirs:
-                if os.path.isfile(os.path.join(csdl_dir, oem_schema_file)):
-                    oem_sources.append(os.path.join(csdl_dir, oem_schema_file))
-
-        oem_entity_type = entity + '.Oem'
-        # create a special entity for OEM and set the major entity's oem section to it
-        entity_repo[oem_entity_type] = ('Set', [])
-        for oemEntityPair in oem_entities:
-            oemName, oem_entity = oemEntityPair.split('=')
-            entity_repo[oem_entity_type][ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX].append(
-               [oemName, 'Set', '', oem_entity])
-
-    # Add namespaces.
-    add_namespaces(csdl_schema_dirs, source, doc_list)
-    for oemSource in oem_sources:
-        add_namespaces(csdl_schema_dirs, oemSource, doc_list)
-
-    if verbose:
-        pprint.PrettyPrinter(indent=3).pprint(doc_list)
 
-    add_all_entity_and_complex_types(doc_list, entity_repo)
-    if verbose:
-        pprint.PrettyPrinter(indent=3).pprint(entity_repo)
+def generate_profile_schema_dictionaries(csdl_schema_dirs, json_schema_dirs, entity, schema_file_name, profiles,
+                                         oem_entities=None, oem_schema_file_names=None, copyright=None,
+                                         schema_set=None, share_subtrees=False):
+    """ Generate a truncated schema dictionary for each of a list of profiles.
 
-    # set the entity oem entry to the special OEM entity type
-    if source_type == 'local' and oem_schema_file_names:
-        for property in entity_repo[entity][ENTITY_REPO_TUPLE_PROPERTY_LIST_INDEX]:
-            if property[PROPERTY_FIELD_STRING] == 'Oem':
-                property[PROPERTY_OFFSET] = oem_entity_type
+    Args:
+        csdl_schema_dirs: List of XML schema directories.
+        json_schema_dirs: List of JSON schema directories.
+        entity: Schema entity name.
+        schema_file_name: Schema file name.
+        profiles: List of schema profiles.
+        oem_entities: List of oem entities (default None).
+        oem_schema_file_names: List of OEM schema file names (default None).
+        copyright: Copyright string that should be appended to the binary dictionaries
+        schema_set: SchemaSet of parsed CSDL documents to reuse across dictionary builds (default None).
+        share_subtrees: Store identical runs of entries once, see share_identical_subtrees() (default False).
 
-    # search for entity and build dictionary
-    if entity in entity_repo:
-        ver = ''
-        dictionary = []
-        if source_type == 'local':
-            # truncate the entity_repo first if a profile is specified
-            is_truncated = False
-            if profile:
-                with open(profile) as file:
-                    json_profile = json.load(file)
-                # Fix up the profile
-                profile_requirements = process_profile(json_profile, entity, entity_repo)
-                if profile_requirements:
-                    is_truncated = truncate_entity_repo(entity_repo, profile_requirements)
-                else:
-                    if verbose:
-                        print('Error parsing profile')
-                    return (SchemaDictionary(dictionary=None,
-                                             dictionary_byte_array=None,
-                                             json_dictionary=None))
-
-            add_dictionary_entries(dictionary, entity_repo, entity, entity_offset_map, True, get_entity_name(entity), None)
-            dictionary = generate_dictionary(dictionary, entity_repo, entity_offset_map)
-            ver = get_latest_version_as_ver32(entity)
-            if verbose:
-                print(entity_offset_map)
+    Return:
+        Dict of each profile to its SchemaDictionary, see generate_schema_dictionary().
+    """
+    builder = DictionaryBuilder(csdl_schema_dirs, json_schema_dirs, copyright, schema_set,
+                                share_subtrees=share_subtrees)
+    return builder.build_profile_dictionaries(entity, schema_file_name, profiles, oem_entities, oem_schema_file_names)
 
-        # Generate dictionary_byte_array.
-        dictionary_byte_array = generate_byte_array(dictionary, ver, is_truncated, copyright)
 
-        # Generate JSON dictionary.
-        json_dictionary = generate_json_dictionary(json_schema_dirs, dictionary, dictionary_byte_array, entity)
+def generate_oem_schema_dictionaries(csdl_schema_dirs, json_schema_dirs, entity, schema_file_name, oem_variants,
+                                     copyright=None, schema_set=None, share_subtrees=False):
+    """ Generate the schema dictionary of an entity for each of a list of OEM extension combinations.
 
-        # Return the named tuple.
-        return (SchemaDictionary(dictionary=dictionary,
-                                 dictionary_byte_array=dictionary_byte_array,
-                                 json_dictionary=json_dictionary))
+    Args:
+        csdl_schema_dirs: List of XML schema directories.
+        json_schema_dirs: List of JSON schema directories.
+        entity: Schema entity name.
+        schema_file_name: Schema file name.
+        oem_variants: List of (oem_entities, oem_schema_file_names) pairs.
+        copyright: Copyright string that should be appended to the binary dictionaries
+        schema_set: SchemaSet of parsed CSDL documents to reuse across dictionary builds (default None).
+        share_subtrees: Store identical runs of entries once, see share_identical_subtrees() (default False).
 
-    # Reached here means something went wrong. Return an empty named tuple.
-    else:
-        if verbose:
-            print('Error, cannot find entity:', entity)
-        return (SchemaDictionary(dictionary=None,
-                                 dictionary_byte_array=None,
-                                 json_dictionary=None))
+    Return:
+        List of the SchemaDictionary of each variant, see generate_schema_dictionary().
+    """
+    builder = DictionaryBuilder(csdl_schema_dirs, json_schema_dirs, copyright, schema_set,
+                                share_subtrees=share_subtrees)
+    return builder.build_oem_dictionaries(entity, schema_file_name, oem_variants)
 
 
-def generate_error_schema_dictionary(csdl_schema_dirs, json_schema_dirs, copyright=None):
+def generate_error_schema_dictionary(csdl_schema_dirs, json_schema_dirs, copyright=None, schema_set=None):
     """ Generate the error schema dictionary.
 
     Args:
         csdl_schema_dirs: List of CSDL schema directories.
         json_schema_dirs: List of JSON schema directories.
+        schema_set: SchemaSet of parsed CSDL documents to reuse across dictionary builds (default None).
 
     Return:
         SchemaDictionary: Named tuple which has the following fields:
@@ -1768,7 +2723,5 @@ def generate_error_schema_dictionary(csdl_schema_dirs, json_schema_dirs, copyrig
                           dictionary_byte_array - The error schema dictionary in byte array.
                           json_dictionary - Error schema dictionary in JSON format.
     """
-    return generate_schema_dictionary('local', csdl_schema_dirs, json_schema_dirs,
-                                      'RedfishError.RedfishError', 'RedfishError_v1.xml',
-                                      oem_entities=None, oem_schema_file_names=None, profile=None, schema_url=None,
-                                      copyright=copyright)
+    builder = DictionaryBuilder(csdl_schema_dirs, json_schema_dirs, copyright, schema_set)
+    return builder.build_error_dictionary()
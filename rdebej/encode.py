@@ -16,9 +16,16 @@ import io
 import os
 import re
 import string
+from concurrent.futures import ProcessPoolExecutor
 from ._internal_utils import *
+from .loader import BinaryDictionary
 from math import *
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 NUM_BYTES_FOR_INTEGER = 8
 
@@ -270,6 +277,112 @@ def bej_pack_sflv_real(stream, seq_num, value, format_flags, precision=16):
     return num_bytes_packed
 
 
+def num_bytes_for_unsigned_integers(values):
+    """
+    Vectorized num_bytes_for_unsigned_integer() for a NumPy array of non-negative integers
+    """
+    num_bytes = np.ones(len(values), dtype=np.uint8)
+    for i in range(1, NUM_BYTES_FOR_INTEGER):
+        num_bytes += values >= (1 << (8 * i))
+
+    return num_bytes
+
+
+def get_num_bytes_for_integers(values):
+    """
+    Vectorized get_num_bytes_and_padding() for a NumPy int64 array
+
+    Return: array of the number of bytes to pack for each value (including padding), or None if a value does not
+    fit in the fixed integer length
+    """
+    # number of bytes left after dropping the leading 0x00 (or 0xff for negative values) bytes
+    num_bytes_for_value = np.ones(len(values), dtype=np.uint8)
+    for i in range(1, NUM_BYTES_FOR_INTEGER):
+        num_bytes_for_value += np.where(values >= 0, values >= (1 << (8 * i)), values < -(1 << (8 * i)))
+
+    if fixed_integer_length != 0:
+        if fixed_integer_length > NUM_BYTES_FOR_INTEGER or (num_bytes_for_value > fixed_integer_length).any():
+            return None
+        return np.full(len(values), fixed_integer_length, dtype=np.uint8)
+
+    msb = (values >> (8 * (num_bytes_for_value.astype(np.int64) - 1))) & 0x80
+    is_padding_required = ((values > 0) & (msb != 0)) | ((values < 0) & (msb == 0))
+    return num_bytes_for_value + is_padding_required
+
+
+def bej_pack_numeric_array(format, json_values, selector):
+    """
+    Packs all the elements of an Integer or Real array as SFLV tuples in one vectorized pass. The output is
+    identical to packing each element with bej_pack_sflv_integer()/bej_pack_sflv_real().
+
+    Args:
+        format: BEJ format of the array elements (BEJ_FORMAT_INTEGER or BEJ_FORMAT_REAL)
+        json_values: list of JSON numbers
+        selector: dictionary selector to add to the element sequence numbers
+
+    Return: packed bytes, or None if the array has to be packed element by element
+    """
+    count = len(json_values)
+    if format == BEJ_FORMAT_INTEGER:
+        if not all(type(value) is int for value in json_values):
+            return None
+        whole_values = json_values
+    elif format == BEJ_FORMAT_REAL:
+        # the whole length written by bej_pack_sflv_real() ignores the fixed integer length, keep that path as is
+        if fixed_integer_length != 0 or not all(type(value) in (float, int) for value in json_values):
+            return None
+        try:
+            whole_values, frac_values, num_leading_zeros = zip(*[split_whole_frac_leading_zeros(value, 16)
+                                                                  for value in json_values])
+            frac_values = np.array(frac_values, dtype=np.uint64)
+            num_leading_zeros = np.array(num_leading_zeros, dtype=np.uint64)
+        except (ValueError, OverflowError):
+            return None
+    else:
+        return None
+
+    try:
+        whole_values = np.array(whole_values, dtype=np.int64)
+    except OverflowError:
+        return None
+
+    num_bytes_for_whole = get_num_bytes_for_integers(whole_values)
+    if num_bytes_for_whole is None:
+        return None
+
+    sequence_numbers = (np.arange(count, dtype=np.uint64) << 1) | selector
+    num_bytes_for_seq = num_bytes_for_unsigned_integers(sequence_numbers)
+
+    def column(value):
+        return np.full((count, 1), value, dtype=np.uint8)
+
+    def nnint_bytes(values):
+        return values.astype('<u8').view(np.uint8).reshape(count, NUM_BYTES_FOR_INTEGER)
+
+    # every element is a row of fields, a field is a (bytes, number of leading bytes used) pair
+    fields = [(num_bytes_for_seq[:, None], 1), (nnint_bytes(sequence_numbers), num_bytes_for_seq)]
+    if format == BEJ_FORMAT_INTEGER:
+        fields += [(column(BEJ_FORMAT_INTEGER << 4), 1), (column(1), 1), (num_bytes_for_whole[:, None], 1)]
+    else:
+        num_bytes_for_leading_zeros = num_bytes_for_unsigned_integers(num_leading_zeros)
+        num_bytes_for_frac = num_bytes_for_unsigned_integers(frac_values)
+        total_length = 2 + num_bytes_for_whole + 1 + num_bytes_for_leading_zeros + 1 + num_bytes_for_frac + 2
+        fields += [(column(BEJ_FORMAT_REAL << 4), 1), (column(1), 1), (total_length[:, None], 1),
+                   (column(1), 1), (num_bytes_for_whole[:, None], 1)]
+    fields += [(whole_values.astype('<i8').view(np.uint8).reshape(count, NUM_BYTES_FOR_INTEGER), num_bytes_for_whole)]
+    if format == BEJ_FORMAT_REAL:
+        fields += [(num_bytes_for_leading_zeros[:, None], 1),
+                   (nnint_bytes(num_leading_zeros), num_bytes_for_leading_zeros),
+                   (num_bytes_for_frac[:, None], 1),
+                   (nnint_bytes(frac_values), num_bytes_for_frac),
+                   (column(1), 1), (column(0), 1)]  # Length of exp == 0
+
+    rows = np.concatenate([field for field, used in fields], axis=1)
+    mask = np.concatenate([np.broadcast_to(np.arange(field.shape[1]) < np.reshape(used, (-1, 1)), field.shape)
+                           for field, used in fields], axis=1)
+    return rows[mask].tobytes()
+
+
 def bej_pack_sflv_enum(stream, seq_num, value, format_flags):
     enum_value_size = num_bytes_for_unsigned_integer(value) + 1 # enum value size as nint
     num_bytes_packed = bej_pack_sfl(stream, seq_num, BEJ_FORMAT_ENUM, enum_value_size, format_flags)
@@ -355,8 +468,17 @@ def bej_pack_property_annotation_done(stream, prop_seq, format_flags=0):
 
 current_available_pdr = 0
 
+# Globals for parallel array encoding - Warning! not thread safe
+parallel_array_workers = 0
+parallel_array_threshold = PARALLEL_ARRAY_THRESHOLD
+parallel_array_pool = None
+parallel_array_dictionaries = None
+
 
 def load_dictionary_subset_by_key_name(schema_dict, offset, child_count):
+    if isinstance(schema_dict, BinaryDictionary):
+        return schema_dict.get_entries_by_name(offset, child_count)
+
     schema_dict_stream = DictionaryByteArrayStream(schema_dict, offset, child_count)
 
     entry_dict = {}
@@ -422,6 +544,96 @@ def is_dict_entry_nullable(dict_entry):
     return False
 
 
+def bej_encode_parallel_worker_init(schema_dict, annot_dict, fixed_int_len):
+    """
+    Initializes a worker process that encodes slices of large arrays
+    """
+    global fixed_integer_length, parallel_array_workers, parallel_array_pool, parallel_array_dictionaries
+    fixed_integer_length = fixed_int_len
+    # workers always encode their slice serially
+    parallel_array_workers = 0
+    parallel_array_pool = None
+    parallel_array_dictionaries = (schema_dict, annot_dict)
+
+
+def bej_encode_array_slice(is_annotation, array_dict_entry, json_values, start_index, selector, pdr_map, next_pdr,
+                           verbose, is_strict, preserve_odata_id_strings):
+    """
+    Encodes a contiguous slice of array elements in a worker process
+
+    Return:
+        Tuple (success, encoded bytes, list of (resource link, pdr) pairs added to the PDR map by this slice)
+    """
+    global current_available_pdr
+    current_available_pdr = next_pdr
+    schema_dict, annot_dict = parallel_array_dictionaries
+    dict_to_use = annot_dict if is_annotation else schema_dict
+    known_links = set(pdr_map)
+
+    stream = io.BytesIO()
+    success = True
+    for i, json_value in enumerate(json_values, start_index):
+        success = bej_encode_sflv(stream, schema_dict, annot_dict, dict_to_use, array_dict_entry,
+                                  (i << 1) | selector, array_dict_entry[DICTIONARY_ENTRY_FORMAT],
+                                  json_value, pdr_map, 0, verbose, is_strict, preserve_odata_id_strings)
+        if not success:
+            break
+
+    new_links = [(link, pdr) for link, pdr in pdr_map.items() if link not in known_links]
+    return success, stream.getvalue(), new_links
+
+
+def bej_encode_array_parallel(output_stream, schema_dict, annot_dict, dict_to_use, array_dict_entry, json_value,
+                              selector, pdr_map, verbose, is_strict, preserve_odata_id_strings):
+    """
+    Encodes the elements of a large array by splitting them into contiguous slices that are encoded by a pool of
+    worker processes. The encoded slices are written to output_stream in element order.
+
+    Resource links that are new to the PDR map are numbered here in element order. A slice whose worker numbered a
+    new link differently (because an earlier slice added links too) is encoded again once the PDR map is complete.
+    """
+    global current_available_pdr, parallel_array_pool
+    if parallel_array_pool is None:
+        parallel_array_pool = ProcessPoolExecutor(max_workers=parallel_array_workers,
+                                                  initializer=bej_encode_parallel_worker_init,
+                                                  initargs=(schema_dict, annot_dict, fixed_integer_length))
+
+    is_annotation = dict_to_use is annot_dict
+    slices = split_array_range(len(json_value), parallel_array_workers)
+
+    def submit_slice(start, end):
+        return parallel_array_pool.submit(bej_encode_array_slice, is_annotation, array_dict_entry,
+                                          json_value[start:end], start, selector, pdr_map, current_available_pdr,
+                                          verbose, is_strict, preserve_odata_id_strings)
+
+    encoded_slices = []
+    for future in [submit_slice(start, end) for start, end in slices]:
+        success, encoded_bytes, new_links = future.result()
+        if not success:
+            return False
+
+        for link, pdr in new_links:
+            if link not in pdr_map:
+                pdr_map[link] = current_available_pdr
+                current_available_pdr += 1
+            if pdr_map[link] != pdr:
+                encoded_bytes = None
+        encoded_slices.append(encoded_bytes)
+
+    # every link of the array is in the PDR map now, so these slices cannot add new ones
+    retries = {index: submit_slice(*slices[index])
+               for index, encoded_bytes in enumerate(encoded_slices) if encoded_bytes is None}
+    for index, future in retries.items():
+        success, encoded_slices[index], new_links = future.result()
+        if not success:
+            return False
+
+    for encoded_bytes in encoded_slices:
+        output_stream.write(encoded_bytes)
+
+    return True
+
+
 def bej_encode_sflv(output_stream, schema_dict, annot_dict, dict_to_use, dict_entry, seq, format, json_value,
                     pdr_map, format_flags, verbose, is_strict, preserve_odata_id_strings):
     success = True
@@ -469,12 +681,23 @@ def bej_encode_sflv(output_stream, schema_dict, annot_dict, dict_to_use, dict_en
 
         nested_stream = bej_pack_array_start(output_stream, count)
         tmp_seq, selector = bej_decode_sequence_number(seq)
-        for i in range(0, count):
-            success = bej_encode_sflv(nested_stream, schema_dict, annot_dict, dict_to_use, array_dict_entry,
-                                      (i << 1) | selector, array_dict_entry[DICTIONARY_ENTRY_FORMAT],
-                                      json_value[i], pdr_map, 0, verbose, is_strict, preserve_odata_id_strings)
-            if not success:
-                break
+        packed_array = None
+        if np is not None and count >= VECTORIZED_ARRAY_THRESHOLD:
+            packed_array = bej_pack_numeric_array(array_dict_entry[DICTIONARY_ENTRY_FORMAT], json_value, selector)
+
+        if packed_array is not None:
+            nested_stream.write(packed_array)
+        elif parallel_array_workers > 1 and count >= parallel_array_threshold:
+            success = bej_encode_array_parallel(nested_stream, schema_dict, annot_dict, dict_to_use,
+                                                array_dict_entry, json_value, selector, pdr_map, verbose, is_strict,
+                                                preserve_odata_id_strings)
+        else:
+            for i in range(0, count):
+                success = bej_encode_sflv(nested_stream, schema_dict, annot_dict, dict_to_use, array_dict_entry,
+                                          (i << 1) | selector, array_dict_entry[DICTIONARY_ENTRY_FORMAT],
+                                          json_value[i], pdr_map, 0, verbose, is_strict, preserve_odata_id_strings)
+                if not success:
+                    break
 
         bej_pack_array_done(nested_stream, seq, format_flags)
 
@@ -628,7 +851,8 @@ def bej_action_encode(output_stream, json_data, schema_dict, annot_dict, action_
 
 
 def bej_encode(output_stream, json_data, schema_dict, annot_dict, verbose=False, resource_link_to_pdr_map=None,
-               version=None, preserve_odata_id_strings=False, fixed_int_len=0):
+               version=None, preserve_odata_id_strings=False, fixed_int_len=0, parallel_workers=0,
+               parallel_threshold=PARALLEL_ARRAY_THRESHOLD):
     """
     BEJ encode JSON data into an output stream
 
@@ -639,13 +863,17 @@ def bej_encode(output_stream, json_data, schema_dict, annot_dict, verbose=False,
         annot_dict: The RDE annotation dictionary to use to encode the BEJ
         resource_link_to_pdr_map: Map of uri to resource id
         bej_version: BEJ version to use in payload
+        parallel_workers: Number of worker processes used to encode large arrays, 0 or 1 encodes serially
+        parallel_threshold: Minimum number of elements in an array before it is split across the worker processes
 
     Return:
         Returns a tuple (True, pdr_map) to indicate success, (False, None) otherwise.
     """
 
-    global fixed_integer_length
+    global fixed_integer_length, parallel_array_workers, parallel_array_threshold, parallel_array_pool
     fixed_integer_length = fixed_int_len
+    parallel_array_workers = parallel_workers
+    parallel_array_threshold = parallel_threshold
     bej_version = 0xF1F0F000
     pdr_map = {}
     is_strict = False
@@ -663,8 +891,13 @@ def bej_encode(output_stream, json_data, schema_dict, annot_dict, verbose=False,
     new_stream = bej_pack_set_start(output_stream, len(json_data))
     dict_stream = DictionaryByteArrayStream(schema_dict)
     entry = dict_stream.get_next_entry()
-    success = bej_encode_stream(new_stream, json_data, schema_dict, annot_dict, schema_dict, pdr_map, entry[DICTIONARY_ENTRY_OFFSET],
-                                entry[DICTIONARY_ENTRY_CHILD_COUNT], verbose, is_strict, preserve_odata_id_strings)
+    try:
+        success = bej_encode_stream(new_stream, json_data, schema_dict, annot_dict, schema_dict, pdr_map, entry[DICTIONARY_ENTRY_OFFSET],
+                                    entry[DICTIONARY_ENTRY_CHILD_COUNT], verbose, is_strict, preserve_odata_id_strings)
+    finally:
+        if parallel_array_pool:
+            parallel_array_pool.shutdown()
+            parallel_array_pool = None
     if success:
         bej_pack_set_done(new_stream, 0)
     return success, pdr_map
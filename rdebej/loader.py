@@ -0,0 +1,586 @@
+#! /usr/bin/python3
+# Copyright Notice:
+# Copyright 2018-2019 DMTF. All rights reserved.
+# License: BSD 3-Clause License. For full text see link: https://github.com/DMTF/RDE-Dictionary/blob/master/LICENSE.md
+
+"""
+rdebej.loader
+~~~~~~~~~~~~~~
+Loads binary dictionaries for the encoder and decoder without copying them into Python objects
+"""
+
+import array
+import binascii
+import fnmatch
+import mmap
+import os
+import re
+import struct
+import threading
+from collections import namedtuple, OrderedDict
+from ._internal_utils import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Fields of a dictionary entry, in the order of DICTIONARY_ENTRY_STRUCT
+DICTIONARY_ENTRY_FIELDS = ('format_flags', 'sequence', 'offset', 'child_count', 'name_length', 'name_offset')
+
+if np is not None:
+    # The packed entry table, 10 bytes per entry, viewed in place by BinaryDictionary.get_entry_table()
+    DICTIONARY_ENTRY_DTYPE = np.dtype([('format_flags', 'u1'), ('sequence', '<u2'), ('offset', '<u2'),
+                                       ('child_count', '<u2'), ('name_length', 'u1'), ('name_offset', '<u2')])
+
+
+class BinaryDictionary:
+    """
+    A binary dictionary backed by a buffer, usually a read-only memory map of a dictionary file, so that loaded
+    dictionaries only cost their page cache. Entries are unpacked straight from the buffer, the entries of a set are
+    indexed the first time the set is used and names are decoded once.
+
+    A BinaryDictionary can be passed to bej_encode()/bej_decode() anywhere a dictionary byte array is expected.
+    """
+    def __init__(self, buffer, path=None):
+        """
+        Args:
+            buffer: The dictionary bytes, any object that supports the buffer protocol
+            path: The file the dictionary was loaded from, if any. Worker processes reload the dictionary from it.
+
+        Raises:
+            ValueError: The header does not match the size of the dictionary
+        """
+        self._buffer = buffer
+        self.path = path
+
+        if len(buffer) < DICTIONARY_HEADER_STRUCT.size:
+            raise ValueError('Dictionary is too short for a header: {0} bytes'.format(len(buffer)))
+        self.version_tag, self.dictionary_flags, self.entry_count, self.schema_version, self.dictionary_size = \
+            DICTIONARY_HEADER_STRUCT.unpack_from(buffer, 0)
+        if self.dictionary_size != len(buffer):
+            raise ValueError('DictionarySize {0} does not match the dictionary size {1}'.format(
+                self.dictionary_size, len(buffer)))
+        if DICTIONARY_HEADER_STRUCT.size + self.entry_count * DICTIONARY_ENTRY_STRUCT.size > len(buffer):
+            raise ValueError('EntryCount {0} does not fit in the dictionary'.format(self.entry_count))
+
+        self.entry_table_end = DICTIONARY_HEADER_STRUCT.size + self.entry_count * DICTIONARY_ENTRY_STRUCT.size
+
+        self._entry_table = None
+        self._rows = None
+        self._names = {}  # (name offset, name length) to the decoded name
+        self._entries_by_name = {}  # (offset, child count) to the entries of a set keyed by name
+        self._entries_by_sequence = {}  # (offset, child count) to the entries of a set keyed by sequence number
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def __getitem__(self, key):
+        return self._buffer[key]
+
+    def __reduce__(self):
+        if self.path is not None:
+            return load_binary_dictionary, (self.path,)
+        return BinaryDictionary, (bytes(self._buffer),)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Unmaps the dictionary. An entry table from get_entry_table() that a caller still holds views the memory map
+        with NumPy, the map is then left open and unmapped once the last view of it is released.
+        """
+        self._entry_table = None  # release the view of the buffer before unmapping it
+        if isinstance(self._buffer, mmap.mmap):
+            try:
+                self._buffer.close()
+            except BufferError:
+                # still exported, the mmap unmaps itself when it is garbage collected
+                pass
+
+    def get_entry_table(self):
+        """
+        Returns the entry table indexed by the names in DICTIONARY_ENTRY_FIELDS. With NumPy this is a structured array
+        that views the buffer without copying it, otherwise a dict of field name to an array.array column.
+        """
+        if self._entry_table is None:
+            if np is not None:
+                self._entry_table = np.frombuffer(self._buffer, dtype=DICTIONARY_ENTRY_DTYPE, count=self.entry_count,
+                                                  offset=DICTIONARY_HEADER_STRUCT.size)
+            else:
+                columns = list(zip(*DICTIONARY_ENTRY_STRUCT.iter_unpack(
+                    self._buffer[DICTIONARY_HEADER_STRUCT.size:self.entry_table_end])))
+                if not columns:
+                    columns = [()] * len(DICTIONARY_ENTRY_FIELDS)
+                self._entry_table = {field: array.array('B' if field in ('format_flags', 'name_length') else 'H',
+                                                        column)
+                                     for field, column in zip(DICTIONARY_ENTRY_FIELDS, columns)}
+        return self._entry_table
+
+    def get_rows(self):
+        """
+        Returns all the entries of the entry table, in the form of get_entry(), unpacked in one pass
+        """
+        if self._rows is None:
+            self._rows = [DictionaryEntry(format_flags >> 4, format_flags & 0xF, sequence, offset, child_count,
+                                          self.get_name(name_offset, name_length))
+                          for format_flags, sequence, offset, child_count, name_length, name_offset
+                          in DICTIONARY_ENTRY_STRUCT.iter_unpack(
+                              self._buffer[DICTIONARY_HEADER_STRUCT.size:self.entry_table_end])]
+        return self._rows
+
+    def get_sets(self):
+        """
+        Returns the sorted (offset, child count) of every set of child entries referenced by the entry table
+        """
+        table = self.get_entry_table()
+        if np is not None:
+            has_children = (table['child_count'] > 0) & (table['offset'] != 0)
+            keys = np.unique((table['offset'][has_children].astype(np.uint32) << 16)
+                             | table['child_count'][has_children])
+            return [(int(key) >> 16, int(key) & 0xFFFF) for key in keys]
+        return sorted({(offset, child_count) for offset, child_count in zip(table['offset'], table['child_count'])
+                       if child_count > 0 and offset != 0})
+
+    def build_indexes(self):
+        """
+        Indexes every set of the dictionary by name and by sequence number up front instead of on first use
+        """
+        rows = self.get_rows()
+        entries_by_name = {}
+        entries_by_sequence = {}
+        for offset, child_count in self.get_sets():
+            first = (offset - DICTIONARY_HEADER_STRUCT.size) // DICTIONARY_ENTRY_STRUCT.size
+            entries = rows[first:first + child_count]
+            entries_by_name[(offset, child_count)] = {entry[DICTIONARY_ENTRY_NAME]: entry for entry in entries}
+            entries_by_sequence[(offset, child_count)] = \
+                {entry[DICTIONARY_ENTRY_SEQUENCE_NUMBER]: entry for entry in entries}
+        with self._lock:
+            for key, entries in entries_by_name.items():
+                self._entries_by_name.setdefault(key, entries)
+            for key, entries in entries_by_sequence.items():
+                self._entries_by_sequence.setdefault(key, entries)
+
+    def validate(self):
+        """
+        Checks that every child offset points at whole entries inside the entry table and that every name lies in
+        the name table and is null terminated
+
+        Raises:
+            ValueError: Lists the rows with invalid offsets or names
+        """
+        table = self.get_entry_table()
+        if np is not None:
+            offsets = table['offset'].astype(np.int64)
+            child_counts = table['child_count'].astype(np.int64)
+            name_offsets = table['name_offset'].astype(np.int64)
+            name_lengths = table['name_length'].astype(np.int64)
+            has_children = (child_counts > 0) & (offsets != 0)
+            bad_children = has_children & ((offsets < DICTIONARY_HEADER_STRUCT.size)
+                                           | ((offsets - DICTIONARY_HEADER_STRUCT.size)
+                                              % DICTIONARY_ENTRY_STRUCT.size != 0)
+                                           | (offsets + child_counts * DICTIONARY_ENTRY_STRUCT.size
+                                              > self.entry_table_end))
+            name_ends = name_offsets + name_lengths
+            has_name = name_lengths > 0
+            bad_names = has_name & ((name_offsets < self.entry_table_end) | (name_ends > self.dictionary_size))
+            buffer = np.frombuffer(self._buffer, dtype=np.uint8)
+            terminated = has_name & ~bad_names
+            bad_names[terminated] = buffer[name_ends[terminated] - 1] != 0
+            bad_rows = np.flatnonzero(bad_children | bad_names).tolist()
+        else:
+            bad_rows = []
+            for row, (offset, child_count, name_offset, name_length) in enumerate(zip(
+                    table['offset'], table['child_count'], table['name_offset'], table['name_length'])):
+                if child_count > 0 and offset != 0 and (
+                        offset < DICTIONARY_HEADER_STRUCT.size
+                        or (offset - DICTIONARY_HEADER_STRUCT.size) % DICTIONARY_ENTRY_STRUCT.size != 0
+                        or offset + child_count * DICTIONARY_ENTRY_STRUCT.size > self.entry_table_end):
+                    bad_rows.append(row)
+                elif name_length > 0 and (
+                        name_offset < self.entry_table_end or name_offset + name_length > self.dictionary_size
+                        or self._buffer[name_offset + name_length - 1] != 0):
+                    bad_rows.append(row)
+
+        if bad_rows:
+            raise ValueError('Invalid child offset or name in rows: {0}'.format(
+                ', '.join(map(str, bad_rows[:10])) + (', ...' if len(bad_rows) > 10 else '')))
+
+    def get_statistics(self):
+        """
+        Returns a dict of statistics of the entry table: the number of entries of each BEJ format, the number of sets,
+        the largest set, the number of unique names and the size of the name table
+        """
+        table = self.get_entry_table()
+        if np is not None:
+            format_counts = np.bincount(table['format_flags'] >> 4, minlength=16)
+            format_counts = {bej_format: int(count) for bej_format, count in enumerate(format_counts) if count}
+            named = table['name_length'] > 0
+            unique_names = len(np.unique(table['name_offset'][named]))
+            name_table_end = int((table['name_offset'][named].astype(np.int64)
+                                  + table['name_length'][named]).max()) if named.any() else self.entry_table_end
+            max_child_count = int(table['child_count'].max()) if self.entry_count else 0
+        else:
+            format_counts = {}
+            for format_flags in table['format_flags']:
+                format_counts[format_flags >> 4] = format_counts.get(format_flags >> 4, 0) + 1
+            format_counts = dict(sorted(format_counts.items()))
+            names = {(name_offset, name_length) for name_offset, name_length
+                     in zip(table['name_offset'], table['name_length']) if name_length > 0}
+            unique_names = len({name_offset for name_offset, name_length in names})
+            name_table_end = max([name_offset + name_length for name_offset, name_length in names],
+                                 default=self.entry_table_end)
+            max_child_count = max(table['child_count'], default=0)
+
+        return {
+            'entry_count': self.entry_count,
+            'format_counts': format_counts,
+            'set_count': len(self.get_sets()),
+            'max_child_count': max_child_count,
+            'unique_names': unique_names,
+            'name_table_size': name_table_end - self.entry_table_end
+        }
+
+    def get_name(self, name_offset, name_length):
+        """
+        Returns the name at name_offset, without its null terminator
+        """
+        key = (name_offset, name_length)
+        name = self._names.get(key)
+        if name is None:
+            name = ''
+            if name_length > 0:
+                name = get_dictionary_name(bytes(self._buffer[name_offset:name_offset+name_length-1]))
+            self._names[key] = name
+        return name
+
+    def get_entry(self, offset):
+        """
+        Returns the entry at offset in the same form as DictionaryByteArrayStream.get_next_entry()
+        """
+        format_flags, sequence, child_offset, child_count, name_length, name_offset = \
+            DICTIONARY_ENTRY_STRUCT.unpack_from(self._buffer, offset)
+        return DictionaryEntry(format_flags >> 4, format_flags & 0xF, sequence, child_offset, child_count,
+                               self.get_name(name_offset, name_length))
+
+    def get_entries(self, offset, child_count):
+        """
+        Returns the child_count entries that start at offset. Like DictionaryByteArrayStream, offset 0 is the root
+        entry that follows the header.
+        """
+        if offset == 0:
+            offset = DICTIONARY_HEADER_STRUCT.size
+            child_count = 1
+        return [self.get_entry(offset + i * DICTIONARY_ENTRY_STRUCT.size) for i in range(child_count)]
+
+    def get_entries_by_name(self, offset, child_count):
+        """
+        Returns a dict of name to entry for a set. The dict is shared and must not be modified.
+        """
+        key = (offset, child_count)
+        entries = self._entries_by_name.get(key)
+        if entries is None:
+            entries = {entry[DICTIONARY_ENTRY_NAME]: entry for entry in self.get_entries(offset, child_count)}
+            with self._lock:
+                entries = self._entries_by_name.setdefault(key, entries)
+        return entries
+
+    def get_entries_by_sequence(self, offset, child_count):
+        """
+        Returns a dict of sequence number to entry for a set. The dict is shared and must not be modified.
+        """
+        key = (offset, child_count)
+        entries = self._entries_by_sequence.get(key)
+        if entries is None:
+            entries = {entry[DICTIONARY_ENTRY_SEQUENCE_NUMBER]: entry for entry in self.get_entries(offset, child_count)}
+            with self._lock:
+                entries = self._entries_by_sequence.setdefault(key, entries)
+        return entries
+
+
+def load_binary_dictionary(file):
+    """
+    Loads a binary dictionary file. Regular files are memory-mapped, anything else (e.g. a pipe) is read.
+
+    Args:
+        file: Path or binary file object of the dictionary
+
+    Return:
+        BinaryDictionary
+    """
+    if isinstance(file, str):
+        with open(file, 'rb') as dictionary_file:
+            return load_binary_dictionary(dictionary_file)
+
+    path = getattr(file, 'name', None)
+    try:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, AttributeError):
+        # not a regular file or an empty one
+        buffer = file.read()
+        path = None
+
+    return BinaryDictionary(buffer, path if isinstance(path, str) else None)
+
+
+# Default number of bytes of dictionaries a DictionaryRegistry keeps loaded
+DEFAULT_REGISTRY_MEMORY_BUDGET = 64 * 1024 * 1024
+
+ANNOTATION_DICTIONARY_ENTITY = 'Annotations'
+
+REDFISH_VERSION_REGEX = re.compile(r'^v(\d+)_(\d+)_(\d+)$')
+
+DictionaryInfo = namedtuple('DictionaryInfo', 'path entity schema_version crc size')
+
+
+def get_version_tuple(ver32):
+    """
+    Returns the (major, minor, errata) of a PLDM ver32, or None if the ver32 is un-versioned (0xFFFFFFFF)
+    """
+    if ver32 == 0xFFFFFFFF:
+        return None
+    version = []
+    for b in ver32.to_bytes(4, 'big')[:3]:
+        if b & 0xf0 == 0xf0:
+            version.append(b & 0x0f)
+        else:
+            version.append(((b & 0xf0) >> 4) * 10 + (b & 0x0f))
+    return tuple(version)
+
+
+def parse_schema_type(schema_type):
+    """
+    Splits an @odata.type (e.g. #Drive.v1_3_0.Drive) or a schema URL (e.g.
+    http://redfish.dmtf.org/schemas/v1/Drive.v1_3_0.json) into the entity name and version
+
+    Return:
+        (entity, (major, minor, errata)), the version is None for un-versioned types
+    """
+    if not schema_type.startswith('#'):
+        schema_type = schema_type.split('#')[0]  # drop the JSON pointer of a schema URL
+    name = schema_type.lstrip('#').rstrip('/').split('/')[-1]
+    if name.endswith('.json'):
+        name = name[:-len('.json')]
+
+    entity = None
+    version = None
+    for part in name.split('.'):
+        m = REDFISH_VERSION_REGEX.match(part)
+        if m:
+            version = tuple(int(i) for i in m.groups())
+        elif part:
+            entity = part
+    if entity is None:
+        raise ValueError('No entity in schema type: {0}'.format(schema_type))
+    return entity, version
+
+
+def select_dictionary_info(candidates, version=None):
+    """
+    Selects the dictionary for a version among the DictionaryInfos of an entity. Redfish minor versions only add
+    properties, so the oldest dictionary with the same major version that is not older than version is used, falling
+    back to the newest of the major version. Without a version the newest dictionary is used.
+
+    Args:
+        candidates: DictionaryInfos of the same entity
+        version: (major, minor, errata), a Redfish version string (e.g. v1_3_0) or None
+
+    Return:
+        DictionaryInfo or None
+    """
+    if isinstance(version, str):
+        m = REDFISH_VERSION_REGEX.match(version)
+        version = tuple(int(i) for i in m.groups()) if m else None
+
+    if not candidates:
+        return None
+
+    versioned = sorted((get_version_tuple(info.schema_version), info) for info in candidates
+                       if get_version_tuple(info.schema_version) is not None)
+    unversioned = [info for info in candidates if get_version_tuple(info.schema_version) is None]
+
+    if version is None:
+        return versioned[-1][1] if versioned else unversioned[0]
+
+    for info_version, info in versioned:
+        if info_version == version:
+            return info
+    same_major = [(info_version, info) for info_version, info in versioned if info_version[0] == version[0]]
+    newer = [info for info_version, info in same_major if info_version >= version]
+    if newer:
+        return newer[0]
+    if same_major:
+        return same_major[-1][1]
+    return unversioned[0] if unversioned else None
+
+
+def read_dictionary_info(path):
+    """
+    Reads the header, root entry name and CRC of a binary dictionary file. The whole file is read for its CRC, but it
+    is not kept loaded.
+
+    Raises:
+        ValueError: The file is not a binary dictionary or has no root entry
+    """
+    with open(path, 'rb') as file:
+        contents = file.read()
+    header = BinaryDictionary(contents)
+    if header.entry_count == 0:
+        raise ValueError('Dictionary {0} has no entries'.format(path))
+    root = header.get_entries(0, 1)[0]
+    return DictionaryInfo(path, root[DICTIONARY_ENTRY_NAME], header.schema_version, binascii.crc32(contents),
+                          header.dictionary_size)
+
+
+class DictionaryRegistry:
+    """
+    An index of the binary dictionaries in one or more directories (e.g. the output of generate_dictionaries.py) by
+    entity name, SchemaVersion and CRC. Dictionaries are loaded the first time they are resolved and the least
+    recently used ones are dropped once the loaded dictionaries exceed the memory budget.
+    """
+    def __init__(self, directories=None, memory_budget=DEFAULT_REGISTRY_MEMORY_BUDGET):
+        """
+        Args:
+            directories: Directory or list of directories to index
+            memory_budget: Number of bytes of dictionaries to keep loaded
+        """
+        self.memory_budget = memory_budget
+        self._infos = {}  # path to DictionaryInfo
+        self._by_entity = {}  # entity name to its DictionaryInfos
+        self._by_crc = {}  # CRC to DictionaryInfo
+        self._loaded = OrderedDict()  # path to BinaryDictionary, least recently used first
+        self._loaded_size = 0
+        self._lock = threading.RLock()
+
+        if isinstance(directories, str):
+            directories = [directories]
+        for directory in directories or []:
+            self.add_directory(directory)
+
+    def __len__(self):
+        return len(self._infos)
+
+    def __iter__(self):
+        return iter(list(self._infos.values()))
+
+    @property
+    def loaded_size(self):
+        return self._loaded_size
+
+    def add_directory(self, directory, pattern='*.bin'):
+        """
+        Indexes the dictionaries in a directory. Files that are not binary dictionaries are skipped.
+
+        Return:
+            List of the DictionaryInfo of the dictionaries added
+        """
+        infos = []
+        for file_name in sorted(fnmatch.filter(os.listdir(directory), pattern)):
+            try:
+                infos.append(self.add_file(os.path.join(directory, file_name)))
+            except (OSError, ValueError, struct.error):
+                continue
+        return infos
+
+    def add_file(self, path):
+        """
+        Indexes a dictionary file, replacing the previous index of the same file
+
+        Return:
+            DictionaryInfo
+        """
+        info = read_dictionary_info(path)
+        with self._lock:
+            self.remove_file(path)
+            self._infos[path] = info
+            self._by_entity.setdefault(info.entity, []).append(info)
+            self._by_crc[info.crc] = info
+        return info
+
+    def remove_file(self, path):
+        with self._lock:
+            info = self._infos.pop(path, None)
+            if info is None:
+                return
+            self._by_entity[info.entity].remove(info)
+            if not self._by_entity[info.entity]:
+                del self._by_entity[info.entity]
+            if self._by_crc.get(info.crc) is info:
+                del self._by_crc[info.crc]
+            self._unload(path)
+
+    def find(self, entity, version=None):
+        """
+        Finds the dictionary for an entity, see select_dictionary_info()
+
+        Args:
+            entity: Entity name, the name of the dictionary root (e.g. Drive)
+            version: (major, minor, errata) or a Redfish version string (e.g. v1_3_0)
+
+        Return:
+            DictionaryInfo or None
+        """
+        with self._lock:
+            candidates = list(self._by_entity.get(entity, []))
+        return select_dictionary_info(candidates, version)
+
+    def find_by_crc(self, crc):
+        with self._lock:
+            return self._by_crc.get(crc)
+
+    def resolve(self, schema_type):
+        """
+        Returns the dictionary for an @odata.type or schema URL, loading it if needed
+
+        Raises:
+            KeyError: No dictionary is indexed for the schema type
+        """
+        entity, version = parse_schema_type(schema_type)
+        info = self.find(entity, version)
+        if info is None:
+            raise KeyError('No dictionary for {0}'.format(schema_type))
+        return self.get_dictionary(info)
+
+    def get_annotation_dictionary(self, version=None):
+        info = self.find(ANNOTATION_DICTIONARY_ENTITY, version)
+        if info is None:
+            raise KeyError('No annotation dictionary')
+        return self.get_dictionary(info)
+
+    def get_dictionary(self, info):
+        """
+        Returns the loaded dictionary of a DictionaryInfo, a path or a CRC, loading it if needed. Loading a dictionary
+        drops the least recently used ones that no longer fit in the memory budget. A dropped dictionary stays valid
+        for the callers that still hold it.
+        """
+        if isinstance(info, int):
+            crc = info
+            info = self.find_by_crc(crc)
+            if info is None:
+                raise KeyError('No dictionary with CRC {0}'.format(hex(crc)))
+        path = info.path if isinstance(info, DictionaryInfo) else info
+
+        with self._lock:
+            binary_dictionary = self._loaded.get(path)
+            if binary_dictionary is not None:
+                self._loaded.move_to_end(path)
+                return binary_dictionary
+
+            if path not in self._infos:
+                self.add_file(path)
+            binary_dictionary = load_binary_dictionary(path)
+            self._loaded[path] = binary_dictionary
+            self._loaded_size += len(binary_dictionary)
+            while self._loaded_size > self.memory_budget and len(self._loaded) > 1:
+                self._unload(next(iter(self._loaded)))
+            return binary_dictionary
+
+    def _unload(self, path):
+        binary_dictionary = self._loaded.pop(path, None)
+        if binary_dictionary is not None:
+            self._loaded_size -= len(binary_dictionary)
@@ -15,13 +15,15 @@ from utils import *
 import shutil
 import stat
 import traceback
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 import requests
 import zipfile
 
 sys.path.append('./')
 
 from rdebej import dictionary
-from rdebej import encode, decode
+from rdebej import encode, decode, loader, bundle
 
 
 COPYRIGHT = 'Copyright (c) 2018 DMTF'
@@ -61,6 +63,45 @@ MAJOR_SCHEMA_DICTIONARY_LIST = [
                                     'test/dummysimple2.json',
                                     'Copyright (c) 2018 Acme Corp'),
 
+                                # property annotations of properties that are not in the payload themselves
+                                TestSpecification(
+                                    'test/schema/dummysimple/csdl',
+                                    'test/schema/dummysimple/json-schema',
+                                    'DummySimple_v1.xml',
+                                    'DummySimple.DummySimple',
+                                    '',
+                                    '',
+                                    '',
+                                    'DummySimple.bin',
+                                    'test/dummysimple3.json',
+                                    'Copyright (c) 2018 Acme Corp'),
+
+                                # two enums with the same members, stored once with shared subtrees
+                                TestSpecification(
+                                    'test/schema/dummysimple/csdl',
+                                    'test/schema/dummysimple/json-schema',
+                                    'DummySimple_v1.xml',
+                                    'DummySimple.DummySimple',
+                                    '',
+                                    '',
+                                    '',
+                                    'DummySimple.bin',
+                                    'test/dummysimple_shared.json',
+                                    'Copyright (c) 2018 Acme Corp'),
+
+                                # integer and real arrays long enough to take the vectorized numeric array path
+                                TestSpecification(
+                                    'test/schema/dummysimple/csdl',
+                                    'test/schema/dummysimple/json-schema',
+                                    'DummySimple_v1.xml',
+                                    'DummySimple.DummySimple',
+                                    '',
+                                    '',
+                                    '',
+                                    'DummySimple.bin',
+                                    'test/dummysimple_numeric_arrays.json',
+                                    'Copyright (c) 2018 Acme Corp'),
+
                                 TestSpecification(
                                     '$csdl_dir test/schema/oem-csdl',
                                     '$json_schema_dir',
@@ -354,6 +395,7 @@ if __name__ == '__main__':
         bej_stream = io.BytesIO()
 
         json_to_encode = json.load(open(major_schema.input_encode_filename))
+        first_available_pdr = encode.current_available_pdr
         encode_success, pdr_map = encode.bej_encode(
                                         bej_stream,
                                         json_to_encode,
@@ -370,6 +412,19 @@ if __name__ == '__main__':
         encoded_bytes = bej_stream.getvalue()
         encode.print_encode_summary(json_to_encode, encoded_bytes)
 
+        # splitting arrays across worker processes must not change the encoding
+        encode.current_available_pdr = first_available_pdr
+        parallel_bej_stream = io.BytesIO()
+        encode_success, parallel_pdr_map = encode.bej_encode(
+                                        parallel_bej_stream,
+                                        json_to_encode,
+                                        schema_dictionary.dictionary_byte_array,
+                                        annotation_dictionary.dictionary_byte_array,
+                                        parallel_workers=2, parallel_threshold=2
+                                    )
+        assert encode_success and parallel_bej_stream.getvalue() == encoded_bytes \
+            and parallel_pdr_map == pdr_map, 'Parallel encode mismatch'
+
         decode_stream = io.StringIO()
         decode_success = decode.bej_decode(
                                         decode_stream,
@@ -382,6 +437,227 @@ if __name__ == '__main__':
 
         decode_file = decode_stream.getvalue()
 
+        # splitting arrays across worker processes must not change the decoding
+        parallel_decode_stream = io.StringIO()
+        decode_success = decode.bej_decode(
+                                        parallel_decode_stream,
+                                        io.BytesIO(bytes(encoded_bytes)),
+                                        schema_dictionary.dictionary_byte_array,
+                                        annotation_dictionary.dictionary_byte_array,
+                                        error_schema_dictionary, pdr_map, deferred_binding_strings,
+                                        parallel_workers=2, parallel_threshold=2
+                                    )
+        assert decode_success and parallel_decode_stream.getvalue() == decode_file, 'Parallel decode mismatch'
+
+        # packing numeric arrays with NumPy must not change the encoding
+        numpy_module = encode.np
+        try:
+            encode.np = None
+            encode.current_available_pdr = first_available_pdr
+            scalar_bej_stream = io.BytesIO()
+            encode_success, scalar_pdr_map = encode.bej_encode(
+                                        scalar_bej_stream,
+                                        json_to_encode,
+                                        schema_dictionary.dictionary_byte_array,
+                                        annotation_dictionary.dictionary_byte_array
+                                    )
+        finally:
+            encode.np = numpy_module
+        assert encode_success and scalar_bej_stream.getvalue() == encoded_bytes \
+            and scalar_pdr_map == pdr_map, 'Scalar encode mismatch'
+
+        # decoding numeric arrays in bulk, with NumPy or with the array.array fallback, must not change the decoding
+        for numpy_module in [decode.np, None]:
+            decode_numpy_module = decode.np
+            try:
+                decode.np = numpy_module
+                numeric_decode_stream = io.StringIO()
+                decode_success = decode.bej_decode(
+                                        numeric_decode_stream,
+                                        io.BytesIO(bytes(encoded_bytes)),
+                                        schema_dictionary.dictionary_byte_array,
+                                        annotation_dictionary.dictionary_byte_array,
+                                        error_schema_dictionary, pdr_map, deferred_binding_strings,
+                                        numeric_arrays=True
+                                    )
+                assert decode_success and numeric_decode_stream.getvalue() == decode_file, \
+                    'Numeric array decode mismatch'
+
+                decode_success, numeric_decoded_object = decode.bej_decode_object(
+                                        io.BytesIO(bytes(encoded_bytes)),
+                                        schema_dictionary.dictionary_byte_array,
+                                        annotation_dictionary.dictionary_byte_array,
+                                        error_schema_dictionary, pdr_map, deferred_binding_strings,
+                                        numeric_arrays=True
+                                    )
+            finally:
+                decode.np = decode_numpy_module
+            assert decode_success and json.loads(json.dumps(numeric_decoded_object, default=lambda value: value.tolist())) \
+                == json.loads(decode_file), \
+                'Numeric array object decode mismatch'
+
+        # decoding straight to Python objects must agree with the JSON text decoding
+        decode_success, decoded_object = decode.bej_decode_object(
+                                        io.BytesIO(bytes(encoded_bytes)),
+                                        schema_dictionary.dictionary_byte_array,
+                                        annotation_dictionary.dictionary_byte_array,
+                                        error_schema_dictionary, pdr_map, deferred_binding_strings
+                                    )
+        assert decode_success and decoded_object == json.loads(decode_file), 'Object decode mismatch'
+
+        # a batch of payloads decodes to columns whose validity marks the payloads that have the property: the
+        # second payload lacks the Id and the third one has another Id
+        column_payloads = [encoded_bytes]
+        for column_id in [None, json_to_encode['Id'] + ' 2']:
+            column_json = {name: value for name, value in json_to_encode.items() if name != 'Id'}
+            if column_id is not None:
+                column_json['Id'] = column_id
+            encode.current_available_pdr = first_available_pdr
+            column_bej_stream = io.BytesIO()
+            encode_success, column_pdr_map = encode.bej_encode(
+                                        column_bej_stream,
+                                        column_json,
+                                        schema_dictionary.dictionary_byte_array,
+                                        annotation_dictionary.dictionary_byte_array
+                                    )
+            assert encode_success and column_pdr_map == pdr_map, 'Column encode failure'
+            column_payloads.append(column_bej_stream.getvalue())
+
+        decode_success, decoded_columns = decode.bej_decode_columns(
+                                        [io.BytesIO(bytes(payload)) for payload in column_payloads],
+                                        schema_dictionary.dictionary_byte_array,
+                                        annotation_dictionary.dictionary_byte_array,
+                                        error_schema_dictionary, pdr_map, deferred_binding_strings
+                                    )
+        assert decode_success and decoded_columns.count == 3, 'Column decode failure'
+        id_values, id_validity = decoded_columns.columns['Id']
+        assert list(id_validity) == [True, False, True] \
+            and [id_values[0], id_values[2]] == [json_to_encode['Id'], json_to_encode['Id'] + ' 2'], \
+            'Column decode mismatch'
+        assert all(all(validity) for path, (values, validity) in decoded_columns.columns.items() if path != 'Id'), \
+            'Column validity mismatch'
+
+        # decoding with memory-mapped dictionaries must agree with the byte array decoding
+        with loader.load_binary_dictionary(major_schema.dictionary_filename) as loaded_schema_dictionary:
+            loaded_schema_dictionary.validate()
+            loaded_decode_stream = io.StringIO()
+            decode_success = decode.bej_decode(
+                                        loaded_decode_stream,
+                                        io.BytesIO(bytes(encoded_bytes)),
+                                        loaded_schema_dictionary,
+                                        loader.BinaryDictionary(annotation_dictionary.dictionary_byte_array),
+                                        error_schema_dictionary, pdr_map, deferred_binding_strings
+                                    )
+            assert decode_success and loaded_decode_stream.getvalue() == decode_file, 'Loaded dictionary mismatch'
+
+        # closing a dictionary whose entry table is still held must not fail, the table stays readable
+        loaded_schema_dictionary = loader.load_binary_dictionary(major_schema.dictionary_filename)
+        entry_table = loaded_schema_dictionary.get_entry_table()
+        loaded_schema_dictionary.close()
+        assert list(entry_table['sequence'][:1]) == [0], 'Entry table close mismatch'
+        del entry_table
+
+        # the registry indexes the dictionary by its root entity and resolves it from the @odata.type
+        registry = loader.DictionaryRegistry()
+        registry_info = registry.add_file(major_schema.dictionary_filename)
+        assert registry_info.entity == major_schema.entity.split('.')[-1] \
+            and registry.find_by_crc(registry_info.crc) == registry_info, 'Registry index mismatch'
+        if '@odata.type' in json_to_encode:
+            assert registry.resolve(json_to_encode['@odata.type']).path == major_schema.dictionary_filename, \
+                'Registry resolve mismatch'
+
+        # sharing identical subtrees must not change the encoding or the decoding
+        shared_dictionary = dictionary.generate_byte_array(
+                                        dictionary.share_identical_subtrees(schema_dictionary.dictionary),
+                                        int.from_bytes(schema_dictionary.dictionary_byte_array[4:8], 'little'),
+                                        False, None)
+        encode.current_available_pdr = first_available_pdr
+        shared_bej_stream = io.BytesIO()
+        encode_success, shared_pdr_map = encode.bej_encode(
+                                        shared_bej_stream,
+                                        json_to_encode,
+                                        shared_dictionary,
+                                        annotation_dictionary.dictionary_byte_array
+                                    )
+        assert encode_success and shared_bej_stream.getvalue() == encoded_bytes, 'Shared subtree encode mismatch'
+        shared_decode_stream = io.StringIO()
+        decode_success = decode.bej_decode(
+                                        shared_decode_stream,
+                                        io.BytesIO(bytes(encoded_bytes)),
+                                        shared_dictionary,
+                                        annotation_dictionary.dictionary_byte_array,
+                                        error_schema_dictionary, pdr_map, deferred_binding_strings
+                                    )
+        assert decode_success and shared_decode_stream.getvalue() == decode_file, 'Shared subtree decode mismatch'
+
+        # truncating a shared entity repo per profile matches building the profile on its own
+        if major_schema.profile:
+            profile_dictionaries = dictionary.generate_profile_schema_dictionaries(
+                csdl_dirs.split(),
+                json_schema__dirs.split(),
+                major_schema.entity,
+                major_schema.schema_filename,
+                [major_schema.profile],
+                major_schema.oem_entities.split(),
+                major_schema.oem_schema_filenames.split()
+            )
+            assert profile_dictionaries[major_schema.profile].dictionary_byte_array == \
+                schema_dictionary.dictionary_byte_array, 'Profile dictionary mismatch'
+
+        # adding the OEM extensions to a shared base entity repo matches building the combination on its own
+        if not major_schema.profile:
+            oem_dictionaries = dictionary.generate_oem_schema_dictionaries(
+                csdl_dirs.split(),
+                json_schema__dirs.split(),
+                major_schema.entity,
+                major_schema.schema_filename,
+                [([], []), (major_schema.oem_entities.split(), major_schema.oem_schema_filenames.split())]
+            )
+            assert oem_dictionaries[1].dictionary_byte_array == schema_dictionary.dictionary_byte_array, \
+                'OEM variant dictionary mismatch'
+
+        # a dictionary truncated to the payload still round trips it
+        corpus_dictionary = dictionary.generate_schema_dictionary(
+            'local',
+            csdl_dirs.split(),
+            json_schema__dirs.split(),
+            major_schema.entity,
+            major_schema.schema_filename,
+            major_schema.oem_entities.split(),
+            major_schema.oem_schema_filenames.split(),
+            major_schema.profile,
+            corpus=[major_schema.input_encode_filename]
+        )
+        encode.current_available_pdr = first_available_pdr
+        corpus_bej_stream = io.BytesIO()
+        encode_success, corpus_pdr_map = encode.bej_encode(
+                                        corpus_bej_stream,
+                                        json_to_encode,
+                                        corpus_dictionary.dictionary_byte_array,
+                                        annotation_dictionary.dictionary_byte_array
+                                    )
+        corpus_decode_stream = io.StringIO()
+        decode_success = encode_success and decode.bej_decode(
+                                        corpus_decode_stream,
+                                        io.BytesIO(corpus_bej_stream.getvalue()),
+                                        corpus_dictionary.dictionary_byte_array,
+                                        annotation_dictionary.dictionary_byte_array,
+                                        error_schema_dictionary, corpus_pdr_map, deferred_binding_strings
+                                    )
+        assert decode_success and corpus_decode_stream.getvalue() == decode_file, 'Corpus dictionary mismatch'
+        # no payload uses every property of its schema, and the truncation is recorded in DictionaryFlags
+        assert len(corpus_dictionary.dictionary) < len(schema_dictionary.dictionary) \
+            and corpus_dictionary.dictionary_byte_array[1] == 1, 'Corpus dictionary truncation mismatch'
+
+        # a bundle rebuilds the dictionary byte for byte, also from a buffer that is not bytes
+        dictionary_bundle = bundle.DictionaryBundle(memoryview(bundle.build_dictionary_bundle(
+            [(major_schema.dictionary_filename, schema_dictionary.dictionary_byte_array),
+             ('annotation.bin', annotation_dictionary.dictionary_byte_array)])))
+        assert dictionary_bundle.get_dictionary_bytes(major_schema.dictionary_filename) == \
+            bytes(schema_dictionary.dictionary_byte_array) \
+            and dictionary_bundle.get_dictionary_bytes('annotation.bin') == \
+            bytes(annotation_dictionary.dictionary_byte_array), 'Bundle mismatch'
+
         # compare the decode with the original
         print('Decoded JSON:')
         print(json.dumps(json.loads(decode_file), indent=3))
@@ -390,6 +666,46 @@ if __name__ == '__main__':
         # cleanup
         os.remove(major_schema.dictionary_filename)
 
+    # the enums of DummySimple that have the same members are only stored once with shared subtrees
+    dummy_simple_schema = MAJOR_SCHEMA_DICTIONARY_LIST[0]
+    dummy_simple_dictionaries = [dictionary.generate_schema_dictionary(
+                                    'local',
+                                    dummy_simple_schema.csdl_directories.split(),
+                                    dummy_simple_schema.json_schema_directories.split(),
+                                    dummy_simple_schema.entity,
+                                    dummy_simple_schema.schema_filename,
+                                    share_subtrees=share_subtrees
+                                ) for share_subtrees in [False, True]]
+    assert len(dummy_simple_dictionaries[1].dictionary) < len(dummy_simple_dictionaries[0].dictionary), \
+        'Shared subtree size mismatch'
+
+    # builders on several threads that share a SchemaSet with a cache directory agree with builds on their own
+    def build_major_schema_dictionary(major_schema, schema_set=None):
+        return bytes(dictionary.generate_schema_dictionary(
+            'local',
+            major_schema.csdl_directories.replace('$csdl_dir', csdl_dir).split(),
+            major_schema.json_schema_directories.replace('$json_schema_dir', json_schema_dir).split(),
+            major_schema.entity,
+            major_schema.schema_filename,
+            major_schema.oem_entities.split(),
+            major_schema.oem_schema_filenames.split(),
+            major_schema.profile,
+            schema_set=schema_set
+        ).dictionary_byte_array)
+
+    expected_dictionaries = [build_major_schema_dictionary(major_schema)
+                             for major_schema in MAJOR_SCHEMA_DICTIONARY_LIST]
+    cache_dir = tempfile.mkdtemp()
+    try:
+        shared_schema_set = dictionary.SchemaSet(cache_dir)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            threaded_dictionaries = list(executor.map(
+                lambda major_schema: build_major_schema_dictionary(major_schema, shared_schema_set),
+                MAJOR_SCHEMA_DICTIONARY_LIST * 4))
+        assert threaded_dictionaries == expected_dictionaries * 4, 'Threaded dictionary mismatch'
+    finally:
+        shutil.rmtree(cache_dir)
+
     # cleanup
     if delete_schema_test_dir:
         shutil.rmtree(schema_test_dir, onerror=onerror)